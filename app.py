@@ -5,7 +5,11 @@ import sys
 project_root = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(project_root)
 
-from src.app import app
+from src.app import app, init_app
+
+# Entry point for both `python app.py` and gunicorn (`app:server`); with
+# gunicorn's preload_app this runs once in the master before workers fork
+init_app()
 server = app.server
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+"""Time joining a contacts sheet with fund and portfolio-company sheets on upload.
+
+Usage: python benchmarks/bench_join.py [contacts]
+
+Merges contacts, funds keyed by fund id, and companies keyed by a column the
+funds sheet adds, the way the upload callback does: once as three CSV files and
+once as one workbook with three sheets. For the workbook, reading the contacts
+sheet alone is timed too, since openpyxl parsing dominates there.
+"""
+import base64
+import io
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openpyxl
+from src.utils.excel_parser import iter_upload_rows, read_workbook
+from src.utils.upload_join import merge_uploads
+
+FUNDS = 5000
+COMPANIES = 20000
+XLSX_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def make_tables(contacts):
+    return [
+        ("contacts", ["Email", "Last Name", "Fund ID"],
+         ([f"person{i}@example.com", f"Name{i}", i % FUNDS] for i in range(contacts))),
+        ("funds", ["Fund ID", "Fund Name", "Company ID"],
+         ([i, f"Fund {i}", i * 7 % COMPANIES] for i in range(FUNDS))),
+        ("companies", ["Company ID", "Port-Co"],
+         ([i, f"Company {i}"] for i in range(COMPANIES))),
+    ]
+
+def data_url(content_type, data):
+    return f"data:{content_type};base64,{base64.b64encode(data).decode()}"
+
+def make_csv_files(contacts):
+    files = []
+    for name, header, rows in make_tables(contacts):
+        lines = [",".join(header)] + [",".join(str(value) for value in row) for row in rows]
+        files.append((f"{name}.csv", data_url("text/csv", "\n".join(lines).encode())))
+    return files
+
+def make_workbook(contacts):
+    workbook = openpyxl.Workbook(write_only=True)
+    for name, header, rows in make_tables(contacts):
+        sheet = workbook.create_sheet(name)
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return [("contacts.xlsx", data_url(XLSX_TYPE, buffer.getvalue()))]
+
+def timed_merge(name, uploads):
+    start = time.perf_counter()
+    merged, report = merge_uploads(uploads)
+    elapsed = time.perf_counter() - start
+    print(f"{name:9s} merged {report['rows']} contacts with {FUNDS} funds and {COMPANIES} companies "
+          f"in {elapsed:.2f}s ({report['rows'] / elapsed:,.0f} rows/s)")
+    return merged
+
+if __name__ == '__main__':
+    contacts = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    merged = timed_merge("csv", make_csv_files(contacts))
+    df = read_workbook(merged)
+    print(f"merged upload: {len(df)} rows, columns {list(df.columns)}")
+
+    workbook = make_workbook(contacts)
+    start = time.perf_counter()
+    rows = sum(1 for _ in iter_upload_rows(workbook[0][1])) - 1
+    print(f"workbook  reading the {rows} rows of the contacts sheet alone: {time.perf_counter() - start:.2f}s")
+    timed_merge("workbook", workbook)
@@ -0,0 +1,67 @@
+"""Compare iterating recipients with DataFrame.iterrows against a RecipientStore.
+
+Usage: python benchmarks/bench_recipients.py [rows]
+
+Both loops do what the send loop needs per row: render the body and read the
+address. Memory is what tracemalloc sees allocated by the conversion plus the
+loop, with the source DataFrame already in memory.
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from src.utils.recipient_store import RecipientStore
+from src.utils.template_parser import compile_template
+
+TEMPLATE = "Dear {{X}},\n\nI'm reaching out regarding {{Y}} and its investment in {{Z}}.\n\nBest regards"
+MAPPING = {"Last Name": "X", "Fund Name": "Y", "Port-Co": "Z"}
+
+def make_frame(rows):
+    return pd.DataFrame({
+        "Email": [f"person{i}@example.com" for i in range(rows)],
+        "Last Name": [f"Name{i}" for i in range(rows)],
+        "Fund Name": [f"Fund {i % 50}" for i in range(rows)],
+        "Port-Co": [f"Company {i % 500}" for i in range(rows)],
+        "Notes": [f"Met at conference {i % 7}; follow up in Q{i % 4 + 1}" for i in range(rows)],
+        "Phone": [f"+1 555 {i:07d}" for i in range(rows)],
+    })
+
+def send_loop_iterrows(df):
+    """The previous send loop: one Series per row"""
+    compiled = compile_template(TEMPLATE, MAPPING, df.columns)
+    bodies = compiled.render_frame(df)
+    return [(index, row["Email"], body) for (index, row), body in zip(df.iterrows(), bodies)]
+
+def send_loop_store(df):
+    compiled = compile_template(TEMPLATE, MAPPING, df.columns)
+    store = RecipientStore.from_frame(df, compiled.columns)
+    bodies = compiled.render_store(store)
+    return list(zip(store.index, store.emails, bodies))
+
+def measure(func, df):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(df)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    df = make_frame(rows)
+    for name, func in [("iterrows", send_loop_iterrows), ("store", send_loop_store)]:
+        func(df.head(100))
+        elapsed, peak = measure(func, df)
+        print(f"{name:9s} {rows} rows: {elapsed:.3f}s ({rows / elapsed:,.0f} rows/s), "
+              f"peak {peak / 1024 / 1024:.1f} MiB")
+
+    full = RecipientStore.from_frame(df)
+    frame_bytes = int(df.memory_usage(deep=True).sum())
+    print(f"all {len(df.columns)} columns: DataFrame {frame_bytes / 1024 / 1024:.1f} MiB, "
+          f"store {sys.getsizeof(full) / 1024 / 1024:.1f} MiB")
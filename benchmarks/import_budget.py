@@ -0,0 +1,100 @@
+"""Cold-start check: import the app in fresh interpreters and compare against a budget.
+
+Usage:
+    python benchmarks/import_budget.py [--budget SECONDS] [--runs N] [--top N]
+
+Each run imports the application (src.app and its callbacks, everything the
+gunicorn entry module loads before init_app) in a new process from an empty
+working directory and reports the median import time. The exit status is 1 if
+the median exceeds the budget, if a heavy dependency was imported eagerly, or
+if importing created any files (log directories, databases) - those belong in
+init_app().
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.append(ROOT)
+
+from src.utils.lazy_import import HEAVY_MODULES
+
+CHILD = """
+import sys, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import src.app
+import src.callbacks
+seconds = time.perf_counter() - started
+print({json_dumps}({{'seconds': seconds, 'modules': sorted(sys.modules)}}))
+"""
+
+
+def run_once(root, importtime=False):
+    """Import the app in a fresh interpreter, returning (result, importtime log, files created)"""
+    with tempfile.TemporaryDirectory() as workdir:
+        command = [sys.executable]
+        if importtime:
+            command += ['-X', 'importtime']
+        command += ['-c', CHILD.format(root=root, json_dumps='__import__("json").dumps')]
+        process = subprocess.run(command, cwd=workdir, capture_output=True, text=True, check=True)
+        created = sorted(os.listdir(workdir))
+    return json.loads(process.stdout.strip().splitlines()[-1]), process.stderr, created
+
+
+def slowest_imports(log, top):
+    """Parse `-X importtime` output into the `top` modules by cumulative time"""
+    rows = []
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget', type=float, default=float(os.getenv('IMPORT_BUDGET_SECONDS', '1.0')),
+                        help='allowed median import time in seconds')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest imports to list')
+    args = parser.parse_args()
+
+    # The first import warms the OS file cache and bytecode; it is not counted
+    run_once(ROOT)
+    timings = []
+    for _ in range(args.runs):
+        result, _, created = run_once(ROOT)
+        timings.append(result['seconds'])
+    median = statistics.median(timings)
+
+    _, log, _ = run_once(ROOT, importtime=True)
+    eager = [name for name in HEAVY_MODULES if name in result['modules']]
+
+    print(f"import src.app: median {median * 1000:.0f} ms over {args.runs} runs "
+          f"(min {min(timings) * 1000:.0f} ms, budget {args.budget * 1000:.0f} ms)")
+    print("slowest imports (cumulative):")
+    for microseconds, name in slowest_imports(log, args.top):
+        print(f"  {microseconds / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if median > args.budget:
+        print("FAIL: import time over budget")
+        failed = True
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if created:
+        print(f"FAIL: importing created files: {', '.join(created)}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""Throughput benchmarks for parsing, rendering and sending against a local SMTP sink.
+
+Usage:
+    python benchmarks/run_benchmarks.py [--sizes 100,1000,10000] [--starttls] [--transport asyncio]
+        [--latency SECONDS] [--error-4xx RATE] [--error-5xx RATE] [--no-memory]
+        [--output results.json] [--compare baseline.json] [--threshold 0.1]
+
+Results are written as JSON. With --compare, throughput is compared per
+(benchmark, size) against an earlier results file and the exit status is 1
+if anything regressed by more than the threshold.
+"""
+import argparse
+import base64
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smtp_sink import SMTPSink
+
+MAPPING = {"Email": "Email", "Last Name": "Last Name", "Fund Name": "Fund Name", "Port-Co": "Port-Co"}
+PLACEHOLDERS = {"Last Name": "X", "Fund Name": "Y", "Port-Co": "Z"}
+TEMPLATE = (
+    "Dear {{X}},\n\n"
+    "I'm reaching out regarding {{Y}} and its investment in {{Z}}. "
+    "We would welcome the chance to compare notes.\n\n"
+    "Best regards"
+)
+
+# Single sends are sequential, so cap them to keep large runs practical
+SEND_EMAIL_LIMIT = 1000
+
+
+def make_rows(size):
+    return [(f"person{i}@example.com", f"Name{i}", f"Fund {i % 50}", f"Company {i % 500}")
+            for i in range(size)]
+
+
+def make_workbook_upload(size):
+    """Build an .xlsx upload as a dcc.Upload data URL"""
+    import openpyxl
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(list(MAPPING))
+    for row in make_rows(size):
+        sheet.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return f"data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{encoded}"
+
+
+def make_frame(size):
+    import pandas as pd
+    return pd.DataFrame(make_rows(size), columns=list(MAPPING))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run_case(name, size, func, measure_memory, latencies=None):
+    """Time `func()` (which returns the number of items processed) and optionally its peak memory"""
+    if latencies is not None:
+        latencies.clear()
+    started = time.perf_counter()
+    count = func()
+    seconds = time.perf_counter() - started
+    samples = list(latencies) if latencies is not None else []
+
+    peak = None
+    if measure_memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    result = {
+        'benchmark': name,
+        'size': size,
+        'count': count,
+        'seconds': round(seconds, 6),
+        'per_second': round(count / seconds, 2) if seconds > 0 else None,
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3) if samples else None,
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3) if samples else None,
+        'peak_memory_bytes': peak,
+    }
+    print(f"{name:20s} {size:>7d}  {result['per_second'] or 0:>12,.1f}/s"
+          f"  p50={result['p50_ms'] or '-'}ms p99={result['p99_ms'] or '-'}ms"
+          f"  peak={peak or '-'}", flush=True)
+    return result
+
+
+def run(args):
+    with SMTPSink(starttls=args.starttls, latency=args.latency,
+                  error_rate_4xx=args.error_4xx, error_rate_5xx=args.error_5xx) as sink:
+        os.environ.update({
+            'SMTP_SERVER': '127.0.0.1',
+            'SMTP_PORT': str(sink.port),
+            'SMTP_STARTTLS': 'true' if args.starttls else 'false',
+            'SMTP_TRANSPORT': args.transport,
+            # The sink's certificate is self-signed
+            'SMTP_TLS_VERIFY': 'false',
+            'EMAIL_ADDRESS': 'bench@example.com',
+            'EMAIL_PASSWORD': 'bench',
+            'SEND_ADAPTIVE_MAX_RATE': os.environ.get('SEND_ADAPTIVE_MAX_RATE', '1000000'),
+            'SEND_RETRY_BASE_DELAY': os.environ.get('SEND_RETRY_BASE_DELAY', '0.01'),
+        })
+
+        from src.utils.email_sender import EmailSender
+        from src.utils.excel_parser import parse_excel, iter_recipient_chunks
+        from src.utils.template_parser import compile_template
+        from src.utils.upload_cache import upload_cache
+
+        latencies = []
+
+        class TimedSender(EmailSender):
+            """Records the network time of every delivery attempt"""
+            def deliver(self, recipient, message):
+                started = time.perf_counter()
+                try:
+                    return super().deliver(recipient, message)
+                finally:
+                    latencies.append(time.perf_counter() - started)
+
+            async def deliver_async(self, recipients, message):
+                started = time.perf_counter()
+                try:
+                    return await super().deliver_async(recipients, message)
+                finally:
+                    latencies.append(time.perf_counter() - started)
+
+        sender = TimedSender()
+        results = []
+        for size in args.sizes:
+            upload = make_workbook_upload(size)
+            df = make_frame(size)
+
+            def parse():
+                upload_cache.clear()
+                return len(parse_excel(upload, MAPPING))
+
+            def stream():
+                return sum(len(chunk) for chunk in iter_recipient_chunks(upload, MAPPING))
+
+            def render():
+                return len(compile_template(TEMPLATE, PLACEHOLDERS, df.columns).render_frame(df))
+
+            def build():
+                builder = sender.get_message_builder("Benchmark", "Calibri", "11")
+                bodies = compile_template(TEMPLATE, PLACEHOLDERS, df.columns).render_frame(df)
+                return len([builder.build(email, body) for email, body in zip(df['Email'], bodies)])
+
+            def send_single():
+                count = min(size, SEND_EMAIL_LIMIT)
+                for email in df['Email'].iloc[:count]:
+                    sender.send_email(email, "Benchmark", "Hello", "Calibri", "11")
+                return count
+
+            def send_batch():
+                successful, total, failed = sender.send_batch_emails(
+                    df, TEMPLATE, "Benchmark", placeholder_settings=PLACEHOLDERS
+                )
+                return total
+
+            results.append(run_case('parse_excel', size, parse, args.memory))
+            results.append(run_case('stream_excel', size, stream, args.memory))
+            results.append(run_case('render_template', size, render, args.memory))
+            results.append(run_case('build_messages', size, build, args.memory))
+            results.append(run_case('send_email', size, send_single, args.memory, latencies))
+            results.append(run_case('send_batch_emails', size, send_batch, args.memory, latencies))
+
+        sink_stats = {name: getattr(sink.stats, name)
+                      for name in ('connections', 'messages', 'recipients', 'bytes', 'deferred', 'rejected')}
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'revision': git_revision(),
+            'options': {
+                'sizes': args.sizes,
+                'starttls': args.starttls,
+                'transport': args.transport,
+                'latency': args.latency,
+                'error_4xx': args.error_4xx,
+                'error_5xx': args.error_5xx,
+                'workers': os.getenv('SEND_WORKERS'),
+            },
+            'sink': sink_stats,
+        },
+        'results': results,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(report, baseline_path, threshold):
+    """Print throughput changes against a baseline and return True if anything regressed"""
+    with open(baseline_path) as f:
+        baseline = {(r['benchmark'], r['size']): r for r in json.load(f)['results']}
+    regressed = False
+    print(f"\nCompared with {baseline_path}:")
+    for result in report['results']:
+        before = baseline.get((result['benchmark'], result['size']))
+        if not before or not before['per_second'] or not result['per_second']:
+            continue
+        change = result['per_second'] / before['per_second'] - 1
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressed = True
+        print(f"{result['benchmark']:20s} {result['size']:>7d}  {change:+7.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='100,1000,10000',
+                        type=lambda value: [int(size) for size in value.split(',')])
+    parser.add_argument('--starttls', action='store_true', help='negotiate STARTTLS with the sink')
+    parser.add_argument('--transport', choices=('smtplib', 'asyncio'), default='smtplib',
+                        help='SMTP transport used by EmailSender')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds the sink waits after DATA')
+    parser.add_argument('--error-4xx', type=float, default=0.0, help='fraction of RCPTs deferred with 451')
+    parser.add_argument('--error-5xx', type=float, default=0.0, help='fraction of RCPTs rejected with 550')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the second, tracemalloc-instrumented pass')
+    parser.add_argument('--output', help='write JSON results here (default: stdout)')
+    parser.add_argument('--compare', help='earlier JSON results to compare throughput against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed throughput drop (fraction)')
+    args = parser.parse_args()
+
+    # Per-message send logging would dominate the measurements
+    logging.basicConfig(level=logging.ERROR)
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare and compare(report, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""In-process SMTP stand-in for benchmarks.
+
+Speaks enough ESMTP for smtplib: EHLO/HELO, optional STARTTLS, AUTH PLAIN/LOGIN,
+MAIL, RCPT, DATA, RSET, NOOP and QUIT. Latency and 4xx/5xx replies can be
+injected to exercise the retry and pacing paths.
+"""
+import os
+import random
+import shutil
+import socket
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+
+def make_tls_context():
+    """Create a server TLS context with a throwaway self-signed certificate"""
+    if not shutil.which('openssl'):
+        raise RuntimeError("STARTTLS needs the openssl command to create a test certificate")
+    directory = tempfile.mkdtemp(prefix='smtp-sink-')
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+         '-subj', '/CN=localhost', '-keyout', key, '-out', cert],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+class SinkStats:
+    """Counters shared by all sink connections"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.recipients = 0
+        self.bytes = 0
+        self.deferred = 0
+        self.rejected = 0
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+
+class SMTPSinkHandler(socketserver.BaseRequestHandler):
+    """One SMTP session"""
+
+    def setup(self):
+        self.conn = self.request
+        # Pipelined commands get one small reply each; don't let Nagle hold them back
+        self.conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.conn.makefile('rb')
+        self.tls_active = False
+        self.recipients = []
+        self.server.stats.add(connections=1)
+
+    def reply(self, code, text):
+        self.conn.sendall(f"{code} {text}\r\n".encode('ascii'))
+
+    def reply_lines(self, code, lines):
+        payload = ''.join(f"{code}-{line}\r\n" for line in lines[:-1]) + f"{code} {lines[-1]}\r\n"
+        self.conn.sendall(payload.encode('ascii'))
+
+    def readline(self):
+        """Read one command line, or None once the client has gone away"""
+        raw = self.reader.readline()
+        if not raw:
+            return None
+        return raw.decode('utf-8', 'replace').rstrip('\r\n')
+
+    def injected_error(self):
+        """Return an injected (code, text) reply for this message, or None"""
+        roll = random.random()
+        if roll < self.server.error_rate_4xx:
+            self.server.stats.add(deferred=1)
+            return 451, "4.7.0 Temporary failure, try again later"
+        if roll < self.server.error_rate_4xx + self.server.error_rate_5xx:
+            self.server.stats.add(rejected=1)
+            return 550, "5.1.1 Recipient rejected"
+        return None
+
+    def handle(self):
+        self.reply(220, "smtp-sink ready")
+        while True:
+            line = self.readline()
+            if line is None:
+                break
+            command, _, argument = line.partition(' ')
+            command = command.upper()
+
+            if command in ('EHLO', 'HELO'):
+                capabilities = ['smtp-sink', 'PIPELINING', '8BITMIME', 'SIZE 52428800', 'AUTH PLAIN LOGIN']
+                if self.server.tls_context is not None and not self.tls_active:
+                    capabilities.append('STARTTLS')
+                self.reply_lines(250, capabilities)
+            elif command == 'STARTTLS' and self.server.tls_context is not None:
+                self.reply(220, "Ready to start TLS")
+                self.conn = self.server.tls_context.wrap_socket(self.conn, server_side=True)
+                self.reader = self.conn.makefile('rb')
+                self.tls_active = True
+            elif command == 'AUTH':
+                self.authenticate(argument)
+            elif command == 'MAIL':
+                self.recipients = []
+                self.reply(250, "2.1.0 OK")
+            elif command == 'RCPT':
+                error = self.injected_error()
+                if error:
+                    self.reply(*error)
+                else:
+                    self.recipients.append(argument)
+                    self.reply(250, "2.1.5 OK")
+            elif command == 'DATA':
+                self.receive_data()
+            elif command == 'RSET':
+                self.recipients = []
+                self.reply(250, "2.0.0 OK")
+            elif command == 'NOOP':
+                self.reply(250, "2.0.0 OK")
+            elif command == 'QUIT':
+                self.reply(221, "2.0.0 Bye")
+                break
+            else:
+                self.reply(502, "5.5.2 Command not implemented")
+
+    def authenticate(self, argument):
+        mechanism, _, initial = argument.partition(' ')
+        mechanism = mechanism.upper()
+        if mechanism == 'PLAIN':
+            if not initial:
+                self.reply(334, "")
+                self.readline()
+        elif mechanism == 'LOGIN':
+            self.reply(334, "VXNlcm5hbWU6")
+            self.readline()
+            self.reply(334, "UGFzc3dvcmQ6")
+            self.readline()
+        else:
+            self.reply(504, "5.5.4 Unrecognized authentication type")
+            return
+        self.reply(235, "2.7.0 Authentication successful")
+
+    def receive_data(self):
+        if not self.recipients:
+            self.reply(503, "5.5.1 No valid recipients")
+            return
+        self.reply(354, "End data with <CR><LF>.<CR><LF>")
+        size = 0
+        while True:
+            line = self.reader.readline()
+            if not line or line == b'.\r\n':
+                break
+            size += len(line)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.stats.add(messages=1, recipients=len(self.recipients), bytes=size)
+        self.recipients = []
+        self.reply(250, "2.0.0 Queued")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Threaded local SMTP server; use as a context manager"""
+    daemon_threads = True
+    allow_reuse_address = True
+    # Room for clients that open many sessions at once (the asyncio transport)
+    request_queue_size = 256
+
+    def __init__(self, starttls=False, latency=0.0, error_rate_4xx=0.0, error_rate_5xx=0.0):
+        super().__init__(('127.0.0.1', 0), SMTPSinkHandler)
+        self.tls_context = make_tls_context() if starttls else None
+        self.latency = latency
+        self.error_rate_4xx = error_rate_4xx
+        self.error_rate_5xx = error_rate_5xx
+        self.stats = SinkStats()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,32 @@
+"""Gunicorn settings: load the app once in the master and fork workers from it.
+
+    gunicorn app:server
+"""
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:8050')
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+
+# Import the app (and run init_app) in the master; workers start as cheap forks
+preload_app = True
+
+
+def when_ready(server):
+    # Runs in the master before the first worker is forked, so pandas and openpyxl
+    # are imported once and shared copy-on-write instead of on each worker's first upload
+    from src.utils.lazy_import import preload
+    preload()
+
+
+def post_worker_init(worker):
+    # Every worker dispatches the sends it queued and adopts those of workers that
+    # died, so queued sends resume after a restart without waiting for a page load
+    from src.utils.send_scheduler import get_scheduler
+    get_scheduler()
+
+
+def worker_exit(server, worker):
+    # Say QUIT on pooled SMTP sessions instead of dropping them with the process
+    from src.utils.smtp_pool import close_all_pools
+    close_all_pools()
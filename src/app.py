@@ -2,19 +2,33 @@ import dash
 import dash_bootstrap_components as dbc
 from datetime import datetime
 import logging
+from flask import Response
 from src.components.layout import create_layout
-from src.config.settings import LOGGING_CONFIG
-
-# Configure logging
-logging.basicConfig(**LOGGING_CONFIG)
+from src.config.settings import PRELOAD_DEPENDENCIES
+from src.utils.log_setup import init_logging
+from src.utils.lazy_import import preload
+from src.utils.metrics import registry
 
 # Initialize the Dash app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 
-# Set app layout
-app.layout = create_layout()
+# Set app layout; served per page load so every visitor gets their own session id
+app.layout = create_layout
+
+@app.server.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint for stage timings and send counters"""
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def init_app(preload_dependencies=PRELOAD_DEPENDENCIES):
+    """Process start-up side effects (log files, optional warm imports), kept out of import"""
+    init_logging()
+    if preload_dependencies:
+        preload()
+    logging.info("Email automation app initialised")
 
 # Import callbacks - must be after layout
 from src.callbacks import preview_callbacks
 from src.callbacks import upload_callbacks
-from src.callbacks import email_callbacks
\ No newline at end of file
+from src.callbacks import email_callbacks
+from src.callbacks import job_callbacks
\ No newline at end of file
@@ -1,3 +1,4 @@
 from . import preview_callbacks
 from . import upload_callbacks
-from . import email_callbacks
\ No newline at end of file
+from . import email_callbacks
+from . import job_callbacks
\ No newline at end of file
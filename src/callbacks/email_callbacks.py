@@ -1,113 +1,161 @@
-from dash import Input, Output, State, callback_context
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime
+from dash import Input, Output, State, callback_context, no_update
 from src.app import app
-from src.utils.excel_parser import parse_excel
-from src.utils.template_parser import parse_template
-from src.utils.email_sender import EmailSender
+from src.utils.excel_parser import parse_excel, load_recipient_store, count_data_rows
+from src.utils.template_parser import parse_template, strip_preview_header, placeholder_mapping
+from src.utils.send_ledger import get_ledger
+from src.utils.send_scheduler import get_scheduler
+from src.utils.suppression import get_suppression_list
+from src.utils.attachments import find_attachment_column, split_attachment_names
+from src.utils.upload_cache import content_key
+from src.utils.upload_store import edit_store
+from src.callbacks.preview_callbacks import edit_key, flush_preview_edits
+from src.config.settings import SEND_CURRENT_WAIT_SECONDS
 import logging
 
+def parse_schedule(start_value, window_hours):
+    """Read the schedule inputs as (start epoch seconds or None, window seconds).
+
+    The start is a datetime-local value, interpreted in the server's time zone.
+    """
+    start_at = datetime.fromisoformat(start_value).timestamp() if start_value else None
+    window_seconds = float(window_hours or 0) * 3600
+    if window_seconds < 0:
+        raise ValueError("The sending window cannot be negative")
+    return start_at, window_seconds
+
 @app.callback(
     [Output('send-progress', 'value', allow_duplicate=True),
      Output('progress-status', 'children', allow_duplicate=True),
-     Output('send-status', 'children', allow_duplicate=True)],
+     Output('send-status', 'children', allow_duplicate=True),
+     Output('send-job-id', 'data'),
+     Output('job-poll', 'disabled')],
     [Input('send-btn', 'n_clicks'),
-     Input('send-current', 'n_clicks'),
-     Input('prev-preview', 'n_clicks'),
-     Input('next-preview', 'n_clicks'),
-     Input('preview-btn', 'n_clicks')],
-    [State('upload-excel', 'contents'),
-     State('upload-template', 'contents'),
+     Input('send-current', 'n_clicks')],
+    [State('excel-upload-id', 'data'),
+     State('template-upload-id', 'data'),
      State('email-subject', 'value'),
      State('email-service', 'value'),
      State('font-family', 'value'),
      State('font-size', 'value'),
-     State('edited-templates', 'data'),
+     State('session-id', 'data'),
+     State('preview-pending-edits', 'data'),
      State('preview-content', 'value'),
      State('preview-index', 'data'),
-     State('sent-emails', 'data')],
+     State('sent-emails', 'data'),
+     State('attachment-names', 'data'),
+     State('placeholder-settings', 'data'),
+     State('schedule-start', 'value'),
+     State('schedule-window', 'value')],
     prevent_initial_call=True
 )
-def handle_email_actions(send_all_clicks, send_current_clicks, prev_clicks, 
-                        next_clicks, preview_clicks, excel_contents, 
-                        template_contents, subject, email_service, 
-                        font_family, font_size, edited_templates, 
-                        current_content, current_index, sent_emails):
+def handle_email_actions(send_all_clicks, send_current_clicks, excel_upload_id, 
+                        template_upload_id, subject, email_service, 
+                        font_family, font_size, session_id, 
+                        pending_edits, current_content, current_index, sent_emails,
+                        attachment_names, column_mapping, schedule_start, schedule_window):
     """Combined callback to handle all email-related actions"""
     ctx = callback_context
     if not ctx.triggered:
-        return 0, "", ""
+        return 0, "", "", no_update, no_update
     
     trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
     
-    # Clear messages for navigation actions
-    if trigger_id in ['prev-preview', 'next-preview', 'preview-btn']:
-        return 0, "", ""
-    
     # Handle send current email
     if trigger_id == 'send-current':
         if not send_current_clicks or current_index in sent_emails:
-            return 0, "", ""
+            return 0, "", "", no_update, no_update
         
         try:
-            df = parse_excel(excel_contents)
-            if df is None:
-                return 0, "", "Error: Could not load Excel file"
+            store = load_recipient_store(excel_upload_id)
+            if store is None:
+                return 0, "", "Error: Could not load Excel file", no_update, no_update
+            recipient = store[current_index].email
+            attachments = list(attachment_names or [])
+            attachment_column = find_attachment_column(store.columns)
+            if attachment_column is not None:
+                attachments.extend(split_attachment_names(store[current_index][attachment_column]))
+            if get_suppression_list().suppressed([recipient]):
+                return 0, "", f"Error: {recipient} is on the suppression list", no_update, no_update
                 
             # Remove preview text from email content
-            email_content = current_content
-            if "Preview" in email_content:
-                email_content = email_content.split("\n\n", 1)[1]
+            email_content = strip_preview_header(current_content)
                 
-            email_sender = EmailSender()
-            if email_sender.send_email(
-                recipient=df.iloc[current_index]['Email'],
-                subject=subject,
-                body=email_content,
-                font_family=font_family,
-                font_size=font_size
-            ):
+            # Goes ahead of any scheduled campaign, which holds back until it is sent
+            result = get_scheduler().send_now({
+                'recipient': recipient,
+                'subject': subject,
+                'body': email_content,
+                'font_family': font_family,
+                'font_size': font_size,
+                'attachments': attachments
+            })
+            try:
+                sent = result.result(timeout=SEND_CURRENT_WAIT_SECONDS)
+            except FutureTimeoutError:
                 sent_emails.append(current_index)
-                return 0, "", f"✓ Email sent successfully to {df.iloc[current_index]['Email']}"
+                return 0, "", f"Email to {recipient} is queued and will be sent shortly", no_update, no_update
+            if sent:
+                sent_emails.append(current_index)
+                return 0, "", f"✓ Email sent successfully to {recipient}", no_update, no_update
             else:
-                return 0, "", "Error: Failed to send email"
+                return 0, "", "Error: Failed to send email", no_update, no_update
             
         except Exception as e:
             logging.error(f"Error sending single email: {str(e)}")
-            return 0, "", f"Error sending email: {str(e)}"
+            return 0, "", f"Error sending email: {str(e)}", no_update, no_update
     
     # Handle send all emails
     if trigger_id == 'send-btn':
         if not send_all_clicks:
-            return 0, "", ""
+            return 0, "", "", no_update, no_update
         
-        if not all([excel_contents, template_contents, subject]):
-            return 0, "Error: Please provide all required information", ""
+        if not all([excel_upload_id, template_upload_id, subject]):
+            return 0, "Error: Please provide all required information", "", no_update, no_update
         
         try:
-            df = parse_excel(excel_contents)
-            template = parse_template(template_contents)
+            start_at, window_seconds = parse_schedule(schedule_start, schedule_window)
+            columns = parse_excel(excel_upload_id)
+            template = parse_template(template_upload_id)
             
-            if df is None or template is None:
-                return 0, "Error: Invalid file format or missing data", ""
-                
-            email_sender = EmailSender()
-            successful, total_emails, failed_emails = email_sender.send_batch_emails(
-                df=df,
-                template=template,
-                subject=subject,
-                edited_templates=edited_templates,
-                font_family=font_family,
-                font_size=font_size
-            )
-                    
-            progress = int((successful / total_emails) * 100)
-            status_message = f"✓ Completed: {successful}/{total_emails} emails sent successfully"
-            if failed_emails:
-                status_message += f"\nFailed recipients: {', '.join(failed_emails)}"
-                
-            return progress, status_message, ""
+            if columns is None or template is None:
+                return 0, "Error: Invalid file format or missing data", "", no_update, no_update
+            
+            # Resume an interrupted run of the same upload and subject if there is one
+            ledger = get_ledger()
+            run_id, resumed = ledger.open_run(content_key('excel', excel_upload_id), subject)
+            
+            # Previews edited since the last window fetch are still only in the browser
+            upload_key = edit_key(excel_upload_id, template_upload_id)
+            flush_preview_edits(session_id, upload_key, pending_edits)
+            
+            # The scheduler streams the upload in chunks on a job thread so memory stays
+            # bounded, spreading it over the window if one is given
+            total_emails = count_data_rows(excel_upload_id)
+            job = get_scheduler().schedule_campaign({
+                'excel_upload_id': excel_upload_id,
+                'template': template,
+                'subject': subject,
+                # Rendered with the same mapping as the preview
+                'placeholder_settings': placeholder_mapping(column_mapping),
+                'edited_templates': edit_store.all(session_id, upload_key),
+                'font_family': font_family,
+                'font_size': font_size,
+                'run_id': run_id,
+                'attachments': attachment_names or [],
+                'column_mapping': column_mapping or {}
+            }, total=total_emails, start_at=start_at, window_seconds=window_seconds)
+            
+            if start_at is not None and start_at > datetime.now().timestamp():
+                return (0, f"Scheduled {total_emails} emails for {datetime.fromtimestamp(start_at):%Y-%m-%d %H:%M}",
+                        "", job.id, False)
+            if resumed:
+                return 0, f"Resuming interrupted run {run_id} for {total_emails} emails", "", job.id, False
+            return 0, f"Queued {total_emails} emails for sending", "", job.id, False
         
         except Exception as e:
             logging.error(f"Error in email sending process: {str(e)}")
-            return 0, f"Error: {str(e)}", ""
+            return 0, f"Error: {str(e)}", "", no_update, no_update
     
-    return 0, "", ""
\ No newline at end of file
+    return 0, "", "", no_update, no_update
\ No newline at end of file
@@ -0,0 +1,154 @@
+from datetime import datetime
+from dash import Input, Output, State, callback_context, no_update
+from flask import jsonify, request
+from src.app import app
+from src.utils.send_jobs import job_manager
+from src.utils.send_ledger import get_ledger
+from src.utils.send_scheduler import get_scheduler
+from src.utils.suppression import get_suppression_list
+
+@app.server.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Polling endpoint returning the progress of a background send job"""
+    snapshot = job_snapshot(job_id)
+    if snapshot is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(snapshot)
+
+@app.server.route('/runs/<run_id>')
+def run_status(run_id):
+    """Per-state recipient counts for a run, read from the send ledger"""
+    return jsonify({'run_id': run_id, 'counts': get_ledger().counts(run_id)})
+
+@app.server.route('/schedule')
+def schedule_status():
+    """Depth of the send queue and when everything in it should be sent"""
+    return jsonify(get_scheduler().status())
+
+@app.server.route('/suppressions', methods=['POST'])
+def add_suppressions():
+    """Suppress addresses (unsubscribes, complaints) posted as {"addresses": [...], "reason": "..."}"""
+    payload = request.get_json(silent=True) or {}
+    addresses = payload.get('addresses')
+    if not isinstance(addresses, list) or not addresses:
+        return jsonify({'error': 'Expected a non-empty "addresses" list'}), 400
+    suppression = get_suppression_list()
+    suppression.add_many(addresses, str(payload.get('reason') or 'unsubscribe'))
+    return jsonify({'suppressed': len(addresses), 'total': suppression.count()})
+
+# Rejected rows spelled out under the progress bar; /jobs/<id> lists more
+REJECTED_SHOWN = 10
+
+def job_snapshot(job_id):
+    """Progress of a send job in this worker, or of a scheduled campaign in any worker"""
+    job = job_manager.get(job_id)
+    return job.snapshot() if job is not None else get_scheduler().snapshot(job_id)
+
+def format_time(timestamp):
+    """Server-local time for a status line, with the date if it is not today"""
+    moment = datetime.fromtimestamp(timestamp)
+    return f"{moment:%H:%M}" if moment.date() == datetime.now().date() else f"{moment:%Y-%m-%d %H:%M}"
+
+def format_job_status(snapshot):
+    """Build the progress message shown under the progress bar"""
+    total = snapshot['total']
+    if snapshot['status'] == 'scheduled':
+        message = f"Scheduled: {total} emails starting at {format_time(snapshot['start_at'])}"
+        if snapshot['eta']:
+            message += f", finishing around {format_time(snapshot['eta'])}"
+        return message
+    if snapshot['status'] == 'failed':
+        return f"Error: {snapshot['error']}"
+    if snapshot['status'] in ('completed', 'cancelled'):
+        prefix = "✓ Completed" if snapshot['status'] == 'completed' else "Cancelled"
+        message = f"{prefix}: {snapshot['sent']}/{total} emails sent successfully"
+    else:
+        label = "Paused" if snapshot['status'] == 'paused' else "Sending"
+        message = (f"{label}: {snapshot['sent']} sent, {snapshot['failed']} failed, "
+                   f"{snapshot['remaining']} remaining ({snapshot['throughput']} emails/s)")
+        if snapshot['eta']:
+            message += f", done around {format_time(snapshot['eta'])}"
+    if snapshot['failed_emails']:
+        message += f"\nFailed recipients: {', '.join(snapshot['failed_emails'])}"
+    if snapshot['rejected']:
+        shown = snapshot['rejected_rows'][:REJECTED_SHOWN]
+        details = '; '.join(f"data row {row['row']} ({row['email'] or 'no address'}): {row['reason']}"
+                            for row in shown)
+        message += f"\nRejected {snapshot['rejected']} rows: {details}"
+        if snapshot['rejected'] > len(shown):
+            message += f" and {snapshot['rejected'] - len(shown)} more"
+    return message
+
+@app.callback(
+    [Output('send-progress', 'value', allow_duplicate=True),
+     Output('progress-status', 'children', allow_duplicate=True),
+     Output('send-controls', 'style'),
+     Output('job-poll', 'disabled', allow_duplicate=True)],
+    [Input('job-poll', 'n_intervals')],
+    [State('send-job-id', 'data')],
+    prevent_initial_call=True
+)
+def poll_send_job(n_intervals, job_id):
+    """Stream background job progress into the progress bar"""
+    snapshot = job_snapshot(job_id) if job_id else None
+    if snapshot is None:
+        return no_update, no_update, {'display': 'none'}, True
+    
+    finished = snapshot['status'] in ('completed', 'cancelled', 'failed')
+    controls_style = {'display': 'none'} if finished else {'display': 'block'}
+    return snapshot['progress'], format_job_status(snapshot), controls_style, finished
+
+@app.callback(
+    Output('send-status', 'children', allow_duplicate=True),
+    [Input('pause-send', 'n_clicks'),
+     Input('resume-send', 'n_clicks'),
+     Input('cancel-send', 'n_clicks')],
+    [State('send-job-id', 'data')],
+    prevent_initial_call=True
+)
+def control_send_job(pause_clicks, resume_clicks, cancel_clicks, job_id):
+    """Pause, resume or cancel the running send job"""
+    ctx = callback_context
+    if not ctx.triggered or not job_id:
+        return no_update
+    
+    trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
+    if trigger_id == 'cancel-send':
+        # A scheduled send that has not started is dropped from the queue; a running
+        # one stops in whichever worker is sending it
+        if get_scheduler().cancel(job_id):
+            return "Scheduled send cancelled"
+        job = job_manager.get(job_id)
+        if job is not None:
+            job.cancel()
+        return "Cancelling remaining emails..."
+    
+    job = job_manager.get(job_id)
+    if job is None:
+        return "This send is running in another worker and can only be cancelled from here"
+    if trigger_id == 'pause-send':
+        job.pause()
+        return "Sending paused"
+    if trigger_id == 'resume-send':
+        job.resume()
+        return "Sending resumed"
+    return no_update
+
+def format_schedule_status(status):
+    """One line on the send queue: its depth, next start and expected finish"""
+    if not status['queued'] and not status['running']:
+        return ""
+    message = f"Send queue: {status['running']} running, {status['queued']} waiting, {status['recipients']} emails to send"
+    if status['next_start']:
+        message += f"; next start {format_time(status['next_start'])}"
+    if status['eta']:
+        message += f"; all sent around {format_time(status['eta'])}"
+    return message
+
+@app.callback(
+    Output('schedule-status', 'children'),
+    [Input('schedule-poll', 'n_intervals')]
+)
+def poll_schedule(n_intervals):
+    """Show the depth of the send queue and its ETA"""
+    return format_schedule_status(get_scheduler().status())
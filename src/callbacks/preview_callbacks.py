@@ -1,77 +1,191 @@
-from dash import Input, Output, State, callback_context
+from dash import Input, Output, State, callback_context, no_update
 from src.app import app
-from src.utils.excel_parser import parse_excel
-from src.utils.template_parser import parse_template
+from src.utils.excel_parser import load_recipient_store
+from src.utils.template_parser import parse_template, compile_template, strip_preview_header, placeholder_mapping
+from src.config.settings import PREVIEW_WINDOW_SIZE
+from src.utils.upload_store import edit_store
 import logging
 
+
+def edit_key(excel_upload_id, template_upload_id):
+    """What preview edits belong to: they are rendered from one file and one template"""
+    return f"{excel_upload_id}:{template_upload_id}"
+
+
+def flush_preview_edits(session_id, upload_key, pending_edits):
+    """Persist previews edited in the browser, without their headers"""
+    if session_id and pending_edits:
+        edit_store.set_many(session_id, upload_key, {
+            int(index): strip_preview_header(content) for index, content in pending_edits.items()
+        })
+
+
+def render_preview_window(store, template, session_id, upload_key, center, mapping):
+    """Render the previews around `center` as a window the browser can page through"""
+    total = len(store)
+    start = max(0, min(center - PREVIEW_WINDOW_SIZE // 2, total - PREVIEW_WINDOW_SIZE))
+    rows = store.slice(start, start + PREVIEW_WINDOW_SIZE)
+    items = compile_template(template, mapping, store.columns).render_store(rows)
+
+    # Rows edited earlier in this session render from their own text
+    for index, content in edit_store.all(session_id, upload_key).items():
+        offset = int(index) - start
+        if 0 <= offset < len(items):
+            compiled = compile_template(content, mapping, store.columns)
+            items[offset] = compiled.render(rows[offset])
+
+    return {'start': start, 'total': total, 'items': items, 'margin': max(1, PREVIEW_WINDOW_SIZE // 5)}
+
+
 @app.callback(
     [Output('preview-card', 'style'),
-     Output('preview-content', 'value'),
-     Output('preview-index', 'data')],
+     Output('preview-window', 'data'),
+     Output('preview-index', 'data', allow_duplicate=True),
+     Output('preview-pending-edits', 'data', allow_duplicate=True)],
     [Input('preview-btn', 'n_clicks'),
-     Input('prev-preview', 'n_clicks'),
-     Input('next-preview', 'n_clicks')],
-    [State('upload-excel', 'contents'),
-     State('upload-template', 'contents'),
-     State('preview-index', 'data'),
-     State('edited-templates', 'data'),
-     State('preview-content', 'value')]
+     Input('preview-window-request', 'data')],
+    [State('excel-upload-id', 'data'),
+     State('template-upload-id', 'data'),
+     State('session-id', 'data'),
+     State('preview-pending-edits', 'data'),
+     State('placeholder-settings', 'data')],
+    prevent_initial_call=True
 )
-def handle_preview(preview_clicks, prev_clicks, next_clicks, excel_contents, 
-                  template_contents, current_index, edited_templates, current_content):
+def load_preview_window(preview_clicks, window_request, excel_upload_id,
+                        template_upload_id, session_id, pending_edits, column_mapping):
+    """Render a window of previews; only called on Preview and when paging past the window"""
     if not preview_clicks:
-        return {'display': 'none'}, "", 0
-    
-    if not excel_contents or not template_contents:
-        return {'display': 'block'}, "Error: Please upload both Excel and template files", 0
-        
-    df = parse_excel(excel_contents)
-    template = parse_template(template_contents)
-    
-    if df is None:
-        return {'display': 'block'}, "Error: Could not load Excel file. Please check format and required columns", 0
+        return {'display': 'none'}, no_update, no_update, no_update
+
+    trigger_id = callback_context.triggered[0]['prop_id'].split('.')[0]
+    starting = trigger_id == 'preview-btn'
+    center = 0 if starting else window_request['index']
+
+    if not excel_upload_id or not template_upload_id:
+        return {'display': 'block'}, {'error': "Error: Please upload both Excel and template files"}, 0, {}
+
+    store = load_recipient_store(excel_upload_id)
+    template = parse_template(template_upload_id)
+
+    if store is None:
+        return {'display': 'block'}, {'error': "Error: Could not load Excel file. Please check format and required columns"}, 0, {}
     if template is None:
-        return {'display': 'block'}, "Error: Could not load template file. Please check format and placeholders", 0
-        
-    ctx = callback_context
-    button_id = ctx.triggered[0]['prop_id'].split('.')[0]
-    
-    if button_id == 'prev-preview':
-        current_index = max(0, current_index - 1)
-    elif button_id == 'next-preview':
-        if current_content:
-            # Remove the preview header if it exists
-            content_parts = current_content.split("\n\n", 1)
-            if len(content_parts) > 1:
-                edited_templates[str(current_index)] = content_parts[1]
-            else:
-                edited_templates[str(current_index)] = current_content
-        current_index = min(len(df) - 1, current_index + 1)
-    
+        return {'display': 'block'}, {'error': "Error: Could not load template file. Please check format and placeholders"}, 0, {}
+
     try:
-        # Get the email content
-        email_content = edited_templates.get(str(current_index), template)
-        email_content = email_content.replace("X", str(df.iloc[current_index]["Last Name"]))
-        email_content = email_content.replace("Y", str(df.iloc[current_index]["Fund Name"]))
-        email_content = email_content.replace("Z", str(df.iloc[current_index]["Port-Co"]))
-        
-        # Add preview header
-        preview_header = f"Preview {current_index + 1} of {len(df)}"
-        preview_text = f"{preview_header}\n\n{email_content}"
-        
+        upload_key = edit_key(excel_upload_id, template_upload_id)
+        flush_preview_edits(session_id, upload_key, pending_edits)
+        window = render_preview_window(store, template, session_id, upload_key, center,
+                                       placeholder_mapping(column_mapping))
     except Exception as e:
         logging.error(f"Error personalizing preview: {str(e)}")
-        return {'display': 'block'}, "Error: Could not generate preview", current_index
-        
-    return {'display': 'block'}, preview_text, current_index
+        return {'display': 'block'}, {'error': "Error: Could not generate preview"}, no_update, no_update
 
-@app.callback(
-    [Output('send-status', 'children'),
-     Output('progress-status', 'children')],
+    # Edits are now part of the rendered window, so a fresh preview starts clean
+    if starting:
+        return {'display': 'block'}, window, 0, {}
+    return {'display': 'block'}, window, no_update, no_update
+
+
+# Previous/Next page through the rendered window in the browser. Edits to the current
+# preview are kept client-side until the next window fetch or send flushes them, and a
+# new window is requested once the index gets within `margin` of the window's edge.
+app.clientside_callback(
+    """
+    function(prevClicks, nextClicks, index, win, pending, content) {
+        const noUpdate = window.dash_clientside.no_update;
+        if (!win || win.error || !win.items) {
+            return [noUpdate, noUpdate, noUpdate, "", ""];
+        }
+        const trigger = window.dash_clientside.callback_context.triggered[0].prop_id.split('.')[0];
+        const step = trigger === 'prev-preview' ? -1 : 1;
+
+        pending = Object.assign({}, pending || {});
+        const offset = index - win.start;
+        const shown = pending[index] !== undefined ? pending[index]
+            : (offset >= 0 && offset < win.items.length
+                ? 'Preview ' + (index + 1) + ' of ' + win.total + '\\n\\n' + win.items[offset]
+                : null);
+        if (content && shown !== null && content !== shown) {
+            pending[index] = content;
+        }
+
+        const next = Math.max(0, Math.min(win.total - 1, index + step));
+        const end = win.start + win.items.length;
+        let request = noUpdate;
+        if ((next < win.start + win.margin && win.start > 0) ||
+                (next >= end - win.margin && end < win.total)) {
+            request = {index: next, requested: Date.now()};
+        }
+        return [next, pending, request, "", ""];
+    }
+    """,
+    [Output('preview-index', 'data'),
+     Output('preview-pending-edits', 'data'),
+     Output('preview-window-request', 'data'),
+     Output('send-status', 'children', allow_duplicate=True),
+     Output('progress-status', 'children', allow_duplicate=True)],
     [Input('prev-preview', 'n_clicks'),
-     Input('next-preview', 'n_clicks'),
-     Input('preview-btn', 'n_clicks')]
+     Input('next-preview', 'n_clicks')],
+    [State('preview-index', 'data'),
+     State('preview-window', 'data'),
+     State('preview-pending-edits', 'data'),
+     State('preview-content', 'value')],
+    prevent_initial_call=True
+)
+
+# Show the current preview from local edits or the rendered window
+app.clientside_callback(
+    """
+    function(index, win, pending) {
+        if (!win) {
+            return window.dash_clientside.no_update;
+        }
+        if (win.error) {
+            return win.error;
+        }
+        if (pending && pending[index] !== undefined) {
+            return pending[index];
+        }
+        const offset = index - win.start;
+        if (offset < 0 || offset >= win.items.length) {
+            return 'Loading preview ' + (index + 1) + ' of ' + win.total + '...';
+        }
+        return 'Preview ' + (index + 1) + ' of ' + win.total + '\\n\\n' + win.items[offset];
+    }
+    """,
+    Output('preview-content', 'value'),
+    [Input('preview-index', 'data'),
+     Input('preview-window', 'data')],
+    State('preview-pending-edits', 'data')
+)
+
+# A new file or template makes the shown preview and unsaved edits stale: they were
+# rendered for other recipients, so drop them rather than send them to this upload's rows
+app.clientside_callback(
+    """
+    function(excelUploadId, templateUploadId) {
+        return [{}, null, 0, ""];
+    }
+    """,
+    [Output('preview-pending-edits', 'data', allow_duplicate=True),
+     Output('preview-window', 'data', allow_duplicate=True),
+     Output('preview-index', 'data', allow_duplicate=True),
+     Output('preview-content', 'value', allow_duplicate=True)],
+    [Input('excel-upload-id', 'data'),
+     Input('template-upload-id', 'data')],
+    prevent_initial_call=True
+)
+
+# Clear status messages when starting a preview
+app.clientside_callback(
+    """
+    function(previewClicks) {
+        return ["", ""];
+    }
+    """,
+    [Output('send-status', 'children', allow_duplicate=True),
+     Output('progress-status', 'children', allow_duplicate=True)],
+    Input('preview-btn', 'n_clicks'),
+    prevent_initial_call=True
 )
-def clear_status_messages(prev_clicks, next_clicks, preview_clicks):
-    """Clear status messages when navigating previews"""
-    return "", ""
\ No newline at end of file
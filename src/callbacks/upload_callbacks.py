@@ -1,29 +1,59 @@
-from dash import Input, Output, State, html
+from dash import Input, Output, State, ALL, html, no_update
 import dash_bootstrap_components as dbc
 from src.app import app
 from src.utils.excel_parser import parse_excel
+from src.utils.upload_join import merge_uploads
+from src.utils.upload_store import upload_store
+from src.utils.attachments import save_attachment
+import logging
 
 @app.callback(
     [Output('excel-upload-status', 'children'),
      Output('template-upload-status', 'children'),
      Output('column-mapping-section', 'style'),
      Output('column-mapping-inputs', 'children'),
-     Output('excel-columns', 'data')],
+     Output('excel-columns', 'data'),
+     Output('excel-upload-id', 'data'),
+     Output('template-upload-id', 'data'),
+     Output('upload-excel', 'contents'),
+     Output('upload-template', 'contents')],
     [Input('upload-excel', 'contents'),
-     Input('upload-template', 'contents')]
+     Input('upload-template', 'contents')],
+    [State('upload-excel', 'filename'),
+     State('join-key', 'value'),
+     State('excel-upload-id', 'data'),
+     State('template-upload-id', 'data')]
 )
-def update_upload_status(excel_contents, template_contents):
-    """Update upload status and show column mapping interface"""
-    excel_status = "✓ Excel file uploaded successfully" if excel_contents else "No file uploaded"
-    template_status = "✓ Template file uploaded successfully" if template_contents else "No file uploaded"
+def update_upload_status(excel_contents, template_contents, excel_filenames, join_key,
+                         excel_upload_id, template_upload_id):
+    """Store uploads server-side, update upload status and show column mapping interface"""
+    # Clearing the upload contents below re-triggers this callback with nothing to do
+    if not excel_contents and not template_contents:
+        return [no_update] * 9
+    
+    # Spool uploads once and hand the browser a short id instead of the file
+    excel_status = None
+    if excel_contents:
+        try:
+            excel_upload_id, excel_status = save_recipient_uploads(excel_contents, excel_filenames, join_key)
+        except Exception as e:
+            logging.error(f"Error merging uploads: {str(e)}")
+            excel_upload_id, excel_status = None, f"Error: {str(e)}"
+    if template_contents:
+        template_upload_id = upload_store.save(template_contents)
+    ids = [excel_upload_id, template_upload_id, None, None]
+    
+    if excel_status is None:
+        excel_status = "✓ Excel file uploaded successfully" if excel_upload_id else "No file uploaded"
+    template_status = "✓ Template file uploaded successfully" if template_upload_id else "No file uploaded"
     
     # Handle column mapping section
-    if not excel_contents:
-        return excel_status, template_status, {'display': 'none'}, [], []
+    if not excel_upload_id:
+        return [excel_status, template_status, {'display': 'none'}, [], []] + ids
         
-    columns = parse_excel(excel_contents)
+    columns = parse_excel(excel_upload_id)
     if not columns:
-        return excel_status, template_status, {'display': 'none'}, [], []
+        return [excel_status, template_status, {'display': 'none'}, [], []] + ids
     
     mapping_inputs = []
     for col in columns:
@@ -41,7 +71,55 @@ def update_upload_status(excel_contents, template_contents):
             ])
         ])
     
-    return excel_status, template_status, {'display': 'block'}, mapping_inputs, columns
+    return [excel_status, template_status, {'display': 'block'}, mapping_inputs, columns] + ids
+
+def save_recipient_uploads(contents, filenames, join_key=None):
+    """Store a single upload as it is (its active sheet lists the recipients), or join
+    several files, or the sheets of one file given a join key, into one recipient
+    upload; returns (upload id, status message)"""
+    if len(contents) == 1 and not join_key:
+        return upload_store.save(contents[0]), "✓ Excel file uploaded successfully"
+    
+    merged, report = merge_uploads(list(zip(filenames, contents)), join_key)
+    lines = [f"✓ Merged {report['rows']} recipients from {report['recipients']} in {report['seconds']}s"]
+    for join in report['joins']:
+        line = f"+ {join['sheet']} on '{join['key']}'"
+        if join['unmatched']:
+            line += f" ({join['unmatched']} rows without a match)"
+        lines.append(line)
+    lines.extend(f"Skipped {reason}" for reason in report['skipped'])
+    return upload_store.save(merged), '\n'.join(lines)
+
+@app.callback(
+    [Output('attachment-upload-status', 'children'),
+     Output('attachment-names', 'data'),
+     Output('upload-attachments', 'contents')],
+    [Input('upload-attachments', 'contents')],
+    [State('upload-attachments', 'filename'),
+     State('attachment-names', 'data')]
+)
+def update_attachments(contents, filenames, attachment_names):
+    """Save attachments for every recipient to the attachment directory by name"""
+    if not contents:
+        return no_update, no_update, no_update
+    
+    names = list(attachment_names or [])
+    errors = []
+    for filename, file_contents in zip(filenames, contents):
+        try:
+            name = save_attachment(filename, file_contents)
+        except Exception as e:
+            logging.error(f"Error saving attachment {filename}: {str(e)}")
+            errors.append(filename)
+            continue
+        if name not in names:
+            names.append(name)
+    
+    status = [html.Div(f"📎 {name}") for name in names]
+    if errors:
+        status.append(html.Div(f"Could not save: {', '.join(errors)}", style={'color': '#E74C3C'}))
+    # The files live server-side; drop the data URLs from the browser
+    return status, names, None
 
 @app.callback(
     Output('placeholder-settings', 'data'),
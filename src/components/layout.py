@@ -1,3 +1,4 @@
+import uuid
 from dash import html, dcc
 import dash_bootstrap_components as dbc
 
@@ -5,6 +6,7 @@ def create_layout():
     return dbc.Container([
         html.H1("Email Automation Tool", className="text-center mb-4", style={'color': '#2C3E50'}),
         create_upload_section(),
+        create_column_mapping_section(),
         create_email_config_section(),
         create_preview_section(),
         create_action_buttons(),
@@ -23,13 +25,16 @@ def create_upload_section():
                         children=dbc.Card([
                             dbc.CardBody([
                                 html.I(className="fas fa-file-excel fa-3x mb-2", style={'color': '#27AE60'}),
-                                html.Div('Drag and Drop or Click to Select Excel File')
+                                html.Div('Drag and Drop or Click to Select Excel Files')
                             ])
                         ], className="text-center"),
-                        className='upload-box mb-3'
+                        className='upload-box mb-3',
+                        multiple=True
                     ),
-                    html.Div(id='excel-upload-status', style={'color': '#27AE60'})
-                ], width=6),
+                    dbc.Input(id='join-key', type='text', size='sm', className='mb-2',
+                              placeholder='Join sheets/files on column (default: shared column)'),
+                    html.Div(id='excel-upload-status', style={'color': '#27AE60', 'whiteSpace': 'pre-line'})
+                ], width=4),
                 dbc.Col([
                     dcc.Upload(
                         id='upload-template',
@@ -42,11 +47,34 @@ def create_upload_section():
                         className='upload-box mb-3'
                     ),
                     html.Div(id='template-upload-status', style={'color': '#2980B9'})
-                ], width=6),
+                ], width=4),
+                dbc.Col([
+                    dcc.Upload(
+                        id='upload-attachments',
+                        children=dbc.Card([
+                            dbc.CardBody([
+                                html.I(className="fas fa-paperclip fa-3x mb-2", style={'color': '#8E44AD'}),
+                                html.Div('Drag and Drop or Click to Select Attachments')
+                            ])
+                        ], className="text-center"),
+                        className='upload-box mb-3',
+                        multiple=True
+                    ),
+                    html.Div(id='attachment-upload-status', style={'color': '#8E44AD'})
+                ], width=4),
             ])
         ])
     ], className="mb-4 shadow")
 
+def create_column_mapping_section():
+    return dbc.Card([
+        dbc.CardBody([
+            html.H4("Column Mapping", className="card-title", style={'color': '#34495E'}),
+            html.Div(id='column-mapping-inputs'),
+            dbc.Button("Save Mapping", id="save-mapping", color="secondary", className="mt-2")
+        ])
+    ], className="mb-4 shadow", id='column-mapping-section', style={'display': 'none'})
+
 def create_email_config_section():
     return dbc.Card([
         dbc.CardBody([
@@ -91,6 +119,16 @@ def create_email_config_section():
                         placeholder="Select Size"
                     ),
                 ], width=4)
+            ]),
+            dbc.Row([
+                dbc.Col([
+                    html.Label("Start sending at (optional)"),
+                    dbc.Input(id="schedule-start", type="datetime-local", className="mb-3"),
+                ], width=6),
+                dbc.Col([
+                    html.Label("Spread over hours (0 = as fast as allowed)"),
+                    dbc.Input(id="schedule-window", type="number", min=0, step=0.5, value=0, className="mb-3"),
+                ], width=6)
             ])
         ])
     ], className="mb-4 shadow")
@@ -123,22 +161,33 @@ def create_action_buttons():
 def create_progress_section():
     return dbc.Row([
         dbc.Col([
-            dcc.Loading(
-                id="loading",
-                children=[
-                    html.Div(id="progress-status", style={'color': '#2C3E50'}),
-                    dbc.Progress(id="send-progress", value=0, className="mb-3",
-                               style={'height': '20px'}),
-                    html.Div(id="send-status", style={'color': '#27AE60'})
-                ],
-                type="circle"
-            )
+            html.Div(id="progress-status", style={'color': '#2C3E50', 'whiteSpace': 'pre-line'}),
+            dbc.Progress(id="send-progress", value=0, className="mb-3",
+                       style={'height': '20px'}),
+            html.Div([
+                dbc.Button("Pause", id="pause-send", color="warning", size="sm", className="me-2"),
+                dbc.Button("Resume", id="resume-send", color="secondary", size="sm", className="me-2"),
+                dbc.Button("Cancel", id="cancel-send", color="danger", size="sm"),
+            ], id="send-controls", className="text-center mb-3", style={'display': 'none'}),
+            html.Div(id="send-status", style={'color': '#27AE60'}),
+            html.Div(id="schedule-status", style={'color': '#7F8C8D'}),
+            dcc.Interval(id="job-poll", interval=1000, disabled=True),
+            dcc.Interval(id="schedule-poll", interval=5000)
         ])
     ])
 
 def create_store_components():
     return html.Div([
         dcc.Store(id='preview-index', data=0),
-        dcc.Store(id='edited-templates', data={}),
-        dcc.Store(id='sent-emails', data=[])
+        dcc.Store(id='preview-window', data=None),
+        dcc.Store(id='preview-window-request', data=None),
+        dcc.Store(id='preview-pending-edits', data={}),
+        dcc.Store(id='session-id', data=uuid.uuid4().hex),
+        dcc.Store(id='excel-upload-id', data=None),
+        dcc.Store(id='template-upload-id', data=None),
+        dcc.Store(id='excel-columns', data=[]),
+        dcc.Store(id='placeholder-settings', data={}),
+        dcc.Store(id='sent-emails', data=[]),
+        dcc.Store(id='attachment-names', data=[]),
+        dcc.Store(id='send-job-id', data=None)
     ])
\ No newline at end of file
@@ -2,14 +2,21 @@ import logging
 from datetime import datetime
 import os
 
-# Ensure logs directory exists
-os.makedirs('logs', exist_ok=True)
-
-# Logging configuration
+# Logging configuration; the directory and files are only created by init_logging().
+# Records are queued and written by a background thread unless LOG_QUEUE is off, files
+# rotate at LOG_MAX_MB or on the LOG_ROTATE_WHEN schedule (e.g. 'midnight'), and
+# per-recipient send outcomes go to a separate JSON-lines file.
+LOG_DIR = os.getenv('LOG_DIR', 'logs')
+_LOG_STAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 LOGGING_CONFIG = {
-    'filename': f'logs/email_automation_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log',
+    'filename': os.path.join(LOG_DIR, f'email_automation_{_LOG_STAMP}.log'),
+    'delivery_filename': os.path.join(LOG_DIR, f'deliveries_{_LOG_STAMP}.jsonl'),
     'level': logging.INFO,
-    'format': '%(asctime)s - %(levelname)s - %(message)s'
+    'format': '%(asctime)s - %(levelname)s - %(message)s',
+    'queue': os.getenv('LOG_QUEUE', 'true').lower() not in ('0', 'false', 'no'),
+    'max_bytes': int(os.getenv('LOG_MAX_MB', '100')) * 1024 * 1024,
+    'when': os.getenv('LOG_ROTATE_WHEN', ''),
+    'backup_count': int(os.getenv('LOG_BACKUP_COUNT', '10'))
 }
 
 # Dynamic columns and placeholders (will be set at runtime)
@@ -17,9 +24,64 @@ REQUIRED_COLUMNS = []
 STANDARD_COLUMNS = []
 REQUIRED_PLACEHOLDERS = []
 
+# Placeholders filled unless the saved column mapping assigns them to other columns
+DEFAULT_PLACEHOLDER_MAPPING = {
+    "Last Name": "X",
+    "Fund Name": "Y",
+    "Port-Co": "Z"
+}
+
 # Storage keys for settings
 PLACEHOLDER_SETTINGS_KEY = "placeholder_settings"
 COLUMN_MAPPING_KEY = "column_mapping"
 
 # Email configuration
 DEFAULT_EMAIL_SERVICE = "outlook"
+
+# Server-side spool for uploads and edited previews, referenced by short ids
+UPLOAD_STORE_DIR = os.getenv('UPLOAD_STORE_DIR', os.path.join('data', 'uploads'))
+UPLOAD_TTL_SECONDS = int(os.getenv('UPLOAD_TTL_SECONDS', str(6 * 3600)))
+
+# Previews rendered per server round trip; the browser pages through them locally
+PREVIEW_WINDOW_SIZE = int(os.getenv('PREVIEW_WINDOW_SIZE', '50'))
+
+# Parsed upload cache budget (decoded DataFrames and templates)
+UPLOAD_CACHE_MAX_BYTES = int(os.getenv('UPLOAD_CACHE_MAX_MB', '256')) * 1024 * 1024
+
+# Rows per chunk when streaming large recipient lists into the send pipeline
+INGEST_CHUNK_SIZE = int(os.getenv('INGEST_CHUNK_SIZE', '1000'))
+
+# Attachments: uploaded files are saved to ATTACHMENT_DIR, and ATTACHMENT_COLUMN of an
+# upload may name further files there per recipient (separated by ';'). Each file is
+# encoded once and shared by every message, within ATTACHMENT_CACHE_MAX_MB.
+ATTACHMENT_DIR = os.getenv('ATTACHMENT_DIR', os.path.join('data', 'attachments'))
+ATTACHMENT_COLUMN = os.getenv('ATTACHMENT_COLUMN', 'attachments')
+ATTACHMENT_CACHE_MAX_BYTES = int(os.getenv('ATTACHMENT_CACHE_MAX_MB', '256')) * 1024 * 1024
+ATTACHMENT_MMAP_THRESHOLD = int(os.getenv('ATTACHMENT_MMAP_THRESHOLD_KB', '1024')) * 1024
+
+# Durable per-recipient send ledger used to resume interrupted runs
+SEND_LEDGER_PATH = os.getenv('SEND_LEDGER_PATH', os.path.join('data', 'send_ledger.db'))
+LEDGER_COMMIT_BATCH = int(os.getenv('LEDGER_COMMIT_BATCH', '50'))
+LEDGER_COMMIT_INTERVAL = float(os.getenv('LEDGER_COMMIT_INTERVAL', '1.0'))
+
+# Scheduled sends: campaigns wait for their start time and are spread over a window,
+# single sends from the preview pane go first. The queue survives restarts.
+SCHEDULER_DB_PATH = os.getenv('SCHEDULER_DB_PATH', os.path.join('data', 'scheduler.db'))
+SCHEDULER_SYNC_INTERVAL = float(os.getenv('SCHEDULER_SYNC_INTERVAL', '60'))
+SEND_CURRENT_WAIT_SECONDS = float(os.getenv('SEND_CURRENT_WAIT_SECONDS', '30'))
+
+# Addresses never mailed again (hard bounces, unsubscribes), screened out before rendering
+SUPPRESSION_DB_PATH = os.getenv('SUPPRESSION_DB_PATH', os.path.join('data', 'suppressions.db'))
+SUPPRESSION_FALSE_POSITIVE_RATE = float(os.getenv('SUPPRESSION_FALSE_POSITIVE_RATE', '0.001'))
+# Opt-in: suppress recipients refused with a mailbox-level (5.1.x) hard bounce
+SUPPRESS_BOUNCES = os.getenv('SUPPRESS_BOUNCES', 'false').lower() in ('1', 'true', 'yes')
+
+# Sharded sending: a JSON file listing several sender accounts/relays, each sent
+# from by its own worker process (see src/utils/sharded_sender.py)
+SEND_ACCOUNTS_FILE = os.getenv('SEND_ACCOUNTS_FILE', '')
+
+# Import pandas/openpyxl during init_app() instead of on the first upload
+PRELOAD_DEPENDENCIES = os.getenv('PRELOAD_DEPENDENCIES', 'false').lower() in ('1', 'true', 'yes')
+
+# Stage timings and send counters exposed at /metrics
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() not in ('0', 'false', 'no')
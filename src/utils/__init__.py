@@ -1,3 +1,21 @@
-from .excel_parser import parse_excel
-from .template_parser import parse_template
-from .email_sender import EmailSender
\ No newline at end of file
+import importlib
+
+# Re-exports are resolved on first access so importing one utility module
+# does not load every other one (and pandas) with it
+_EXPORTS = {
+    'parse_excel': 'excel_parser',
+    'load_excel_dataframe': 'excel_parser',
+    'load_recipient_store': 'excel_parser',
+    'iter_recipient_chunks': 'excel_parser',
+    'parse_template': 'template_parser',
+    'EmailSender': 'email_sender',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(f'.{module_name}', __name__), name)
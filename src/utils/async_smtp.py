@@ -0,0 +1,335 @@
+import asyncio
+import base64
+import logging
+import smtplib
+import socket
+import ssl
+import threading
+import time
+from src.utils.metrics import smtp_phase
+from src.utils.smtp_pool import NOOP_CHECK_INTERVAL, RECONNECT_CODES, data_chunks
+
+CRLF = b'\r\n'
+
+
+class AsyncSMTPConnection:
+    """One ESMTP session driven by asyncio streams.
+
+    Failures are raised as the smtplib exception types, so retry classification and
+    pool handling work the same as for the blocking transport.
+    """
+
+    def __init__(self, host, port, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.features = {}
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+    async def connect(self):
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), self.timeout
+            )
+        except OSError as e:
+            raise smtplib.SMTPConnectError(-1, str(e).encode()) from e
+        code, message = await self.read_reply()
+        if code != 220:
+            self.close()
+            raise smtplib.SMTPConnectError(code, message)
+
+    async def read_reply(self):
+        """Read a (possibly multi-line) reply as (code, message)"""
+        lines = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            try:
+                code = int(line[:3])
+            except ValueError:
+                raise smtplib.SMTPResponseException(-1, line)
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                return code, b'\n'.join(lines)
+
+    async def write(self, data):
+        self.writer.write(data)
+        # Waits while the socket buffer is full, so a slow server pushes back on us
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+    async def command(self, line):
+        await self.write(line.encode('ascii') + CRLF)
+        return await self.read_reply()
+
+    async def ehlo(self):
+        code, message = await self.command(f"EHLO {socket.getfqdn()}")
+        if code != 250:
+            code, message = await self.command(f"HELO {socket.getfqdn()}")
+            if code != 250:
+                raise smtplib.SMTPHeloError(code, message)
+            self.features = {}
+            return
+        self.features = {}
+        for line in message.decode('latin-1').split('\n')[1:]:
+            name, _, argument = line.partition(' ')
+            self.features[name.lower()] = argument
+
+    def has_extn(self, name):
+        return name.lower() in self.features
+
+    async def starttls(self, context):
+        code, message = await self.command("STARTTLS")
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, message)
+        await asyncio.wait_for(self.writer.start_tls(context, server_hostname=self.host), self.timeout)
+        await self.ehlo()
+
+    async def login(self, username, password):
+        mechanisms = self.features.get('auth', '').upper().split()
+        if 'PLAIN' in mechanisms or 'LOGIN' not in mechanisms:
+            token = base64.b64encode(f"\0{username}\0{password}".encode('utf-8')).decode('ascii')
+            code, message = await self.command(f"AUTH PLAIN {token}")
+        else:
+            code, message = await self.command("AUTH LOGIN")
+            for value in (username, password):
+                if code != 334:
+                    break
+                code, message = await self.command(base64.b64encode(value.encode('utf-8')).decode('ascii'))
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, message)
+
+    async def sendmail(self, from_addr, to_addrs, msg_bytes):
+        """Send one message to several recipients, returning the refused ones like SMTP.sendmail.
+
+        The envelope is pipelined when the server advertises PIPELINING.
+        """
+        options = f" SIZE={len(msg_bytes)}" if self.has_extn('size') else ''
+        commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}{options}"]
+        commands.extend(f"RCPT TO:{smtplib.quoteaddr(recipient)}" for recipient in to_addrs)
+        commands.append("DATA")
+        if self.has_extn('pipelining'):
+            await self.write(b''.join(command.encode('ascii') + CRLF for command in commands))
+            replies = [await self.read_reply() for _ in commands]
+        else:
+            replies = [await self.command(command) for command in commands]
+        mail_reply, rcpt_replies, (data_code, data_message) = replies[0], replies[1:-1], replies[-1]
+
+        refused = {recipient: reply for recipient, reply in zip(to_addrs, rcpt_replies)
+                   if reply[0] not in (250, 251)}
+        error = None
+        if mail_reply[0] != 250:
+            error = smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], from_addr)
+        elif len(refused) == len(to_addrs):
+            error = smtplib.SMTPRecipientsRefused(refused)
+        elif data_code != 354:
+            error = smtplib.SMTPDataError(data_code, data_message)
+        if error is not None:
+            if data_code == 354:
+                # The server is waiting for a body we no longer want to send
+                await self.write(b'.' + CRLF)
+                await self.read_reply()
+            if mail_reply[0] != 421:
+                await self.command("RSET")
+            raise error
+
+        for chunk in data_chunks(msg_bytes):
+            await self.write(chunk)
+        code, message = await self.read_reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, message)
+        return refused
+
+    async def noop(self):
+        return (await self.command("NOOP"))[0]
+
+    async def quit(self):
+        try:
+            await self.command("QUIT")
+        except Exception:
+            pass
+        self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class EventLoopThread:
+    """A background event loop shared by every asyncio transport in the process"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='smtp-event-loop', daemon=True)
+        self.thread.start()
+
+    def run(self, coroutine):
+        """Run a coroutine on the loop and block until it finishes"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def get_loop_thread():
+    global _loop_thread
+    with _loop_lock:
+        if _loop_thread is None:
+            _loop_thread = EventLoopThread()
+        return _loop_thread
+
+
+class AsyncSMTPPool:
+    """Authenticated asyncio SMTP sessions, many in flight on a single thread.
+
+    Offers the same blocking sendmail() as SMTPConnectionPool, plus sendmail_async()
+    and run() for callers that drive whole batches as coroutines on the loop.
+    """
+    is_async = True
+
+    def __init__(self, host, port, username, password, size=100,
+                 max_messages_per_connection=100, timeout=30, use_starttls=True, verify_tls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = max(1, int(size))
+        self.max_messages_per_connection = max(1, int(max_messages_per_connection))
+        self.timeout = timeout
+        self.use_starttls = use_starttls
+        self.verify_tls = verify_tls
+
+        self._idle = []
+        self._slots = None
+        self._closed = False
+        self._loop_thread = get_loop_thread()
+
+    def tls_context(self):
+        context = ssl.create_default_context()
+        if not self.verify_tls:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        return context
+
+    async def _connect(self):
+        """Open a new session and run EHLO, STARTTLS and AUTH"""
+        conn = AsyncSMTPConnection(self.host, self.port, self.timeout)
+        with smtp_phase('connect'):
+            await conn.connect()
+        try:
+            await conn.ehlo()
+            if self.use_starttls:
+                with smtp_phase('starttls'):
+                    await conn.starttls(self.tls_context())
+            with smtp_phase('auth'):
+                await conn.login(self.username, self.password)
+        except Exception:
+            await conn.quit()
+            raise
+        logging.info(f"Opened async SMTP connection to {self.host}:{self.port}")
+        return conn
+
+    async def acquire(self):
+        """Take a healthy session, waiting while `size` sessions are already busy"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        await self._slots.acquire()
+        try:
+            while self._idle:
+                conn = self._idle.pop()
+                if time.monotonic() - conn.last_used < NOOP_CHECK_INTERVAL:
+                    return conn
+                try:
+                    if await conn.noop() == 250:
+                        return conn
+                except Exception:
+                    pass
+                await conn.quit()
+            return await self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+    async def release(self, conn, discard=False):
+        """Return a session to the pool, recycling it if worn out or broken"""
+        try:
+            conn.last_used = time.monotonic()
+            if (discard or self._closed
+                    or conn.messages_sent >= self.max_messages_per_connection):
+                await conn.quit()
+            else:
+                self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    async def sendmail_async(self, from_addr, to_addrs, msg_bytes):
+        """Send a serialised message; a dropped session is discarded and the error
+        raised for the sender's retry policy, like SMTPConnectionPool"""
+        conn = await self.acquire()
+        try:
+            with smtp_phase('transaction'):
+                refused = await conn.sendmail(from_addr, to_addrs, msg_bytes)
+        except (smtplib.SMTPServerDisconnected, ConnectionError, asyncio.TimeoutError):
+            await self.release(conn, discard=True)
+            raise
+        except smtplib.SMTPResponseException as e:
+            await self.release(conn, discard=e.smtp_code in RECONNECT_CODES)
+            raise
+        except smtplib.SMTPRecipientsRefused:
+            await self.release(conn)
+            raise
+        except Exception:
+            await self.release(conn, discard=True)
+            raise
+        conn.messages_sent += 1
+        await self.release(conn)
+        return refused
+
+    def sendmail(self, from_addr, to_addrs, msg_bytes):
+        """Blocking sendmail for callers outside the event loop"""
+        return self.run(self.sendmail_async(from_addr, to_addrs, msg_bytes))
+
+    def run(self, coroutine):
+        """Run a coroutine on the shared SMTP event loop and wait for its result"""
+        return self._loop_thread.run(coroutine)
+
+    async def _close(self):
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await conn.quit()
+
+    def close(self):
+        """Close all idle sessions; in-use sessions close when released"""
+        self.run(self._close())
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_async_pool(host, port, username, password, size=100, max_messages_per_connection=100,
+                   use_starttls=True, verify_tls=True):
+    """Return the shared asyncio pool for an SMTP account, creating it on first use"""
+    key = (host, port, username)
+    size = max(1, int(size))
+    max_messages_per_connection = max(1, int(max_messages_per_connection))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if (pool is None or pool._closed or pool.password != password
+                or pool.size != size or pool.use_starttls != use_starttls
+                or pool.verify_tls != verify_tls
+                or pool.max_messages_per_connection != max_messages_per_connection):
+            if pool is not None:
+                pool.close()
+            pool = AsyncSMTPPool(host, port, username, password, size=size,
+                                 max_messages_per_connection=max_messages_per_connection,
+                                 use_starttls=use_starttls, verify_tls=verify_tls)
+            _pools[key] = pool
+        return pool
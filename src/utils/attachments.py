@@ -0,0 +1,195 @@
+import base64
+import binascii
+import logging
+import mimetypes
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from email.utils import encode_rfc2231
+from src.config.settings import (ATTACHMENT_DIR, ATTACHMENT_COLUMN, ATTACHMENT_CACHE_MAX_BYTES,
+                                 ATTACHMENT_MMAP_THRESHOLD)
+
+CRLF = b'\r\n'
+
+# Raw bytes per base64 line; 57 bytes encode to the 76 characters RFC 2045 allows
+BASE64_LINE_BYTES = 57
+BASE64_LINE_CHARS = 76
+
+# Raw bytes encoded per step: whole lines, so consecutive blocks need no padding
+BASE64_BLOCK_BYTES = BASE64_LINE_BYTES * 1024
+
+# Oversized attachments remembered so the cache warns about each only once
+TOO_LARGE_REMEMBERED = 256
+
+# Separators between file names in an upload's attachment column
+NAME_SEPARATOR = re.compile(r'[;\n]')
+
+
+def safe_filename(filename):
+    """Reduce an uploaded file name to a plain name inside the attachment directory"""
+    name = os.path.basename(str(filename).replace('\\', '/')).strip()
+    name = re.sub(r'[\x00-\x1f]', '', name)
+    if name in ('', '.', '..'):
+        raise ValueError(f"Invalid attachment name: {filename!r}")
+    return name
+
+
+def attachment_path(name, directory=ATTACHMENT_DIR):
+    """Resolve an attachment name to a file in the attachment directory"""
+    root = os.path.realpath(directory)
+    path = os.path.realpath(os.path.join(root, str(name).strip()))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Attachment {name!r} is outside the attachment directory")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Attachment {name!r} not found")
+    return path
+
+
+def save_attachment(filename, contents, directory=ATTACHMENT_DIR):
+    """Save a dcc.Upload data URL into the attachment directory, returning its name"""
+    name = safe_filename(filename)
+    _, content_string = contents.split(',', 1)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(base64.b64decode(content_string))
+    os.replace(temp_path, path)
+    return name
+
+
+def find_attachment_column(columns):
+    """The column naming per-recipient attachments (ATTACHMENT_COLUMN, any case), or None"""
+    return next((col for col in columns if str(col).strip().lower() == ATTACHMENT_COLUMN.lower()), None)
+
+
+def split_attachment_names(value):
+    """File names listed in one cell of the attachment column"""
+    if value is None or value in ('', 'None', 'nan'):
+        return []
+    return [name.strip() for name in NAME_SEPARATOR.split(str(value)) if name.strip()]
+
+
+def base64_lines_size(size):
+    """Length of the CRLF-terminated base64 lines encoding `size` raw bytes"""
+    lines = -(-size // BASE64_LINE_BYTES)
+    return 4 * -(-size // 3) + len(CRLF) * lines
+
+
+def encode_base64_lines(data, head=b''):
+    """Base64-encode a bytes-like object into CRLF-terminated 76 character lines after `head`.
+
+    The output is written block by block into one buffer of its final size, so
+    encoding holds little more than the result; it is returned as a read-only
+    memoryview because the cache shares it between messages.
+    """
+    out = bytearray(len(head) + base64_lines_size(len(data)))
+    out[:len(head)] = head
+    position = len(head)
+    with memoryview(data) as view:
+        for start in range(0, len(view), BASE64_BLOCK_BYTES):
+            encoded = memoryview(binascii.b2a_base64(view[start:start + BASE64_BLOCK_BYTES], newline=False))
+            for line in range(0, len(encoded), BASE64_LINE_CHARS):
+                chunk = encoded[line:line + BASE64_LINE_CHARS]
+                end = position + len(chunk)
+                out[position:end] = chunk
+                out[end:end + len(CRLF)] = CRLF
+                position = end + len(CRLF)
+    return memoryview(out).toreadonly()
+
+
+def encode_attachment(path):
+    """Return the MIME part (headers and base64 body, without boundary) for a file.
+
+    Files from ATTACHMENT_MMAP_THRESHOLD up are memory-mapped rather than read, so
+    only the encoded copy is held in memory. The part is a read-only memoryview.
+    """
+    name = os.path.basename(path)
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    try:
+        name.encode('ascii')
+        quoted = name.replace('\\', '\\\\').replace('"', '\\"')
+        disposition = f'attachment; filename="{quoted}"'
+    except UnicodeEncodeError:
+        disposition = f"attachment; filename*={encode_rfc2231(name, 'utf-8')}"
+    head = CRLF.join([
+        f'Content-Type: {content_type}'.encode('ascii'),
+        b'MIME-Version: 1.0',
+        b'Content-Transfer-Encoding: base64',
+        f'Content-Disposition: {disposition}'.encode('ascii'),
+        b'',
+        b'',
+    ])
+
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if size >= ATTACHMENT_MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return encode_base64_lines(mapped, head)
+        return encode_base64_lines(f.read(), head)
+
+
+class AttachmentCache:
+    """Size-bounded LRU cache of encoded attachment parts.
+
+    Each file is read and encoded once, and every message attaching it shares the
+    same buffer. Entries are keyed by path, size and modification time, so a
+    replaced file is encoded afresh.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._too_large = OrderedDict()
+
+    def get(self, name, directory=ATTACHMENT_DIR):
+        """Return the encoded MIME part for an attachment name"""
+        path = attachment_path(name, directory)
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            part = self._entries.get(key)
+            if part is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return part
+            self.misses += 1
+
+        part = encode_attachment(path)
+        if len(part) > self.max_bytes:
+            with self._lock:
+                warn = key not in self._too_large
+                self._too_large[key] = None
+                self._too_large.move_to_end(key)
+                if len(self._too_large) > TOO_LARGE_REMEMBERED:
+                    self._too_large.popitem(last=False)
+            if warn:
+                logging.warning(f"Attachment {name} ({len(part)} bytes encoded) is larger than the "
+                                f"attachment cache and is encoded for every use")
+            return part
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = part
+                self.current_bytes += len(part)
+            # Evict least recently used parts until we fit the budget
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.current_bytes -= len(evicted)
+        return part
+
+    def get_many(self, names, directory=ATTACHMENT_DIR):
+        return tuple(self.get(name, directory) for name in names)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+attachment_cache = AttachmentCache(ATTACHMENT_CACHE_MAX_BYTES)
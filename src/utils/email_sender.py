@@ -1,95 +1,548 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import asyncio
 import logging
 import os
+import smtplib
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from src.utils.smtp_pool import get_pool
+from src.utils.async_smtp import get_async_pool
+from src.utils.spool_transport import get_spool, SendmailTransport, SpoolFlushError
+from src.utils.rate_limiter import RateLimiter, AdaptiveRateLimiter
+from src.utils.retry_policy import classify_error, classify_code, backoff_delay, TRANSIENT
+from src.utils.template_parser import compile_template, strip_preview_header
+from src.utils.recipient_store import RecipientStore, find_email_column
+from src.utils.message_builder import HtmlShell, MessageBuilder
+from src.utils.metrics import timed, STAGE_SECONDS, MESSAGES_TOTAL, MESSAGE_BYTES_TOTAL
+from src.utils.log_setup import log_delivery
+from src.utils.suppression import get_suppression_list, is_hard_bounce
+from src.utils.attachments import attachment_cache, find_attachment_column, split_attachment_names
+from src.config.settings import SUPPRESS_BOUNCES
+
+# Seconds between checks of a paused job on the asyncio transport
+PAUSE_POLL_INTERVAL = 0.2
+
+# Message builders kept per sender; each holds its attachment parts alive
+MESSAGE_BUILDER_CACHE_SIZE = 16
 
 class EmailSender:
-    def __init__(self):
-        self.smtp_server = os.getenv('SMTP_SERVER', 'smtp.office365.com')
-        self.smtp_port = int(os.getenv('SMTP_PORT', '587'))
-        self.email_address = os.getenv('EMAIL_ADDRESS')
-        self.email_password = os.getenv('EMAIL_PASSWORD')
+    def __init__(self, account=None):
+        """Configure from the environment; `account` (see sharded_sender) overrides the
+        server, credentials and rate limits for one of several sending accounts"""
+        account = account or {}
+        self.smtp_server = account.get('smtp_server') or os.getenv('SMTP_SERVER', 'smtp.office365.com')
+        self.smtp_port = int(account.get('smtp_port') or os.getenv('SMTP_PORT', '587'))
+        self.smtp_starttls = str(account.get('starttls', os.getenv('SMTP_STARTTLS', 'true'))).lower() not in ('0', 'false', 'no')
+        self.email_address = account.get('email_address') or os.getenv('EMAIL_ADDRESS')
+        self.email_password = account.get('password') or os.getenv('EMAIL_PASSWORD')
+        self.smtp_pool_size = int(os.getenv('SMTP_POOL_SIZE', '4'))
+        self.smtp_max_messages_per_connection = int(os.getenv('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+        self.send_workers = int(os.getenv('SEND_WORKERS', str(self.smtp_pool_size)))
+        self.send_rate_per_second = float(account.get('rate_per_second') or os.getenv('SEND_RATE_PER_SECOND', '0'))
+        self.send_rate_per_minute = float(account.get('rate_per_minute') or os.getenv('SEND_RATE_PER_MINUTE', '0'))
+        self.send_max_attempts = int(os.getenv('SEND_MAX_ATTEMPTS', '4'))
+        self.retry_base_delay = float(os.getenv('SEND_RETRY_BASE_DELAY', '2'))
+        self.retry_max_delay = float(os.getenv('SEND_RETRY_MAX_DELAY', '60'))
+        self.adaptive_max_rate = float(os.getenv('SEND_ADAPTIVE_MAX_RATE', str(self.send_rate_per_second)))
+        self.coalesce_identical = os.getenv('SEND_COALESCE_IDENTICAL', 'false').lower() in ('1', 'true', 'yes')
+        self.max_recipients_per_message = max(1, int(os.getenv('SEND_MAX_RECIPIENTS_PER_MESSAGE', '50')))
+        self.smtp_transport = (account.get('transport') or os.getenv('SMTP_TRANSPORT', 'smtplib')).lower()
+        self.async_connections = int(os.getenv('SMTP_ASYNC_CONNECTIONS', '100'))
+        self.tls_verify = os.getenv('SMTP_TLS_VERIFY', 'true').lower() not in ('0', 'false', 'no')
         
-        if not all([self.email_address, self.email_password]):
+        # Local handoff transports only need a From address, SMTP sessions need credentials
+        if not self.email_address or (self.smtp_transport in ('smtplib', 'asyncio') and not self.email_password):
             raise ValueError("Email credentials not properly configured")
 
+        self._html_shells = {}
+        self._message_builders = OrderedDict()
+        self._message_builders_lock = threading.Lock()
+        self.rate_limiter = RateLimiter(self.send_rate_per_second, self.send_rate_per_minute)
+        self.adaptive_limiter = AdaptiveRateLimiter(self.adaptive_max_rate)
+
+        # Authenticated sessions are shared across sends and callbacks. Every transport
+        # offers sendmail(); the asyncio one also runs whole batches as coroutines, and
+        # the local ones (spool, sendmail) hand messages to an MTA on this machine.
+        if self.smtp_transport == 'spool':
+            self.pool = get_spool(
+                os.getenv('SPOOL_DIR', os.path.join('data', 'spool')),
+                shards=int(os.getenv('SPOOL_SHARDS', '16')),
+                fsync_batch=int(os.getenv('SPOOL_FSYNC_BATCH', '100')),
+                envelope=os.getenv('SPOOL_ENVELOPE_HEADERS', 'false').lower() in ('1', 'true', 'yes')
+            )
+            # Without envelope lines the MTA only has the undisclosed To: header to go by
+            if not self.pool.envelope:
+                self.coalesce_identical = False
+        elif self.smtp_transport == 'sendmail':
+            self.pool = SendmailTransport(os.getenv('SENDMAIL_PATH', '/usr/sbin/sendmail'))
+        elif self.smtp_transport == 'asyncio':
+            self.pool = get_async_pool(
+                self.smtp_server,
+                self.smtp_port,
+                self.email_address,
+                self.email_password,
+                size=self.async_connections,
+                max_messages_per_connection=self.smtp_max_messages_per_connection,
+                use_starttls=self.smtp_starttls,
+                verify_tls=self.tls_verify
+            )
+        elif self.smtp_transport == 'smtplib':
+            self.pool = get_pool(
+                self.smtp_server,
+                self.smtp_port,
+                self.email_address,
+                self.email_password,
+                size=max(self.smtp_pool_size, self.send_workers),
+                max_messages_per_connection=self.smtp_max_messages_per_connection,
+                use_starttls=self.smtp_starttls
+            )
+        else:
+            raise ValueError(f"Unknown SMTP transport: {self.smtp_transport}")
+
     def get_signature(self):
         """Get signature from environment variable or return empty string"""
         return os.getenv('EMAIL_SIGNATURE', '')
 
-    def format_email_body(self, body, font_family="Calibri", font_size="11"):
-        """Format the email body with HTML"""
-        style = 'body { ' + f'font-family: {font_family}; font-size: {font_size}pt;' + ' }'
-        html_parts = [
-            '<html>',
-            '<head>',
-            '<style>',
-            style,
-            '</style>',
-            '</head>',
-            '<body>',
-            body.replace('\n', '<br>'),
-            '<br><br>',
-            self.get_signature(),
-            '</body>',
-            '</html>'
-        ]
-        return '\n'.join(html_parts)
-
-    def send_email(self, recipient, subject, body, font_family="Calibri", font_size="11"):
-        """Send a single email"""
-        try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = self.email_address
-            msg['To'] = recipient
+    def get_html_shell(self, font_family="Calibri", font_size="11"):
+        """Return the cached HTML wrapper for a font setting"""
+        key = (font_family, font_size)
+        shell = self._html_shells.get(key)
+        if shell is None:
+            shell = self._html_shells[key] = HtmlShell(font_family, font_size, self.get_signature())
+        return shell
 
-            html_content = self.format_email_body(body, font_family, font_size)
-            msg.attach(MIMEText(html_content, 'html'))
+    def get_message_builder(self, subject, font_family="Calibri", font_size="11", attachments=()):
+        """Return the cached message builder for a subject, font setting and attachments
+        sent to every recipient"""
+        attachments = tuple(attachments)
+        # Encoded parts come from the attachment cache, which notices replaced files
+        parts = attachment_cache.get_many(attachments)
+        key = (subject, font_family, font_size, attachments, tuple(id(part) for part in parts))
+        with self._message_builders_lock:
+            builder = self._message_builders.get(key)
+            if builder is not None:
+                self._message_builders.move_to_end(key)
+                return builder
+        shell = self.get_html_shell(font_family, font_size)
+        builder = MessageBuilder(self.email_address, subject, shell, parts)
+        with self._message_builders_lock:
+            self._message_builders[key] = builder
+            # Drop the least recently used builders, and with them evicted or re-encoded parts
+            while len(self._message_builders) > MESSAGE_BUILDER_CACHE_SIZE:
+                self._message_builders.popitem(last=False)
+        return builder
 
-            with smtplib.SMTP(self.smtp_server, self.smtp_port) as server:
-                server.starttls()
-                server.login(self.email_address, self.email_password)
-                server.send_message(msg)
+    def format_email_body(self, body, font_family="Calibri", font_size="11"):
+        """Format the email body with HTML"""
+        return self.get_html_shell(font_family, font_size).render(body)
 
-            logging.info(f"Email sent successfully to {recipient}")
-            return True
+    @timed('send_email')
+    def send_email(self, recipient, subject, body, font_family="Calibri", font_size="11", attachments=()):
+        """Send a single email, attaching files from the attachment directory by name"""
+        try:
+            builder = self.get_message_builder(subject, font_family, font_size, attachments)
+            return self.send_prepared(recipient, builder.build(recipient, body))
         except Exception as e:
             logging.error(f"Failed to send email to {recipient}: {str(e)}")
             return False
 
-    def send_batch_emails(self, df, template, subject, placeholder_settings, edited_templates=None, 
-                         font_family="Calibri", font_size="11"):
-        """Send emails with dynamic placeholder replacement"""
-        total_emails = len(df)
+    def send_prepared(self, recipient, message):
+        """Send a message already serialised by a MessageBuilder, retrying transient
+        failures like a batch does"""
+        return bool(self.send_prepared_many([(recipient, message)])[0])
+
+    def deliver(self, recipient, message):
+        """Send a serialised message, raising the underlying SMTP error on failure"""
+        self.pool.sendmail(self.email_address, [recipient], message)
+
+    def flush_transport(self):
+        """Make messages handed to a buffering transport (the spool) durable and visible"""
+        flush = getattr(self.pool, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def deliver_many(self, recipients, message):
+        """Send one serialised message to several recipients in a single transaction.
+
+        Returns the refused recipients as {recipient: (code, message)}; raises if the
+        whole transaction failed.
+        """
+        return self.pool.sendmail(self.email_address, list(recipients), message)
+
+    async def deliver_async(self, recipients, message):
+        """deliver_many() for the asyncio transport, run on its event loop"""
+        return await self.pool.sendmail_async(self.email_address, list(recipients), message)
+
+    def send_batch_emails(self, df, template, subject, placeholder_settings=None, edited_templates=None, 
+                         font_family="Calibri", font_size="11", job=None, ledger=None, run_id=None,
+                         attachments=None):
+        """Send emails with dynamic placeholder replacement, reporting progress to `job` if given"""
+        return self.send_batch_chunks([df], template, subject, placeholder_settings, edited_templates,
+                                      font_family, font_size, job=job, ledger=ledger, run_id=run_id,
+                                      attachments=attachments)
+
+    @timed('send_batch')
+    def send_batch_chunks(self, chunks, template, subject, placeholder_settings=None, edited_templates=None,
+                          font_family="Calibri", font_size="11", job=None, ledger=None, run_id=None,
+                          attachments=None):
+        """Send emails from an iterable of DataFrame chunks, holding only one chunk in memory at a time.
+
+        With a ledger and run id, per-recipient state is checkpointed and rows already
+        sent in that run are skipped before rendering. `attachments` names files sent
+        to every recipient; an ATTACHMENT_COLUMN column adds per-recipient files.
+        """
+        total_emails = 0
         successful = 0
         failed_emails = []
+        checkpoint = None
+        if ledger is not None:
+            checkpoint = (ledger, run_id, ledger.sent_rows(run_id))
         
-        # Get email column (assuming it's named 'email' or similar)
-        email_column = next((col for col in df.columns if 'email' in col.lower()), None)
+        for df in chunks:
+            if job is not None and job.cancelled:
+                break
+            total_emails += len(df)
+            if job is not None and job.total < total_emails:
+                job.total = total_emails
+            
+            chunk_successful, chunk_failed = self._send_chunk(
+                df, template, subject, placeholder_settings or {}, edited_templates or {},
+                font_family, font_size, job, checkpoint, attachments or ()
+            )
+            successful += chunk_successful
+            failed_emails.extend(chunk_failed)
+        
+        # Correct any up-front row estimate once the whole stream has been read
+        if job is not None and not job.cancelled:
+            job.total = total_emails
+        
+        # Cancelled runs stay open so the next send resumes them
+        if ledger is not None and not (job is not None and job.cancelled):
+            ledger.finish_run(run_id)
+        
+        return successful, total_emails, failed_emails
+
+    def _send_chunk(self, df, template, subject, placeholder_settings, edited_templates,
+                    font_family, font_size, job, checkpoint=None, attachments=()):
+        """Render and send one DataFrame of recipients, returning (successful, failed_emails)"""
+        email_column = find_email_column(df.columns)
         if not email_column:
             logging.error("No email column found in DataFrame")
-            return 0, total_emails, []
+            return 0, []
+        
+        # Render every message to bytes up front so workers only do network I/O
+        render_started = time.perf_counter()
+        # A missing shared attachment fails the whole send rather than every row
+        builder = self.get_message_builder(subject, font_family, font_size, attachments)
+        compiled = compile_template(strip_preview_header(template), placeholder_settings, df.columns)
+        # Rows edited in the preview pane use their own template
+        edited_compiled = {
+            index: compile_template(strip_preview_header(edited), placeholder_settings, df.columns)
+            for index, edited in edited_templates.items()
+        }
+        
+        # Convert the chunk once into the columns its templates read
+        columns = set(compiled.columns)
+        for edited in edited_compiled.values():
+            columns.update(edited.columns)
+        attachment_column = find_attachment_column(df.columns)
+        if attachment_column is not None:
+            columns.add(attachment_column)
+        store = RecipientStore.from_frame(df, [col for col in df.columns if col in columns])
+        row_attachments = store.column(attachment_column) if attachment_column is not None else None
+        
+        previously_sent = 0
+        if checkpoint is not None:
+            ledger, run_id, sent_rows = checkpoint
+            store, previously_sent = store.without_rows(sent_rows)
+            if previously_sent and job is not None:
+                job.record_previously_sent(previously_sent)
+            ledger.queue(run_id, zip(store.index, store.emails))
+        
+        bodies = compiled.render_store(store)
+        
+        failed_emails = []
+        
+        def reject(index, recipient, error):
+            failed_emails.append(recipient)
+            if job is not None:
+                job.record(recipient, False)
+            if checkpoint is not None:
+                ledger.record(run_id, index, recipient, 'failed', str(error))
+            logging.error(f"Failed to send email to {recipient}: {str(error)}")
         
-        for index, row in df.iterrows():
+        rendered = []
+        for position, (index, recipient, email_body) in enumerate(zip(store.index, store.emails, bodies)):
             try:
-                email_body = edited_templates.get(str(index), template)
-                if "Preview" in email_body:
-                    email_body = email_body.split("\n\n", 1)[1]
+                edited = edited_compiled.get(str(index))
+                if edited is not None:
+                    email_body = edited.render(store[position])
+                names = ()
+                if row_attachments is not None:
+                    names = tuple(split_attachment_names(row_attachments[position]))
+                rendered.append((index, recipient, email_body, names))
                 
-                # Replace all placeholders dynamically
-                for column, placeholder in placeholder_settings.items():
-                    if placeholder and column in row:
-                        email_body = email_body.replace(placeholder, str(row[column]))
-                
-                if self.send_email(row[email_column], subject, email_body, font_family, font_size):
-                    successful += 1
+            except Exception as e:
+                reject(index, recipient, e)
+        
+        # With SEND_COALESCE_IDENTICAL, bodies (with the same attachments) shared by
+        # several rows become one undisclosed-recipients message, which
+        # send_prepared_many delivers with many RCPTs per transaction. It is opt-in
+        # because those recipients no longer see their own address in To:
+        shared = {}
+        if self.coalesce_identical:
+            body_counts = Counter((email_body, names) for _, _, email_body, names in rendered)
+            shared = {key: None for key, count in body_counts.items() if count > 1}
+        
+        messages = []
+        message_rows = []
+        for index, recipient, email_body, names in rendered:
+            try:
+                # Each file is encoded once; messages reference the cached parts
+                parts = attachment_cache.get_many(names) if names else ()
+                key = (email_body, names)
+                if key in shared:
+                    if shared[key] is None:
+                        shared[key] = builder.build_shared(email_body, parts)
+                    message = shared[key]
                 else:
-                    failed_emails.append(row[email_column])
-                    
+                    message = builder.build(recipient, email_body, parts)
             except Exception as e:
-                failed_emails.append(row[email_column])
-                logging.error(f"Failed to send email to {row[email_column]}: {str(e)}")
-                
-        return successful, total_emails, failed_emails
+                reject(index, recipient, e)
+                continue
+            messages.append((recipient, message))
+            message_rows.append(index)
+        
+        render_seconds = time.perf_counter() - render_started
+        STAGE_SECONDS.observe(render_seconds, stage='render')
+        logging.info(f"Rendered {len(messages)} messages in {render_seconds:.3f}s")
+        
+        on_result = None
+        if checkpoint is not None:
+            def on_result(position, recipient, sent, final):
+                state = 'sent' if sent else ('failed' if final else 'deferred')
+                ledger.record(run_id, message_rows[position], recipient, state)
+        
+        results = self.send_prepared_many(messages, job=job, on_result=on_result,
+                                          run_id=checkpoint[1] if checkpoint is not None else None)
+        if checkpoint is not None:
+            ledger.flush()
+        
+        # Results are True/False per message, or None if the job was cancelled first
+        successful = previously_sent + sum(1 for sent in results if sent)
+        failed_emails.extend(recipient for (recipient, _), sent in zip(messages, results) if sent is False)
+        return successful, failed_emails
+
+    def send_prepared_many(self, messages, job=None, on_result=None, run_id=None):
+        """Send (recipient, message bytes) pairs concurrently, returning a success flag per message.
+
+        With SEND_COALESCE_IDENTICAL, entries sharing the same message bytes (see
+        build_shared) are delivered as one transaction with up to
+        SEND_MAX_RECIPIENTS_PER_MESSAGE distinct recipients, and pacing
+        applies per transaction. Transient failures (4xx replies, dropped connections)
+        are requeued at the tail of the batch with exponential backoff and jitter, up
+        to SEND_MAX_ATTEMPTS attempts, and slow the adaptive send rate down.
+        `on_result(position, recipient, sent, final)` is called after each attempt, and
+        every attempt is written to the delivery log under `run_id`.
+
+        With the smtplib transport each transaction occupies a worker thread; with the
+        asyncio transport every transaction of a round is a coroutine on one event loop
+        and concurrency is bounded by SMTP_ASYNC_CONNECTIONS.
+        """
+        results = [None] * len(messages)
+        # Handing off to a local MTA is not paced; the MTA paces delivery itself
+        local = getattr(self.pool, 'is_local', False)
+        # A buffering transport (the spool) only makes messages durable on flush(), so
+        # metrics, the delivery log, the job and on_result hear they were sent after
+        # the flush, never before
+        buffered = getattr(self.pool, 'buffered', False)
+        # (positions, message size, latency) of transactions accepted but not yet flushed
+        unflushed = []
+        
+        def finish(position, sent):
+            results[position] = sent
+            recipient = messages[position][0]
+            if job is not None:
+                job.record(recipient, sent)
+            if on_result is not None:
+                on_result(position, recipient, sent, True)
+        
+        def confirm(accepted, size, latency):
+            MESSAGES_TOTAL.inc(len(accepted), status='sent')
+            MESSAGE_BYTES_TOTAL.inc(size)
+            for position in accepted:
+                log_delivery(messages[position][0], 'sent', run_id, latency)
+                finish(position, True)
+        
+        def flush():
+            """Flush the transport, then settle every message it held as sent or, if the
+            batch could not be made durable, failed"""
+            try:
+                self.flush_transport()
+                error = None
+            except SpoolFlushError as e:
+                error = e
+            batch = list(unflushed)
+            del unflushed[:]
+            for accepted, size, latency in batch:
+                if error is None:
+                    confirm(accepted, size, latency)
+                    continue
+                for position in accepted:
+                    recipient = messages[position][0]
+                    MESSAGES_TOTAL.inc(status='failed')
+                    logging.error(f"Failed to spool email to {recipient}: {error}")
+                    log_delivery(recipient, 'failed', run_id, latency, None, str(error))
+                    finish(position, False)
+        
+        def settle(item, refused=None, error=None, latency=None):
+            """Record the outcome of one transaction, returning a retry item for deferred recipients"""
+            positions, attempt, _ = item
+            recipients = [messages[position][0] for position in positions]
+            if isinstance(error, smtplib.SMTPRecipientsRefused):
+                refused, error = error.recipients, None
+            
+            # (position, kind, error, code) for every recipient that was not accepted
+            if error is not None:
+                code = getattr(error, 'smtp_code', None)
+                failures = [(position, classify_error(error), str(error), code) for position in positions]
+            else:
+                failures = [(position, classify_code(refused[recipient][0]), str(refused[recipient]),
+                             refused[recipient][0])
+                            for position, recipient in zip(positions, recipients)
+                            if refused and recipient in refused]
+            
+            failed_positions = {position for position, _, _, _ in failures}
+            accepted = [position for position in positions if position not in failed_positions]
+            if accepted:
+                size = len(messages[positions[0]][1])
+                if buffered:
+                    unflushed.append((accepted, size, latency))
+                    if self.pool.flush_due:
+                        flush()
+                else:
+                    confirm(accepted, size, latency)
+                self.adaptive_limiter.on_success()
+            if any(kind == TRANSIENT for _, kind, _, _ in failures):
+                self.adaptive_limiter.on_deferral()
+            
+            retries = []
+            bounced = []
+            # A transaction whose recipients were all refused points at the sender or
+            # the message rather than at the mailboxes, so nobody is suppressed for it
+            mailbox_refusals = error is None and (len(positions) == 1 or len(failures) < len(positions))
+            for position, kind, reason, code in failures:
+                recipient = messages[position][0]
+                if kind == TRANSIENT and attempt < self.send_max_attempts:
+                    MESSAGES_TOTAL.inc(status='retried')
+                    logging.warning(f"Deferred email to {recipient} (attempt {attempt}): {reason}")
+                    log_delivery(recipient, 'deferred', run_id, latency, code, reason)
+                    retries.append(position)
+                    if on_result is not None:
+                        on_result(position, recipient, False, False)
+                else:
+                    MESSAGES_TOTAL.inc(status='failed')
+                    logging.error(f"Failed to send email to {recipient} ({kind}): {reason}")
+                    log_delivery(recipient, 'failed', run_id, latency, code, reason)
+                    finish(position, False)
+                    # Only a mailbox-level refusal of this recipient says the address is dead
+                    if mailbox_refusals and is_hard_bounce(code, refused[recipient][1]):
+                        bounced.append(recipient)
+            if bounced and SUPPRESS_BOUNCES:
+                get_suppression_list().add_many(bounced, 'bounce')
+            if retries:
+                retry_at = time.monotonic() + backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+                return (tuple(retries), attempt + 1, retry_at)
+            return None
+        
+        def send_one(item):
+            positions, attempt, not_before = item
+            recipients = [messages[position][0] for position in positions]
+            data = messages[positions[0]][1]
+            if job is not None:
+                if not job.wait_to_proceed():
+                    return None
+                # Scheduled sends are spread over their window (see send_scheduler);
+                # a retry already had its slot and waits out its backoff instead
+                if attempt == 1:
+                    job.pace(len(positions))
+                if job.cancelled:
+                    return None
+            delay = not_before - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            started = None
+            try:
+                if not local:
+                    self.rate_limiter.acquire()
+                    self.adaptive_limiter.acquire()
+                started = time.perf_counter()
+                if len(positions) == 1:
+                    self.deliver(recipients[0], data)
+                    refused = {}
+                else:
+                    refused = self.deliver_many(recipients, data)
+            except Exception as e:
+                return settle(item, error=e, latency=None if started is None else time.perf_counter() - started)
+            return settle(item, refused=refused, latency=time.perf_counter() - started)
+        
+        async def send_one_async(item):
+            positions, attempt, not_before = item
+            recipients = [messages[position][0] for position in positions]
+            data = messages[positions[0]][1]
+            if job is not None:
+                while job.paused and not job.cancelled:
+                    await asyncio.sleep(PAUSE_POLL_INTERVAL)
+                if job.cancelled:
+                    return None
+                if attempt == 1:
+                    await job.pace_async(len(positions))
+                if job.cancelled:
+                    return None
+            delay = not_before - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = None
+            try:
+                await self.rate_limiter.acquire_async()
+                await self.adaptive_limiter.acquire_async()
+                started = time.perf_counter()
+                refused = await self.deliver_async(recipients, data)
+            except Exception as e:
+                return settle(item, error=e, latency=None if started is None else time.perf_counter() - started)
+            return settle(item, refused=refused, latency=time.perf_counter() - started)
+        
+        async def send_round_async(items):
+            return await asyncio.gather(*(send_one_async(item) for item in items))
+        
+        # With SEND_COALESCE_IDENTICAL, identical messages share one transaction, bounded
+        # by the per-message recipient limit; a recipient listed twice gets each copy in
+        # a separate transaction. Otherwise every recipient has a transaction of its own
+        envelopes = {}
+        copies = Counter()
+        for position, (recipient, data) in enumerate(messages):
+            if self.coalesce_identical:
+                copies[recipient, data] += 1
+                envelopes.setdefault((data, copies[recipient, data]), []).append(position)
+            else:
+                envelopes[position] = [position]
+        limit = self.max_recipients_per_message
+        pending = [(tuple(positions[start:start + limit]), 1, 0.0)
+                   for positions in envelopes.values()
+                   for start in range(0, len(positions), limit)]
+        while pending:
+            if getattr(self.pool, 'is_async', False):
+                retries = self.pool.run(send_round_async(pending))
+            elif getattr(self.pool, 'single_threaded', False) or self.send_workers <= 1 or len(pending) <= 1:
+                retries = [send_one(item) for item in pending]
+            else:
+                with ThreadPoolExecutor(max_workers=self.send_workers) as executor:
+                    retries = list(executor.map(send_one, pending))
+            # Deferred messages go to the back of the queue for the next round
+            pending = sorted((item for item in retries if item is not None), key=lambda item: item[2])
+        
+        flush()
+        sent = sum(1 for result in results if result)
+        logging.info(f"Sent {sent} of {len(messages)} messages")
+        return results
@@ -1,92 +1,372 @@
 import base64
+import csv
 import io
-import pandas as pd
-import openpyxl
 import logging
+from src.config.settings import INGEST_CHUNK_SIZE
+from src.utils.lazy_import import lazy_module
+from src.utils.upload_cache import upload_cache
+from src.utils.upload_store import resolve_upload
+from src.utils.recipient_store import RecipientStore, find_email_column
+from src.utils.suppression import DedupeIndex, screen_recipients
+from src.utils.metrics import timed
 
+# Loaded on first parse so importing the app stays fast
+pd = lazy_module('pandas')
+openpyxl = lazy_module('openpyxl')
+
+@timed('parse_excel')
 def parse_excel(contents, required_columns=None):
-    """Parse uploaded Excel file with dynamic column validation"""
+    """Parse uploaded Excel or CSV file with dynamic column validation"""
     # Check if contents are provided
     if contents is None:
         logging.error("No Excel file provided")
         return None
 
     try:
-        # Split content string to retrieve the actual file data
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-        
-        # Load workbook and select the active sheet
-        workbook = openpyxl.load_workbook(io.BytesIO(decoded))
-        sheet = workbook.active
-        
-        # Read data and convert it to DataFrame
-        data = sheet.values
-        cols = next(data)
-        df = pd.DataFrame(data, columns=cols)
-        
-        # Check if DataFrame is empty
-        if df.empty:
-            logging.error("Excel file is empty")
-            return None
-            
         # If this is the first load (no required columns specified)
         if not required_columns:
-            # Return just the column names for mapping
-            return list(df.columns)
+            # Return just the column names for mapping, read from the header row only
+            return upload_cache.get_or_load('columns', contents, read_columns)
+        
+        df = load_excel_dataframe(contents)
+        if df is None:
+            return None
         
-        # Validate and process DataFrame with required columns
-        return validate_and_process_dataframe(df, required_columns)
+        # Validate and process a copy so the cached DataFrame stays untouched
+        return validate_and_process_dataframe(df.copy(), required_columns)
         
     except Exception as e:
         logging.error(f"Error parsing Excel file: {str(e)}")
         return None
 
+def load_excel_dataframe(contents):
+    """Return the uploaded workbook as a DataFrame, reusing the cached copy for unchanged uploads.
+
+    The returned DataFrame is shared between callbacks and must be treated as read-only.
+    """
+    if contents is None:
+        logging.error("No Excel file provided")
+        return None
+
+    try:
+        return upload_cache.get_or_load('excel', contents, read_workbook)
+    except Exception as e:
+        logging.error(f"Error parsing Excel file: {str(e)}")
+        return None
+
+def load_recipient_store(contents):
+    """Return the uploaded workbook as a cached RecipientStore of every column, for
+    callbacks that read rows one at a time (previews, single sends)"""
+    if contents is None:
+        logging.error("No Excel file provided")
+        return None
+
+    try:
+        return upload_cache.get_or_load('recipients', contents, read_recipient_store)
+    except Exception as e:
+        logging.error(f"Error parsing Excel file: {str(e)}")
+        return None
+
+def read_recipient_store(contents):
+    df = load_excel_dataframe(contents)
+    if df is None:
+        return None
+    return RecipientStore.from_frame(df)
+
+def decode_upload(contents):
+    """Split a dcc.Upload data URL (or stored upload id) into its content type and decoded bytes"""
+    content_type, content_string = resolve_upload(contents).split(',')
+    return content_type, base64.b64decode(content_string)
+
+def csv_rows(decoded):
+    """Rows of a decoded CSV upload, with empty cells as None like openpyxl"""
+    text = io.TextIOWrapper(io.BytesIO(decoded), encoding='utf-8-sig', newline='')
+    return (tuple(value if value != '' else None for value in row)
+            for row in csv.reader(text))
+
+def non_blank_rows(rows):
+    """Yield the header row and then each data row with at least one value"""
+    header = next(rows, None)
+    if header is None:
+        return
+    yield header
+    for row in rows:
+        if any(value is not None for value in row):
+            yield row
+
+def iter_upload_rows(contents):
+    """Yield the header row and then each non-blank data row of an uploaded workbook or CSV.
+
+    Workbooks are read with openpyxl in read-only mode, so rows are streamed from the
+    file instead of building the whole sheet in memory.
+    """
+    content_type, decoded = decode_upload(contents)
+    
+    # .xlsx files are zip archives; anything else is treated as CSV
+    if decoded[:2] != b'PK':
+        rows = csv_rows(decoded)
+        workbook = None
+    else:
+        workbook = openpyxl.load_workbook(io.BytesIO(decoded), read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+    
+    try:
+        yield from non_blank_rows(rows)
+    finally:
+        if workbook is not None:
+            workbook.close()
+
+class UploadSheets:
+    """Every sheet of an uploaded workbook, or the single table of a CSV, opened once.
+
+    `sheets` lists (title, rows) pairs, where rows yields the header row and then
+    each non-blank data row, streamed like iter_upload_rows; `active` is the title
+    of the sheet iter_upload_rows would read. Use as a context manager so the
+    workbook is closed.
+    """
+
+    def __init__(self, contents, name='upload'):
+        content_type, decoded = decode_upload(contents)
+        self.workbook = None
+        if decoded[:2] != b'PK':
+            self.sheets = [(name, non_blank_rows(csv_rows(decoded)))]
+            self.active = name
+        else:
+            self.workbook = openpyxl.load_workbook(io.BytesIO(decoded), read_only=True, data_only=True)
+            self.sheets = [(sheet.title, non_blank_rows(sheet.iter_rows(values_only=True)))
+                           for sheet in self.workbook.worksheets]
+            self.active = self.workbook.active.title
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.workbook is not None:
+            self.workbook.close()
+            self.workbook = None
+
+def read_columns(contents):
+    """Read just the header row of an upload"""
+    rows = iter_upload_rows(contents)
+    try:
+        header = next(rows, None)
+        # An upload with a header but no data rows is treated as empty
+        if header is None or next(rows, None) is None:
+            logging.error("Excel file is empty")
+            return None
+    finally:
+        rows.close()
+    return [col for col in header if col is not None]
+
+def count_data_rows(contents):
+    """Estimate the number of data rows in an upload without parsing its cells"""
+    content_type, decoded = decode_upload(contents)
+    if decoded[:2] != b'PK':
+        return max(0, decoded.rstrip(b'\r\n').count(b'\n'))
+    workbook = openpyxl.load_workbook(io.BytesIO(decoded), read_only=True)
+    try:
+        return max(0, (workbook.active.max_row or 1) - 1)
+    finally:
+        workbook.close()
+
+def read_workbook(contents):
+    """Decode an uploaded workbook or CSV and read its first sheet into a DataFrame"""
+    rows = iter_upload_rows(contents)
+    cols = next(rows, None)
+    if cols is None:
+        logging.error("Excel file is empty")
+        return None
+    df = pd.DataFrame(rows, columns=cols)
+    
+    # Check if DataFrame is empty
+    if df.empty:
+        logging.error("Excel file is empty")
+        return None
+    
+    return df
+
+def iter_recipient_chunks(contents, column_mapping=None, chunk_size=INGEST_CHUNK_SIZE,
+                          suppression=None, dedupe=False, on_rejected=None):
+    """Stream an upload as DataFrame chunks of at most `chunk_size` rows.
+
+    Chunks keep their row position in the file as index, so per-row edits keyed by
+    preview index still apply. With a column mapping (column -> placeholder, as saved
+    in the mapping section; an empty one still checks the email column) each chunk is
+    validated with validate_rows: rows with an empty mapped cell, a malformed address
+    or an address repeated in the chunk are dropped and passed to `on_rejected` as
+    (data row, address, reason) tuples. Column names are kept so templates still
+    find them. Rows addressed to a `suppression` list entry, and with `dedupe` every
+    repeat of an address already seen earlier in the upload, are dropped before they
+    are yielded.
+    """
+    rows = iter_upload_rows(contents)
+    cols = next(rows, None)
+    if cols is None:
+        logging.error("Excel file is empty")
+        return
+    
+    required = mapped_columns(cols, column_mapping) if column_mapping is not None else None
+    seen = DedupeIndex() if dedupe else None
+    screening = suppression is not None or seen is not None
+    suppressed = duplicates = 0
+    
+    def screened(chunk, start):
+        nonlocal suppressed, duplicates
+        df = build_chunk(chunk, cols, start, required, on_rejected)
+        if df is None or not screening:
+            return df
+        df, chunk_suppressed, chunk_duplicates = screen_recipients(df, suppression, seen)
+        suppressed += chunk_suppressed
+        duplicates += chunk_duplicates
+        return df if not df.empty else None
+    
+    start = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            df = screened(chunk, start)
+            start += len(chunk)
+            chunk = []
+            if df is not None:
+                yield df
+    if chunk:
+        df = screened(chunk, start)
+        if df is not None:
+            yield df
+    if suppressed or duplicates:
+        logging.info(f"Skipped {suppressed} suppressed and {duplicates} duplicate addresses")
+
+def mapped_columns(columns, column_mapping):
+    """The upload columns a mapping requires to be filled in, plus the email column"""
+    by_name = {str(col).strip().lower(): col for col in columns if col is not None}
+    required = []
+    for col in column_mapping:
+        name = str(col).strip().lower()
+        if name in by_name:
+            required.append(by_name[name])
+        else:
+            logging.warning(f"Mapped column {col} is not in the upload; not validating it")
+    email_column = find_email_column(by_name.values())
+    if email_column is not None and email_column not in required:
+        required.append(email_column)
+    return required
+
+def build_chunk(rows, cols, start, required_columns=None, on_rejected=None):
+    """Turn a list of row tuples into an indexed DataFrame, dropping rows that fail
+    validation of `required_columns` if given; None if no row is left"""
+    df = pd.DataFrame(rows, columns=cols, index=range(start, start + len(rows)))
+    if required_columns is None:
+        return df
+    valid, rejected = validate_rows(df, required_columns)
+    if not rejected.empty:
+        log_rejected_rows(rejected)
+        if on_rejected is not None:
+            on_rejected(describe_rejected(rejected))
+    return valid if not valid.empty else None
+
+# Practical address syntax check: one "@", no whitespace, a dot in the domain
+EMAIL_PATTERN = r'^[^@\s]+@[^@\s]+\.[^@\s]+$'
+
+# How many rejected rows to spell out in the log
+REJECTED_LOG_LIMIT = 20
+
 def validate_and_process_dataframe(df, column_mapping):
-    """Validate and process the DataFrame with dynamic column mapping"""
+    """Validate and process the DataFrame with dynamic column mapping.
+
+    Rows failing validation are dropped and logged rather than rejecting the
+    whole upload; use process_dataframe to get the rejected rows as well.
+    """
+    result = process_dataframe(df, column_mapping)
+    if result is None:
+        return None
+    
+    valid, rejected = result
+    if valid.empty:
+        logging.error("No valid rows left after validation")
+        return None
+    return valid
+
+def process_dataframe(df, column_mapping):
+    """Map columns and split the rows into (valid, rejected) DataFrames.
+
+    The rejected DataFrame carries a 'reason' column. Returns None if mapped
+    columns are missing altogether.
+    """
     try:
         # Convert column names to lowercase for comparison
         df.columns = [str(col).strip().lower() for col in df.columns]
+        mapping = {str(col).strip().lower(): target for col, target in column_mapping.items()}
         
         # Ensure all mapped columns are present
-        required_columns = [col.lower() for col in column_mapping.keys()]
-        missing_columns = [col for col in required_columns 
-                         if not any(existing.lower() == col 
-                                  for existing in df.columns)]
+        existing_columns = set(df.columns)
+        missing_columns = [col for col in mapping if col not in existing_columns]
         if missing_columns:
             logging.error(f"Excel file missing columns: {', '.join(missing_columns)}")
             return None
 
         # Rename columns according to mapping
-        df = df.rename(columns=column_mapping)
+        df = df.rename(columns=mapping)
         
-        # Validate the DataFrame's content
-        if not validate_dataframe(df, list(column_mapping.values())):
-            return None
-            
-        return df
+        # Validate the DataFrame's content row by row
+        valid, rejected = validate_rows(df, list(mapping.values()))
+        if not rejected.empty:
+            log_rejected_rows(rejected)
+        return valid, rejected
         
     except Exception as e:
         logging.error(f"Error processing DataFrame: {str(e)}")
         return None
 
-def validate_dataframe(df, required_columns):
-    """Validate DataFrame contents with dynamic required columns"""
-    # Check for missing values in required columns
-    if df[required_columns].isnull().any().any():
-        logging.error("Excel file contains empty cells in required columns")
-        return False
-        
-    # Ensure there's at least one column designated as email
-    email_columns = [col for col in required_columns if 'email' in col.lower()]
+def validate_rows(df, required_columns):
+    """Vectorized per-row validation returning (valid, rejected) DataFrames.
+
+    Checks for empty required cells, address syntax and duplicate addresses in
+    every column whose name contains 'email'. Addresses in valid rows are
+    stripped and lowercased.
+    """
+    email_columns = [col for col in required_columns if 'email' in str(col).lower()]
+    reasons = pd.Series('', index=df.index, dtype=object)
+    
+    def flag(mask, reason):
+        nonlocal reasons
+        reasons = reasons.where(~mask, reasons + reason + '; ')
+    
     if not email_columns:
         logging.error("No email column specified in mapping")
-        return False
-        
-    # Verify email format in email column(s)
+        flag(pd.Series(True, index=df.index), "no email column")
+    
+    # Check for missing values in required columns
+    for col in required_columns:
+        flag(df[col].isnull(), f"empty {col}")
+    
+    df = df.copy()
     for email_col in email_columns:
-        if not df[email_col].str.contains("@").all():
-            logging.error(f"Invalid email format detected in column {email_col}")
-            return False
-            
-    return True
+        present = df[email_col].notnull()
+        normalized = df[email_col].astype(str).str.strip().str.lower()
+        well_formed = normalized.str.match(EMAIL_PATTERN)
+        flag(present & ~well_formed, f"invalid {email_col}")
+        flag(present & well_formed & normalized.duplicated(keep='first'), f"duplicate {email_col}")
+        df[email_col] = normalized.where(present, df[email_col])
+    
+    bad = reasons != ''
+    rejected = df[bad].assign(reason=reasons[bad].str.rstrip('; '))
+    return df[~bad], rejected
+
+def log_rejected_rows(rejected):
+    """Log a summary of rejected rows by 1-based data row number (the header row and
+    blank rows are not counted)"""
+    logging.warning(f"Rejected {len(rejected)} rows during validation")
+    for index, reason in rejected['reason'].head(REJECTED_LOG_LIMIT).items():
+        logging.warning(f"Data row {index + 1}: {reason}")
+
+def describe_rejected(rejected):
+    """(data row, address, reason) for each row of a rejected DataFrame from validate_rows"""
+    email_column = find_email_column(rejected.columns)
+    addresses = rejected[email_column] if email_column is not None else pd.Series(None, index=rejected.index)
+    return [(index + 1, None if pd.isnull(address) else str(address), reason)
+            for index, address, reason in zip(rejected.index, addresses, rejected['reason'])]
+
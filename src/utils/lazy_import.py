@@ -0,0 +1,37 @@
+import importlib
+
+
+class LazyModule:
+    """Stand-in for a heavy module that is imported on first attribute access.
+
+    Importing goes through importlib, so concurrent first uses from request threads
+    are serialised by the import lock.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_module(name):
+    return LazyModule(name)
+
+
+# Imported on first use rather than at start-up; preload() pulls them in ahead of time
+HEAVY_MODULES = ('pandas', 'openpyxl')
+
+
+def preload(names=HEAVY_MODULES):
+    """Import heavy dependencies now, e.g. in a gunicorn master before workers fork"""
+    for name in names:
+        importlib.import_module(name)
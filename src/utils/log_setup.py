@@ -0,0 +1,216 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from src.config.settings import LOGGING_CONFIG
+
+# Per-recipient send outcomes, written as JSON lines apart from the main log
+DELIVERY_LOGGER = 'email_automation.deliveries'
+delivery_logger = logging.getLogger(DELIVERY_LOGGER)
+delivery_logger.propagate = False
+
+DELIVERY_FIELDS = ('run_id', 'recipient', 'status', 'latency_ms', 'smtp_code', 'error')
+
+_initialised = False
+_lock = threading.Lock()
+_config = None
+_listener = None
+_listening = False
+
+
+def log_delivery(recipient, status, run_id=None, latency=None, smtp_code=None, error=None):
+    """Record one recipient's outcome (sent, deferred or failed) in the delivery log"""
+    if delivery_logger.isEnabledFor(logging.INFO):
+        delivery_logger.info(status, extra={
+            'run_id': run_id,
+            'recipient': recipient,
+            'status': status,
+            'latency_ms': round(latency * 1000, 1) if latency is not None else None,
+            'smtp_code': smtp_code,
+            'error': error
+        })
+
+
+class DeliveryFormatter(logging.Formatter):
+    """One JSON object per delivery record"""
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}
+        entry.update((field, getattr(record, field, None)) for field in DELIVERY_FIELDS)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class BatchFlushMixin:
+    """Leaves flushing to the listener, which flushes once the queue runs dry"""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class BatchedRotatingFileHandler(BatchFlushMixin, logging.handlers.RotatingFileHandler):
+    pass
+
+
+class BatchedTimedRotatingFileHandler(BatchFlushMixin, logging.handlers.TimedRotatingFileHandler):
+    pass
+
+
+class BatchedQueueListener(logging.handlers.QueueListener):
+    """QueueListener that writes a burst of records before flushing the files once"""
+
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            self.flush()
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush_batch()
+
+
+class ExcludeLogger(logging.Filter):
+    def filter(self, record):
+        return not super().filter(record)
+
+
+class ForwardHandler(logging.Handler):
+    """Hands records from worker processes to this process's loggers"""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def file_handler(filename, config, batched):
+    """A rotating file handler, by schedule when `when` is set and by size otherwise"""
+    if config.get('when'):
+        handler_class = BatchedTimedRotatingFileHandler if batched else logging.handlers.TimedRotatingFileHandler
+        return handler_class(filename, when=config['when'], backupCount=config.get('backup_count', 0),
+                             encoding='utf-8')
+    handler_class = BatchedRotatingFileHandler if batched else logging.handlers.RotatingFileHandler
+    return handler_class(filename, maxBytes=config.get('max_bytes', 0), backupCount=config.get('backup_count', 0),
+                         encoding='utf-8')
+
+
+def process_filename(filename, pid):
+    """Give a forked process its own file, since rotation needs a single writer"""
+    root, extension = os.path.splitext(filename)
+    return f"{root}.{pid}{extension}"
+
+
+def init_logging(config=LOGGING_CONFIG, forward_queue=None):
+    """Create the log directory and configure logging, once per process.
+
+    Worker processes pass `forward_queue` to send their records to the parent (see
+    forward_logs) instead of writing the files themselves.
+    """
+    global _initialised, _config
+    with _lock:
+        if _initialised:
+            return
+        root = logging.getLogger()
+        root.setLevel(config.get('level', logging.INFO))
+        if forward_queue is not None:
+            handler = logging.handlers.QueueHandler(forward_queue)
+            root.addHandler(handler)
+            delivery_logger.addHandler(handler)
+        else:
+            _config = config
+            start_handlers(config)
+            os.register_at_fork(before=before_fork, after_in_parent=after_fork_in_parent,
+                                after_in_child=after_fork_in_child)
+        _initialised = True
+
+
+def start_handlers(config, pid=None):
+    """Attach the main and delivery log handlers, behind a queue unless `queue` is off"""
+    global _listener
+    main_filename = config['filename']
+    delivery_filename = config.get('delivery_filename')
+    if pid is not None:
+        main_filename = process_filename(main_filename, pid)
+        delivery_filename = delivery_filename and process_filename(delivery_filename, pid)
+    for filename in (main_filename, delivery_filename):
+        directory = os.path.dirname(filename or '')
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    queued = config.get('queue', True)
+    main = file_handler(main_filename, config, queued)
+    main.setFormatter(logging.Formatter(config.get('format')))
+    handlers = [main]
+    if delivery_filename:
+        deliveries = file_handler(delivery_filename, config, queued)
+        deliveries.setFormatter(DeliveryFormatter())
+        handlers.append(deliveries)
+
+    root = logging.getLogger()
+    if not queued:
+        root.addHandler(main)
+        if delivery_filename:
+            delivery_logger.addHandler(deliveries)
+        return
+
+    # The sending threads only enqueue; one background thread formats and writes
+    records = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    root.addHandler(handler)
+    delivery_logger.addHandler(handler)
+    if delivery_filename:
+        main.addFilter(ExcludeLogger(DELIVERY_LOGGER))
+        deliveries.addFilter(logging.Filter(DELIVERY_LOGGER))
+    _listener = BatchedQueueListener(records, *handlers, respect_handler_level=True)
+    start_listener()
+    atexit.register(stop_listener)
+
+
+def start_listener():
+    global _listening
+    if _listener is not None and not _listening:
+        _listener.start()
+        _listening = True
+
+
+def stop_listener():
+    """Write out everything still queued"""
+    global _listening
+    if _listener is not None and _listening:
+        _listener.stop()
+        _listener.flush()
+        _listening = False
+
+
+def before_fork():
+    # Drain and flush so no buffered records are copied into the child
+    stop_listener()
+
+
+def after_fork_in_parent():
+    start_listener()
+
+
+def after_fork_in_child():
+    """Forked workers (gunicorn with preload_app) write their own files with a fresh listener"""
+    global _listener
+    handlers = set(_listener.handlers if _listener is not None else ())
+    for logger in (logging.getLogger(), delivery_logger):
+        handlers.update(logger.handlers)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+    for handler in handlers:
+        handler.close()
+    _listener = None
+    if _config is not None:
+        start_handlers(_config, pid=os.getpid())
+
+
+def forward_logs(records):
+    """Write records that worker processes put on `records`; stop() the result when they are done"""
+    listener = logging.handlers.QueueListener(records, ForwardHandler())
+    listener.start()
+    return listener
@@ -0,0 +1,136 @@
+import base64
+import uuid
+from email.header import Header
+from src.utils.metrics import timed
+
+CRLF = '\r\n'
+
+# To header of messages delivered to several recipients at once, so none sees the others
+UNDISCLOSED_RECIPIENTS = 'undisclosed-recipients:;'
+
+
+def encode_header_value(value):
+    """RFC 2047-encode a header value if it is not plain ASCII"""
+    try:
+        value.encode('ascii')
+        return value
+    except UnicodeEncodeError:
+        return Header(value, 'utf-8').encode(linesep=CRLF)
+
+
+def encode_body(text):
+    """UTF-8 and base64-encode a body with CRLF-terminated 76 character lines"""
+    return base64.encodebytes(text.encode('utf-8')).replace(b'\n', b'\r\n')
+
+
+class HtmlShell:
+    """The invariant HTML wrapper (style block and signature) for one font setting"""
+
+    def __init__(self, font_family="Calibri", font_size="11", signature=''):
+        style = 'body { ' + f'font-family: {font_family}; font-size: {font_size}pt;' + ' }'
+        self.prefix = '\n'.join(['<html>', '<head>', '<style>', style, '</style>', '</head>', '<body>', ''])
+        self.suffix = '\n'.join(['', '<br><br>', signature, '</body>', '</html>'])
+
+    @timed('format_email_body')
+    def render(self, body):
+        """Wrap a plain-text body in the HTML shell"""
+        return self.prefix + body.replace('\n', '<br>') + self.suffix
+
+
+class PreparedMessage:
+    """A serialised message with attachments, kept as its text plus shared parts.
+
+    `text` holds the headers and HTML part; `parts` are boundary lines and encoded
+    attachments shared with every other message carrying them, so a batch holds one
+    copy of each file. No line in `parts` starts with '.', so transports only need
+    to dot-stuff `text`. bytes(message) gives the whole message.
+    """
+    __slots__ = ('text', 'parts', 'size')
+
+    def __init__(self, text, parts):
+        self.text = text
+        self.parts = parts
+        self.size = len(text) + sum(len(part) for part in parts)
+
+    def __len__(self):
+        return self.size
+
+    def __bytes__(self):
+        return b''.join((self.text,) + self.parts)
+
+
+def message_bytes(message):
+    """The message as one bytes object, for transports that cannot write it in pieces"""
+    return message if isinstance(message, bytes) else bytes(message)
+
+
+class MessageBuilder:
+    """Build ready-to-send HTML messages for one batch.
+
+    The headers and MIME envelope are computed once per sender/subject/shell, so
+    each message only renders its body and the To header. `attachments` are encoded
+    parts (see attachments.AttachmentCache) added to every message; build() takes
+    more per message.
+    """
+
+    def __init__(self, sender, subject, shell, attachments=()):
+        self.sender = sender
+        self.subject = subject
+        self.shell = shell
+        self.attachments = tuple(attachments)
+
+        boundary = f"==============={uuid.uuid4().int:020d}=="
+        headers = [
+            'MIME-Version: 1.0',
+            f'Subject: {encode_header_value(subject)}',
+            f'From: {encode_header_value(sender)}',
+            'To: ',
+        ]
+        self.head = CRLF.join([f'Content-Type: multipart/alternative; boundary="{boundary}"'] + headers).encode('ascii')
+        # Messages with attachments are multipart/mixed: the HTML part, then the files
+        self.mixed_head = CRLF.join([f'Content-Type: multipart/mixed; boundary="{boundary}"'] + headers).encode('ascii')
+        self.separator = f'{CRLF}--{boundary}{CRLF}'.encode('ascii')
+        self.part_head = CRLF.join([
+            '',
+            '',
+            f'--{boundary}',
+            'Content-Type: text/html; charset="utf-8"',
+            'MIME-Version: 1.0',
+            'Content-Transfer-Encoding: base64',
+            '',
+            '',
+        ]).encode('ascii')
+        self.tail = f'{CRLF}--{boundary}--{CRLF}'.encode('ascii')
+
+    def build(self, recipient, body, attachments=()):
+        """Return the complete RFC 5322 message for one recipient.
+
+        Messages without attachments are bytes; with attachments they are a
+        PreparedMessage sharing the encoded files.
+        """
+        attachments = self.attachments + tuple(attachments)
+        if not attachments:
+            return b''.join([
+                self.head,
+                encode_header_value(str(recipient)).encode('ascii'),
+                self.part_head,
+                encode_body(self.shell.render(body)),
+                self.tail,
+            ])
+
+        text = b''.join([
+            self.mixed_head,
+            encode_header_value(str(recipient)).encode('ascii'),
+            self.part_head,
+            encode_body(self.shell.render(body)),
+        ])
+        parts = []
+        for attachment in attachments:
+            parts.append(self.separator)
+            parts.append(attachment)
+        parts.append(self.tail)
+        return PreparedMessage(text, tuple(parts))
+
+    def build_shared(self, body, attachments=()):
+        """Return one message for a body sent unchanged to many recipients in one transaction"""
+        return self.build(UNDISCLOSED_RECIPIENTS, body, attachments)
@@ -0,0 +1,145 @@
+import asyncio
+import math
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` tokens per `period` seconds"""
+
+    def __init__(self, rate, period=1.0):
+        self.capacity = float(rate)
+        self.fill_rate = float(rate) / period
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Take a token if one is available, otherwise return seconds until one is"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.fill_rate
+
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Global send rate limit combining per-second and per-minute buckets"""
+
+    def __init__(self, per_second=0, per_minute=0):
+        self.buckets = []
+        if per_second and per_second > 0:
+            self.buckets.append(TokenBucket(per_second, 1.0))
+        if per_minute and per_minute > 0:
+            self.buckets.append(TokenBucket(per_minute, 60.0))
+
+    def acquire(self):
+        """Block until every bucket allows another message"""
+        for bucket in self.buckets:
+            bucket.acquire()
+
+    async def acquire_async(self):
+        """Wait on the event loop until every bucket allows another message"""
+        for bucket in self.buckets:
+            while True:
+                wait = bucket.try_acquire()
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+
+
+class AdaptiveRateLimiter:
+    """AIMD pacing: creep the send rate up on success, halve it when deferrals rise.
+
+    The rate is halved when more than `deferral_threshold` of the attempts in the
+    current window were deferred, at most once per window, starting from the rate
+    actually being achieved so a high ceiling still reacts immediately. Isolated
+    deferrals (e.g. greylisting of single recipients) do not slow the batch. A
+    `max_rate` of 0 leaves sending unpaced until deferrals first slow it down.
+    """
+
+    # Seconds of send history used to measure the achieved rate and deferral ratio
+    WINDOW = 1.0
+
+    def __init__(self, max_rate, min_rate=0.1, increase=0.1, deferral_threshold=0.05):
+        self.max_rate = float(max_rate) if max_rate and max_rate > 0 else math.inf
+        self.min_rate = float(min_rate)
+        self.increase = float(increase)
+        self.deferral_threshold = float(deferral_threshold)
+        self.rate = self.max_rate
+        self._next_slot = time.monotonic()
+        self._window_start = time.monotonic()
+        self._window_attempts = 0
+        self._window_deferrals = 0
+        self._observed_rate = None
+        self._last_decrease = None
+        self._lock = threading.Lock()
+
+    def _roll_window(self, now):
+        elapsed = now - self._window_start
+        if elapsed >= self.WINDOW:
+            self._observed_rate = self._window_attempts / elapsed
+            self._window_start = now
+            self._window_attempts = 0
+            self._window_deferrals = 0
+
+    def reserve(self):
+        """Claim the next send slot at the current rate, returning seconds until it starts"""
+        with self._lock:
+            now = time.monotonic()
+            self._roll_window(now)
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+            self._window_attempts += 1
+        return slot - now
+
+    def acquire(self):
+        """Block until the next send slot at the current rate"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Wait on the event loop until the next send slot at the current rate"""
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_deferral(self):
+        with self._lock:
+            now = time.monotonic()
+            self._roll_window(now)
+            self._window_deferrals += 1
+            ratio = self._window_deferrals / max(1, self._window_attempts)
+            if ratio <= self.deferral_threshold:
+                return
+            if self._last_decrease is not None and now - self._last_decrease < self.WINDOW:
+                return
+            observed = self._observed_rate
+            if observed is None:
+                # No full window yet: measure the one in progress
+                elapsed = now - self._window_start
+                observed = self._window_attempts / elapsed if elapsed > 0 else None
+            current = min(self.rate, observed or self.rate)
+            if math.isinf(current):
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, current / 2)
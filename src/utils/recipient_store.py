@@ -0,0 +1,117 @@
+import sys
+
+
+def find_email_column(columns):
+    """The first column whose name contains 'email', or None"""
+    return next((col for col in columns if 'email' in str(col).lower()), None)
+
+
+class Recipient:
+    """A view of one row of a RecipientStore, readable like a mapping of column values"""
+    __slots__ = ('store', 'position')
+
+    def __init__(self, store, position):
+        self.store = store
+        self.position = position
+
+    @property
+    def index(self):
+        return self.store.index[self.position]
+
+    @property
+    def email(self):
+        return self.store.emails[self.position]
+
+    def __getitem__(self, column):
+        return self.store.column(column)[self.position]
+
+
+class RecipientStore:
+    """Recipients held column by column as lists of pre-stringified values.
+
+    Converting an upload once replaces the per-row pandas Series that iterrows()
+    builds in the send loop. Only the columns a template needs are kept, and
+    repeated values (fund names, companies) share one string object per store.
+    """
+    __slots__ = ('index', 'columns', 'email_column', '_values')
+
+    def __init__(self, index, values, email_column):
+        self.index = index
+        self._values = values
+        self.columns = tuple(values)
+        self.email_column = email_column
+
+    @classmethod
+    def from_frame(cls, df, columns=None):
+        """Convert a DataFrame, keeping `columns` (default all) plus the email column.
+
+        Values are stringified like DataFrame.astype(str), so rendering from the store
+        gives the same text as rendering from the DataFrame.
+        """
+        email_column = find_email_column(df.columns)
+        wanted = list(df.columns) if columns is None else [col for col in columns if col in df.columns]
+        if email_column is not None and email_column not in wanted:
+            wanted.append(email_column)
+
+        values = {}
+        for col in dict.fromkeys(wanted):
+            strings = df[col].astype(str).tolist()
+            if col != email_column:
+                # Addresses are unique; other columns tend to repeat a few values
+                shared = {}
+                strings = [shared.setdefault(value, value) for value in strings]
+            values[col] = strings
+        return cls(df.index.tolist(), values, email_column)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return (Recipient(self, position) for position in range(len(self.index)))
+
+    def __getitem__(self, position):
+        if not -len(self.index) <= position < len(self.index):
+            raise IndexError(f"recipient {position} out of range")
+        return Recipient(self, position % len(self.index))
+
+    def __sizeof__(self):
+        size = object.__sizeof__(self) + sys.getsizeof(self.index)
+        size += sum(sys.getsizeof(value) for value in self.index)
+        seen = set()
+        for strings in self._values.values():
+            size += sys.getsizeof(strings)
+            for value in strings:
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+        return size
+
+    @property
+    def emails(self):
+        if self.email_column is None:
+            return []
+        return self._values[self.email_column]
+
+    def column(self, column):
+        return self._values[column]
+
+    def slice(self, start, stop):
+        """Recipients at positions start..stop-1 as a new store"""
+        return RecipientStore(self.index[start:stop],
+                              {col: strings[start:stop] for col, strings in self._values.items()},
+                              self.email_column)
+
+    def take(self, positions):
+        """Recipients at the given positions as a new store"""
+        positions = list(positions)
+        return RecipientStore([self.index[position] for position in positions],
+                              {col: [strings[position] for position in positions]
+                               for col, strings in self._values.items()},
+                              self.email_column)
+
+    def without_rows(self, row_indexes):
+        """Drop recipients whose row index is in `row_indexes`, returning (store, dropped count)"""
+        keep = [position for position, index in enumerate(self.index) if index not in row_indexes]
+        if len(keep) == len(self.index):
+            return self, 0
+        return self.take(keep), len(self.index) - len(keep)
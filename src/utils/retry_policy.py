@@ -0,0 +1,40 @@
+import random
+import smtplib
+import socket
+
+TRANSIENT = 'transient'
+PERMANENT = 'permanent'
+
+# Errors that mean the connection went away rather than the message being refused
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout, TimeoutError)
+
+
+def smtp_code(error):
+    """Return the SMTP reply code carried by an exception, if any"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        # Only treat the refusal as temporary if every recipient was deferred
+        return max(codes) if codes else None
+    return getattr(error, 'smtp_code', None)
+
+
+def classify_code(code):
+    """Classify an SMTP reply code as TRANSIENT (4xx) or PERMANENT"""
+    return TRANSIENT if 400 <= code < 500 else PERMANENT
+
+
+def classify_error(error):
+    """Classify a send failure as TRANSIENT (worth retrying) or PERMANENT"""
+    code = smtp_code(error)
+    if code is not None and code >= 0:
+        return classify_code(code)
+    if isinstance(error, CONNECTION_ERRORS + (smtplib.SMTPConnectError,)):
+        return TRANSIENT
+    if isinstance(error, OSError):
+        return TRANSIENT
+    return PERMANENT
+
+
+def backoff_delay(attempt, base_delay=2.0, max_delay=60.0):
+    """Exponential backoff with full jitter for the given (1-based) retry attempt"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
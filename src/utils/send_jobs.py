@@ -0,0 +1,214 @@
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# Finished jobs are kept this long so the UI can read their final report
+FINISHED_JOB_TTL = 3600
+
+# Rows rejected by validation that a job keeps for its report
+REJECTED_REPORT_LIMIT = 100
+
+
+class SendJob:
+    """Progress, result and pause/cancel controls for one background send run"""
+
+    def __init__(self, job_id, total=0, status='queued'):
+        self.id = job_id
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.failed_emails = []
+        self.previously_sent = 0
+        self.rejected = 0
+        self.rejected_rows = []
+        self.run_id = None
+        self.status = status
+        self.error = None
+        # Set for scheduled sends: when the job may start, and the send_scheduler
+        # gate pacing it through its window
+        self.start_at = None
+        self.gate = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self._lock = threading.Lock()
+        self._resume = threading.Event()
+        self._resume.set()
+        self._cancelled = threading.Event()
+
+    def pause(self):
+        if self.status in ('queued', 'running'):
+            self._resume.clear()
+            self.status = 'paused'
+
+    def resume(self):
+        if self.status == 'paused':
+            self.status = 'running' if self.started_at else 'queued'
+            self._resume.set()
+
+    def cancel(self):
+        if not self.finished:
+            self._cancelled.set()
+            self._resume.set()
+
+    @property
+    def paused(self):
+        return not self._resume.is_set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def finished(self):
+        return self.status in ('completed', 'cancelled', 'failed')
+
+    def wait_to_proceed(self):
+        """Block while paused; return False once the job has been cancelled"""
+        self._resume.wait()
+        return not self.cancelled
+
+    def wait_cancelled(self, timeout):
+        """Sleep up to `timeout` seconds, returning True early if the job is cancelled"""
+        return self._cancelled.wait(timeout)
+
+    def pace(self, count=1):
+        """Wait until the job's gate lets `count` more messages go"""
+        if self.gate is not None:
+            self.gate.wait(count)
+
+    async def pace_async(self, count=1):
+        """Wait on the event loop until the job's gate lets `count` more messages go"""
+        if self.gate is not None:
+            await self.gate.wait_async(count)
+
+    def close(self, status, error=None):
+        """Finish a job that never ran, e.g. a scheduled send cancelled before its start"""
+        self.error = error
+        self.status = status
+        self.finished_at = time.time()
+
+    def record(self, recipient, success):
+        """Count the outcome of one recipient"""
+        with self._lock:
+            if success:
+                self.sent += 1
+            else:
+                self.failed += 1
+                self.failed_emails.append(recipient)
+
+    def record_rejected(self, rows):
+        """Count rows dropped by validation, given as (data row, address, reason) tuples"""
+        with self._lock:
+            for row in rows:
+                self.rejected += 1
+                if len(self.rejected_rows) < REJECTED_REPORT_LIMIT:
+                    self.rejected_rows.append(row)
+
+    def record_previously_sent(self, count):
+        """Count recipients already sent by an earlier attempt at the same run"""
+        with self._lock:
+            self.sent += count
+            self.previously_sent += count
+
+    def snapshot(self):
+        """Return a JSON-serialisable view of the job's progress"""
+        with self._lock:
+            sent, failed = self.sent, self.failed
+            failed_emails = list(self.failed_emails)
+            rejected, rejected_rows = self.rejected, list(self.rejected_rows)
+        done = sent + failed
+        remaining = max(0, self.total - done)
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0
+        throughput = round((done - self.previously_sent) / elapsed, 2) if elapsed > 0 else 0.0
+        return {
+            'id': self.id,
+            'run_id': self.run_id,
+            'status': self.status,
+            'total': self.total,
+            'sent': sent,
+            'failed': failed,
+            'remaining': remaining,
+            'progress': int(done / self.total * 100) if self.total else 0,
+            'throughput': throughput,
+            'start_at': self.start_at,
+            'eta': self.estimate_finish(remaining, throughput),
+            'failed_emails': failed_emails,
+            'rejected': rejected,
+            'rejected_rows': [{'row': row, 'email': email, 'reason': reason}
+                              for row, email, reason in rejected_rows],
+            'error': self.error,
+        }
+
+
+    def estimate_finish(self, remaining, throughput):
+        """Expected finish time (epoch seconds): the end of a paced window, else at the current rate"""
+        if self.finished or not remaining:
+            return None
+        if self.gate is not None and self.gate.window_seconds:
+            return max(self.gate.end_at, time.time())
+        if throughput > 0:
+            return time.time() + remaining / throughput
+        return None
+
+
+class JobManager:
+    """Run send jobs on a local thread pool and keep track of them by id"""
+
+    def __init__(self, max_workers=2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='send-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, target, *args, total=0, run_id=None, **kwargs):
+        """Queue `target(*args, job=job, **kwargs)` and return the new job"""
+        job = self.create(total=total, run_id=run_id)
+        if run_id is not None:
+            kwargs['run_id'] = run_id
+        self.start(job, target, *args, **kwargs)
+        return job
+
+    def create(self, total=0, run_id=None, job_id=None, status='queued'):
+        """Register a job without running it yet; see start()"""
+        job = SendJob(job_id or uuid.uuid4().hex[:12], total=total, status=status)
+        job.run_id = run_id
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        return job
+
+    def start(self, job, target, *args, **kwargs):
+        """Queue `target(*args, job=job, **kwargs)` for a job from create()"""
+        job.status = 'queued'
+        self._executor.submit(self._run, job, target, args, kwargs)
+
+    def _run(self, job, target, args, kwargs):
+        job.started_at = time.time()
+        if job.status == 'queued':
+            job.status = 'running'
+        try:
+            target(*args, job=job, **kwargs)
+            job.status = 'cancelled' if job.cancelled else 'completed'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            logging.error(f"Send job {job.id} failed: {str(e)}")
+        finally:
+            job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self):
+        cutoff = time.time() - FINISHED_JOB_TTL
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+job_manager = JobManager()
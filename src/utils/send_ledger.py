@@ -0,0 +1,230 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from src.config.settings import SEND_LEDGER_PATH, LEDGER_COMMIT_BATCH, LEDGER_COMMIT_INTERVAL
+
+# Attempts at a write that still finds the database locked after the connection's busy timeout
+BUSY_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    upload_key TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_upload ON runs (upload_key, subject, status);
+CREATE TABLE IF NOT EXISTS recipients (
+    run_id TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    recipient TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (run_id, row_index)
+);
+CREATE INDEX IF NOT EXISTS recipients_by_state ON recipients (run_id, state);
+CREATE TABLE IF NOT EXISTS account_usage (
+    account TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (account, day)
+);
+"""
+
+
+class SendLedger:
+    """Durable per-recipient send state in SQLite, so interrupted runs can resume.
+
+    Outcomes are buffered and committed in batches; call flush() at checkpoints.
+    """
+
+    def __init__(self, path, commit_batch=LEDGER_COMMIT_BATCH, commit_interval=LEDGER_COMMIT_INTERVAL):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.commit_batch = commit_batch
+        self.commit_interval = commit_interval
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._pending = []
+        self._last_commit = time.monotonic()
+
+    def _write(self, statements):
+        """Run (sql, params) statements in one transaction, retrying while the database is locked"""
+        statements = [(sql, list(params)) for sql, params in statements]
+        for attempt in range(1, BUSY_ATTEMPTS + 1):
+            try:
+                with self._lock:
+                    # IMMEDIATE takes the write lock up front, so waiting for it honours the busy timeout
+                    self._conn.execute('BEGIN IMMEDIATE')
+                    try:
+                        for sql, params in statements:
+                            self._conn.executemany(sql, params)
+                        self._conn.execute('COMMIT')
+                    except Exception:
+                        self._conn.execute('ROLLBACK')
+                        raise
+                return
+            except sqlite3.OperationalError as e:
+                if 'locked' not in str(e) or attempt == BUSY_ATTEMPTS:
+                    raise
+                logging.warning(f"Send ledger is locked, retrying write (attempt {attempt}): {str(e)}")
+                time.sleep(attempt)
+
+    def open_run(self, upload_key, subject):
+        """Return (run_id, resumed): the latest unfinished run for this upload and subject, or a new one"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT run_id FROM runs WHERE upload_key = ? AND subject = ? AND status = 'open' "
+                "ORDER BY created_at DESC LIMIT 1",
+                (upload_key, subject)
+            ).fetchone()
+        if row:
+            return row[0], True
+
+        run_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        self._write([(
+            "INSERT INTO runs (run_id, upload_key, subject, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'open', ?, ?)",
+            [(run_id, upload_key, subject, now, now)]
+        )])
+        return run_id, False
+
+    def finish_run(self, run_id, status='completed'):
+        """Mark a run finished so it is no longer picked up for resumption"""
+        self.flush()
+        self._write([("UPDATE runs SET status = ?, updated_at = ? WHERE run_id = ?",
+                      [(status, time.time(), run_id)])])
+
+    def sent_rows(self, run_id):
+        """Return the row indexes already sent in a run"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT row_index FROM recipients WHERE run_id = ? AND state = 'sent'", (run_id,)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def queue(self, run_id, rows):
+        """Record (row_index, recipient) pairs as queued, keeping any existing state"""
+        now = time.time()
+        self._write([(
+            "INSERT OR IGNORE INTO recipients (run_id, row_index, recipient, state, updated_at) "
+            "VALUES (?, ?, ?, 'queued', ?)",
+            [(run_id, int(index), str(recipient), now) for index, recipient in rows]
+        )])
+
+    def record(self, run_id, row_index, recipient, state, error=None):
+        """Buffer the outcome of one attempt, committing once the batch is full or stale"""
+        with self._lock:
+            self._pending.append((state, error, time.time(), str(recipient), run_id, int(row_index)))
+            due = (len(self._pending) >= self.commit_batch
+                   or time.monotonic() - self._last_commit >= self.commit_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Commit buffered outcomes"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_commit = time.monotonic()
+        if not pending:
+            return
+        try:
+            self._write([(
+                "UPDATE recipients SET state = ?, error = ?, updated_at = ?, recipient = ?, "
+                "attempts = attempts + 1 WHERE run_id = ? AND row_index = ?",
+                pending
+            )])
+        except Exception as e:
+            logging.error(f"Failed to write send ledger: {str(e)}")
+            with self._lock:
+                self._pending = pending + self._pending
+
+    def account_usage(self, account):
+        """Return how many messages an account has sent today (UTC)"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sent FROM account_usage WHERE account = ? AND day = ?",
+                (account, time.strftime('%Y-%m-%d', time.gmtime()))
+            ).fetchone()
+        return row[0] if row else 0
+
+    def add_account_usage(self, account, count):
+        """Add to (or with a negative count, give back) an account's sent count for
+        today (UTC), used for daily quotas"""
+        day = time.strftime('%Y-%m-%d', time.gmtime())
+        if count > 0:
+            self._write([(
+                "INSERT INTO account_usage (account, day, sent) VALUES (?, ?, ?) "
+                "ON CONFLICT (account, day) DO UPDATE SET sent = sent + excluded.sent",
+                [(account, day, int(count))]
+            )])
+        elif count < 0:
+            self._write([(
+                "UPDATE account_usage SET sent = MAX(0, sent + ?) WHERE account = ? AND day = ?",
+                [(int(count), account, day)]
+            )])
+
+    def reserve_account_usage(self, account, count, limit):
+        """Take up to `count` of what is left of an account's daily `limit` in one
+        transaction, so concurrent runs cannot both spend the same quota; returns how
+        many were granted. Give back what is not sent with add_account_usage(-n)."""
+        day = time.strftime('%Y-%m-%d', time.gmtime())
+        with self._lock:
+            # IMMEDIATE takes the write lock before reading, so other processes wait
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    "SELECT sent FROM account_usage WHERE account = ? AND day = ?", (account, day)
+                ).fetchone()
+                granted = max(0, min(int(count), int(limit) - (row[0] if row else 0)))
+                if granted:
+                    self._conn.execute(
+                        "INSERT INTO account_usage (account, day, sent) VALUES (?, ?, ?) "
+                        "ON CONFLICT (account, day) DO UPDATE SET sent = sent + excluded.sent",
+                        (account, day, granted)
+                    )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return granted
+
+    def counts(self, run_id):
+        """Return the number of recipients in each state for a run"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM recipients WHERE run_id = ? GROUP BY state", (run_id,)
+            ).fetchall()
+        return dict(rows)
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """Return the process-wide ledger, opening it on first use"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = SendLedger(SEND_LEDGER_PATH)
+        return _ledger
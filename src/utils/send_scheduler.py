@@ -0,0 +1,562 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from src.config.settings import SCHEDULER_DB_PATH, SCHEDULER_SYNC_INTERVAL
+from src.utils.email_sender import EmailSender
+from src.utils.excel_parser import iter_recipient_chunks
+from src.utils.send_jobs import job_manager
+from src.utils.send_ledger import get_ledger
+from src.utils.sharded_sender import ShardedSender, load_accounts
+from src.utils.suppression import get_suppression_list
+from src.utils.upload_store import upload_store
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheduled_sends (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    start_at REAL NOT NULL,
+    window_seconds REAL NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    run_id TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner INTEGER,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    progress TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scheduled_by_status ON scheduled_sends (status, start_at);
+"""
+
+# Lower runs first: single sends from the preview pane go ahead of any due campaign
+PRIORITY_URGENT = 0
+PRIORITY_CAMPAIGN = 10
+
+# Seconds between checks while an asyncio send waits for its gate
+GATE_POLL_INTERVAL = 0.2
+
+# Seconds between the owner applying cancels from other processes and saving its
+# jobs' progress for them
+CONTROL_INTERVAL = 2.0
+
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def run_campaign(payload, job):
+    """Send a campaign's upload with the sharded sender if accounts are configured, else one account"""
+    accounts = load_accounts()
+    sender = ShardedSender(accounts) if accounts else EmailSender()
+    return sender.send_batch_chunks(
+        # Rows failing validation of the saved mapping are reported on the job;
+        # suppressed addresses and repeats are dropped before rendering
+        iter_recipient_chunks(payload['excel_upload_id'], payload.get('column_mapping') or {},
+                              suppression=get_suppression_list(), dedupe=True,
+                              on_rejected=job.record_rejected),
+        payload['template'],
+        payload['subject'],
+        payload['placeholder_settings'],
+        payload['edited_templates'],
+        payload['font_family'],
+        payload['font_size'],
+        job=job,
+        ledger=get_ledger(),
+        run_id=payload['run_id'],
+        attachments=payload['attachments']
+    )
+
+
+def send_single(payload):
+    return EmailSender().send_email(
+        recipient=payload['recipient'],
+        subject=payload['subject'],
+        body=payload['body'],
+        font_family=payload['font_family'],
+        font_size=payload['font_size'],
+        attachments=payload['attachments']
+    )
+
+
+class ScheduledSend:
+    """One queued campaign or single send"""
+
+    def __init__(self, entry_id, kind, priority, start_at, window_seconds, total, run_id, payload):
+        self.id = entry_id
+        self.kind = kind
+        self.priority = priority
+        self.start_at = start_at
+        self.window_seconds = window_seconds
+        self.total = total
+        self.run_id = run_id
+        self.payload = payload
+
+    @property
+    def end_at(self):
+        return self.start_at + self.window_seconds
+
+
+class SendGate:
+    """Paces a campaign job: its recipients are spread evenly until the end of its
+    window, and it holds back while urgent sends are queued"""
+
+    def __init__(self, scheduler, job, start_at, window_seconds):
+        self.scheduler = scheduler
+        self.job = job
+        self.window_seconds = window_seconds
+        self.end_at = start_at + window_seconds
+        self._next_slot = 0.0
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, count):
+        """Claim the send slot for `count` messages, returning seconds until it starts"""
+        if not self.window_seconds:
+            return 0.0
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot)
+            # What is left of the window is shared evenly by what is left to send, so
+            # a restart or a slow stretch catches up instead of overrunning the window
+            remaining = max(count, self.job.total - self.job.previously_sent - self._reserved)
+            self._next_slot = slot + max(0.0, self.end_at - slot) * count / remaining
+            self._reserved += count
+        return slot - now
+
+    def wait(self, count=1):
+        self.scheduler.wait_for_urgent(self.job)
+        delay = self.reserve(count)
+        if delay > 0:
+            self.job.wait_cancelled(delay)
+
+    async def wait_async(self, count=1):
+        while self.scheduler.urgent_pending and not self.job.cancelled:
+            await asyncio.sleep(GATE_POLL_INTERVAL)
+        deadline = time.monotonic() + self.reserve(count)
+        while not self.job.cancelled:
+            delay = deadline - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(min(delay, GATE_POLL_INTERVAL))
+
+
+class SendScheduler:
+    """Persistent priority queue of sends, dispatched by one background thread.
+
+    Entries wait in a heap ordered by start time; once due they move to a heap
+    ordered by priority, so a single send from the preview pane goes out before any
+    due campaign. Campaigns run as send jobs whose SendGate spreads them over their
+    window and pauses them while urgent sends are queued. Entries are kept in
+    SQLite and owned by the process that queued them, which alone sends them while
+    it lives: every SCHEDULER_SYNC_INTERVAL the queue picks up entries whose owner
+    died, pending or mid-send, and those resume through the send ledger. A process
+    claims an entry in the database before sending it. Other processes reach an
+    entry through the database too: cancel() flags it for the owner, and
+    snapshot() reads the progress the owner saves every CONTROL_INTERVAL.
+    """
+
+    def __init__(self, path, jobs=job_manager):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.jobs = jobs
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+
+        self._cond = threading.Condition()
+        self._waiting = []  # (start_at, seq, entry id)
+        self._ready = []  # (priority, start_at, seq, entry id)
+        self._counter = itertools.count()
+        self._entries = {}
+        self._running = {}
+        self._futures = {}
+        self._urgent = set()
+        self._urgent_clear = threading.Event()
+        self._urgent_clear.set()
+        self._thread = None
+
+    def start(self):
+        """Start the dispatcher thread"""
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch, name='send-scheduler', daemon=True)
+                self._thread.start()
+
+    def schedule_campaign(self, payload, total, start_at=None, window_seconds=0, priority=PRIORITY_CAMPAIGN):
+        """Queue a campaign (see run_campaign for the payload) and return its send job.
+
+        It starts at `start_at` (epoch seconds, default now) and its recipients are
+        spread over `window_seconds`, or sent as fast as the sender allows if 0.
+        """
+        run_id = payload.get('run_id')
+        if run_id is not None and self._run_active(run_id):
+            raise ValueError(f"Run {run_id} is already scheduled")
+        start_at = max(time.time(), start_at or 0)
+        entry = ScheduledSend(uuid.uuid4().hex[:12], 'campaign', priority, start_at,
+                              max(0.0, float(window_seconds or 0)), total, run_id, payload)
+        job = self._job_for(entry)
+        self._insert(entry, job.snapshot())
+        self._push(entry)
+        logging.info(f"Scheduled {total} emails for {time.ctime(start_at)} over {entry.window_seconds:.0f}s")
+        return job
+
+    def send_now(self, payload):
+        """Queue a single send (see send_single) ahead of every campaign, returning a
+        Future of its success flag"""
+        entry = ScheduledSend(uuid.uuid4().hex[:12], 'single', PRIORITY_URGENT, time.time(), 0.0, 1, None, payload)
+        future = Future()
+        with self._cond:
+            self._futures[entry.id] = future
+        self._insert(entry)
+        self._push(entry)
+        return future
+
+    def cancel(self, entry_id):
+        """Cancel a send queued by any process. One that has not started yet is dropped
+        (returns True); a running one is flagged for its owner to stop (returns False,
+        as when there is no such send)."""
+        with self._cond:
+            entry = self._entries.pop(entry_id, None)
+        if entry is not None:
+            self._finish(entry.id, 'cancelled', expected='pending')
+            self._drop(entry.id)
+            return True
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "UPDATE scheduled_sends SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'pending'",
+                (time.time(), entry_id)
+            )
+            if cursor.rowcount != 1:
+                self._conn.execute(
+                    "UPDATE scheduled_sends SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'running'",
+                    (time.time(), entry_id)
+                )
+        return cursor.rowcount == 1
+
+    def snapshot(self, entry_id):
+        """Progress of a campaign, from its job if this process runs it, else as last
+        saved by its owner; None if there is no such campaign"""
+        job = self.jobs.get(entry_id)
+        if job is not None:
+            return job.snapshot()
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT status, progress, error FROM scheduled_sends WHERE id = ? AND kind = 'campaign'", (entry_id,)
+            ).fetchone()
+        if row is None or row[1] is None:
+            return None
+        status, progress, error = row
+        snapshot = json.loads(progress)
+        # Cancelled before its owner saved again, or the owner died mid-send
+        if status in FINISHED_STATUSES and snapshot['status'] not in FINISHED_STATUSES:
+            snapshot.update(status=status, error=error, eta=None)
+        return snapshot
+
+    @property
+    def urgent_pending(self):
+        return not self._urgent_clear.is_set()
+
+    def wait_for_urgent(self, job=None):
+        """Block while urgent sends are queued or sending, or until `job` is cancelled"""
+        while not self._urgent_clear.wait(GATE_POLL_INTERVAL):
+            if job is not None and job.cancelled:
+                return
+
+    def status(self):
+        """Queue depth and the expected finish of everything queued, for the UI"""
+        now = time.time()
+        with self._cond:
+            queued = list(self._entries.values())
+            running = list(self._running.values())
+        snapshots = [job.snapshot() for job in running]
+        etas = [snapshot['eta'] for snapshot in snapshots if snapshot['eta']]
+        etas.extend(entry.end_at for entry in queued if entry.window_seconds)
+        return {
+            'queued': len(queued),
+            'running': len(running),
+            'recipients': sum(entry.total for entry in queued) + sum(snapshot['remaining'] for snapshot in snapshots),
+            'next_start': min((entry.start_at for entry in queued if entry.start_at > now), default=None),
+            'eta': max(etas, default=None),
+        }
+
+    def _insert(self, entry, progress=None):
+        now = time.time()
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT INTO scheduled_sends (id, kind, priority, start_at, window_seconds, total, run_id, "
+                "payload, status, owner, progress, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?, ?, ?)",
+                (entry.id, entry.kind, entry.priority, entry.start_at, entry.window_seconds, entry.total,
+                 entry.run_id, json.dumps(entry.payload), os.getpid(),
+                 None if progress is None else json.dumps(progress), now, now)
+            )
+
+    def _run_active(self, run_id):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM scheduled_sends WHERE run_id = ? AND status IN ('pending', 'running')", (run_id,)
+            ).fetchone()
+        return row is not None
+
+    def _claim(self, entry_id):
+        """Mark an entry as sent by this process, unless another process took it first"""
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "UPDATE scheduled_sends SET status = 'running', owner = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'pending'",
+                (os.getpid(), time.time(), entry_id)
+            )
+        return cursor.rowcount == 1
+
+    def _finish(self, entry_id, status, error=None, expected='running', progress=None):
+        with self._db_lock:
+            self._conn.execute(
+                "UPDATE scheduled_sends SET status = ?, error = ?, progress = COALESCE(?, progress), updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (status, error, None if progress is None else json.dumps(progress), time.time(), entry_id, expected)
+            )
+
+    def _drop(self, entry_id):
+        """Forget a queued entry cancelled before it started, closing its job"""
+        self._urgent_done(entry_id)
+        job = self.jobs.get(entry_id)
+        if job is not None:
+            job.cancel()
+            job.close('cancelled')
+
+    def _job_for(self, entry):
+        """The send job reporting a campaign's progress, created when it is queued"""
+        job = self.jobs.get(entry.id)
+        if job is None:
+            job = self.jobs.create(total=entry.total, run_id=entry.run_id, job_id=entry.id, status='scheduled')
+            job.start_at = entry.start_at
+            job.gate = SendGate(self, job, entry.start_at, entry.window_seconds)
+        return job
+
+    def _push(self, entry):
+        with self._cond:
+            self._entries[entry.id] = entry
+            heapq.heappush(self._waiting, (entry.start_at, next(self._counter), entry.id))
+            if entry.priority <= PRIORITY_URGENT:
+                self._urgent.add(entry.id)
+                self._urgent_clear.clear()
+            self._cond.notify()
+
+    def _urgent_done(self, entry_id):
+        with self._cond:
+            self._urgent.discard(entry_id)
+            if not self._urgent:
+                self._urgent_clear.set()
+
+    def _sync(self):
+        """Queue entries from the database whose owner died, and keep the uploads of
+        waiting campaigns from expiring"""
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, priority, start_at, window_seconds, total, run_id, payload, status, owner "
+                "FROM scheduled_sends WHERE status IN ('pending', 'running') ORDER BY start_at"
+            ).fetchall()
+        for entry_id, kind, priority, start_at, window_seconds, total, run_id, payload, status, owner in rows:
+            payload = json.loads(payload)
+            if status == 'pending' and owner not in (None, os.getpid()) and process_alive(owner):
+                # Its owner sends it; it is touched there too
+                continue
+            if status == 'running':
+                alive = entry_id in self._running if owner == os.getpid() else process_alive(owner)
+                if alive:
+                    continue
+                # Interrupted mid-send: queue it again, the ledger skips rows already sent
+                with self._db_lock:
+                    cursor = self._conn.execute(
+                        "UPDATE scheduled_sends SET status = 'pending', owner = NULL, updated_at = ? "
+                        "WHERE id = ? AND status = 'running' AND owner = ?",
+                        (time.time(), entry_id, owner)
+                    )
+                if cursor.rowcount != 1:
+                    continue
+                logging.info(f"Requeued scheduled send {entry_id} interrupted in process {owner}")
+            elif owner != os.getpid():
+                # Queued by a process that died: adopt it
+                with self._db_lock:
+                    cursor = self._conn.execute(
+                        "UPDATE scheduled_sends SET owner = ?, updated_at = ? WHERE id = ? AND status = 'pending' "
+                        "AND owner IS ?",
+                        (os.getpid(), time.time(), entry_id, owner)
+                    )
+                if cursor.rowcount != 1:
+                    continue
+            if kind == 'campaign':
+                upload_store.touch(payload['excel_upload_id'])
+            with self._cond:
+                known = entry_id in self._entries
+            if not known:
+                entry = ScheduledSend(entry_id, kind, priority, start_at, window_seconds, total, run_id, payload)
+                if kind == 'campaign':
+                    self._job_for(entry)
+                self._push(entry)
+
+    def _control(self):
+        """Apply cancels made by other processes to this process's entries, and save
+        the progress of its campaigns for them to read"""
+        with self._cond:
+            queued = list(self._entries)
+            running = dict(self._running)
+        entry_ids = queued + list(running)
+        if not entry_ids:
+            return
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT id, status, cancel_requested FROM scheduled_sends "
+                f"WHERE id IN ({', '.join('?' * len(entry_ids))})",
+                entry_ids
+            ).fetchall()
+        progress = []
+        for entry_id, status, cancel_requested in rows:
+            if entry_id in running:
+                job = running[entry_id]
+                if cancel_requested:
+                    job.cancel()
+                progress.append((json.dumps(job.snapshot()), entry_id))
+            elif status == 'cancelled':
+                with self._cond:
+                    entry = self._entries.pop(entry_id, None)
+                if entry is not None:
+                    self._drop(entry_id)
+        if progress:
+            with self._db_lock:
+                self._conn.executemany(
+                    "UPDATE scheduled_sends SET progress = ? WHERE id = ? AND status = 'running'", progress
+                )
+
+    def _next_due(self, timeout):
+        """Pop the most urgent due entry, or wait up to `timeout` seconds and return None"""
+        with self._cond:
+            now = time.time()
+            while self._waiting and self._waiting[0][0] <= now:
+                start_at, seq, entry_id = heapq.heappop(self._waiting)
+                entry = self._entries.get(entry_id)
+                if entry is not None:
+                    heapq.heappush(self._ready, (entry.priority, start_at, seq, entry_id))
+            while self._ready:
+                # Cancelled (and duplicate) heap items no longer have an entry
+                entry = self._entries.pop(heapq.heappop(self._ready)[-1], None)
+                if entry is not None:
+                    return entry
+            if self._waiting:
+                timeout = min(timeout, self._waiting[0][0] - now)
+            self._cond.wait(max(0.0, timeout))
+        return None
+
+    def _dispatch(self):
+        next_sync = next_control = 0.0
+        while True:
+            if time.monotonic() >= next_sync:
+                try:
+                    self._sync()
+                except Exception as e:
+                    logging.error(f"Error loading scheduled sends: {str(e)}")
+                next_sync = time.monotonic() + SCHEDULER_SYNC_INTERVAL
+            if time.monotonic() >= next_control:
+                try:
+                    self._control()
+                except Exception as e:
+                    logging.error(f"Error updating scheduled sends: {str(e)}")
+                next_control = time.monotonic() + CONTROL_INTERVAL
+            entry = self._next_due(min(next_sync, next_control) - time.monotonic())
+            if entry is None:
+                continue
+            try:
+                if not self._claim(entry.id):
+                    # Cancelled, possibly from another process
+                    self._drop(entry.id)
+                    continue
+                if entry.kind == 'single':
+                    self._send_single(entry)
+                else:
+                    self._start_campaign(entry)
+            except Exception as e:
+                logging.error(f"Error starting scheduled send {entry.id}: {str(e)}")
+
+    def _send_single(self, entry):
+        with self._cond:
+            future = self._futures.pop(entry.id, None)
+        sent = False
+        try:
+            sent = send_single(entry.payload)
+        finally:
+            self._finish(entry.id, 'completed' if sent else 'failed')
+            self._urgent_done(entry.id)
+            if future is not None:
+                future.set_result(sent)
+
+    def _start_campaign(self, entry):
+        job = self._job_for(entry)
+        if job.cancelled:
+            job.close('cancelled')
+            self._finish(entry.id, 'cancelled', progress=job.snapshot())
+            return
+        with self._cond:
+            self._running[entry.id] = job
+        self.jobs.start(job, self._run_campaign, entry)
+
+    def _run_campaign(self, entry, job):
+        status, error = 'failed', None
+        try:
+            run_campaign(entry.payload, job)
+            status = 'cancelled' if job.cancelled else 'completed'
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            # JobManager closes the job after this returns, so save it as it will end
+            progress = dict(job.snapshot(), status=status, error=error, eta=None)
+            self._finish(entry.id, status, error, progress=progress)
+            with self._cond:
+                self._running.pop(entry.id, None)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler, starting its dispatcher on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = SendScheduler(SCHEDULER_DB_PATH)
+            _scheduler.start()
+        return _scheduler
+
+
+def _forget_after_fork():
+    # Threads do not survive fork; a forked worker starts its own dispatcher on first use
+    global _scheduler, _scheduler_lock
+    _scheduler = None
+    _scheduler_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_after_fork)
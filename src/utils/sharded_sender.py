@@ -0,0 +1,498 @@
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from src.config.settings import SEND_ACCOUNTS_FILE, LOGGING_CONFIG
+from src.utils.lazy_import import lazy_module
+from src.utils.log_setup import init_logging, forward_logs
+from src.utils.metrics import timed, MESSAGES_TOTAL
+from src.utils.recipient_store import find_email_column
+
+pd = lazy_module('pandas')
+
+# Seconds between checks of the parent job's pause/cancel state and of worker liveness
+POLL_INTERVAL = 0.2
+
+# Chunks queued per worker ahead of the one it is sending
+TASK_QUEUE_DEPTH = 2
+
+
+def load_accounts(path=SEND_ACCOUNTS_FILE):
+    """Read the sender accounts for sharded sending, or [] when none are configured.
+
+    The file holds a JSON list of accounts, for example:
+
+        [{"email_address": "a@example.com", "password_env": "ACCOUNT_A_PASSWORD",
+          "smtp_server": "smtp.office365.com", "smtp_port": 587,
+          "rate_per_minute": 30, "daily_limit": 10000, "weight": 1}]
+
+    `password` may be given inline or read from the variable named by `password_env`;
+    server, port, STARTTLS and rate settings default to the usual environment variables.
+    """
+    if not path:
+        return []
+    with open(path, encoding='utf-8') as f:
+        accounts = json.load(f)
+
+    for account in accounts:
+        if account.get('password_env'):
+            account['password'] = os.getenv(account['password_env'])
+        if not account.get('email_address') or not account.get('password'):
+            raise ValueError(f"Sender account {account.get('email_address')!r} is missing credentials")
+    return accounts
+
+
+class WorkerJob:
+    """Stands in for the parent's SendJob inside a worker process"""
+
+    def __init__(self, results, resume, cancel):
+        self.results = results
+        self.resume = resume
+        self.cancel = cancel
+
+    @property
+    def paused(self):
+        return not self.resume.is_set()
+
+    @property
+    def cancelled(self):
+        return self.cancel.is_set()
+
+    def wait_to_proceed(self):
+        self.resume.wait()
+        return not self.cancelled
+
+    def pace(self, count=1):
+        # The parent paces scheduled sends a chunk at a time before dispatch
+        pass
+
+    async def pace_async(self, count=1):
+        pass
+
+    def record(self, recipient, success):
+        self.results.put(('record', recipient, success))
+
+    def record_previously_sent(self, count):
+        # Already-sent rows are filtered out by the parent before dispatch
+        pass
+
+
+class WorkerLedger:
+    """Forwards ledger writes to the parent, which owns the SQLite connection"""
+
+    def __init__(self, results):
+        self.results = results
+
+    def queue(self, run_id, rows):
+        # The parent queues rows before dispatching them
+        pass
+
+    def record(self, run_id, row_index, recipient, state, error=None):
+        self.results.put(('ledger', int(row_index), str(recipient), state, error))
+
+    def flush(self):
+        pass
+
+
+def shard_worker(shard, account, options, run_id, logging_config, log_records, tasks, results, resume, cancel):
+    """Worker process: send every DataFrame put on `tasks` from one account until None arrives"""
+    from src.utils.email_sender import EmailSender
+
+    # The parent writes (and rotates) the log files; workers only forward records
+    init_logging(logging_config, forward_queue=log_records)
+    try:
+        sender = EmailSender(account)
+        init_error = None
+    except Exception as e:
+        sender = None
+        init_error = str(e)
+        logging.error(f"Sender account {account.get('email_address')} could not be set up: {init_error}")
+
+    job = WorkerJob(results, resume, cancel)
+    # Per-row outcomes always go to the parent, which tracks the rows each worker holds
+    checkpoint = (WorkerLedger(results), run_id, ())
+    while True:
+        df = tasks.get()
+        if df is None:
+            break
+        try:
+            if sender is None:
+                raise RuntimeError(init_error)
+            successful, failed_emails = sender._send_chunk(df, job=job, checkpoint=checkpoint, **options)
+        except Exception as e:
+            logging.error(f"Shard {shard} failed a chunk of {len(df)} emails: {str(e)}")
+            email_column = find_email_column(df.columns)
+            failed_emails = [str(email) for email in df[email_column]] if email_column else []
+            for index, email in zip(df.index, failed_emails):
+                job.record(email, False)
+                checkpoint[0].record(run_id, index, email, 'failed', str(e))
+            successful = 0
+        results.put(('chunk', shard, successful, failed_emails))
+    results.put(('exit', shard))
+
+
+class Shard:
+    """Parent-side handle on one account's worker process"""
+
+    def __init__(self, index, account, remaining):
+        self.index = index
+        self.account = account
+        self.weight = float(account.get('weight', 1))
+        self.remaining = remaining
+        self.current = 0.0
+        self.tasks = None
+        self.process = None
+        self.sent = 0
+        # Reserved quota for rows that failed, given back once their chunk is done
+        self.unsent = 0
+
+    @property
+    def name(self):
+        return self.account['email_address']
+
+    @property
+    def available(self):
+        return self.remaining is None or self.remaining > 0
+
+
+class InFlightRows:
+    """Rows handed to worker processes that have no final outcome yet.
+
+    When a worker exits, whatever it still holds is taken back so it can be deferred
+    to a later resume instead of silently staying 'queued'. `lock` also guards the
+    run's report, which the dispatching and collecting threads both update.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._rows = {}  # row index -> (shard index, recipient)
+        self._exited = set()
+
+    def add(self, shard, rows):
+        """Track (row index, recipient) pairs about to be dispatched to a shard,
+        returning False if the shard has already exited"""
+        with self.lock:
+            if shard.index in self._exited:
+                return False
+            self._rows.update((int(index), (shard.index, recipient)) for index, recipient in rows)
+        return True
+
+    def settle(self, row_index):
+        """Forget a row that reached a final outcome, returning its shard index"""
+        with self.lock:
+            entry = self._rows.pop(row_index, None)
+        return entry[0] if entry is not None else None
+
+    def discard(self, rows):
+        """Stop tracking rows that were never dispatched, returning those still held;
+        a shard that exited meanwhile has already taken back the rest"""
+        with self.lock:
+            return [(index, recipient) for index, recipient in rows
+                    if self._rows.pop(int(index), None) is not None]
+
+    def abandon(self, shard):
+        """Mark a shard exited and take back the (row index, recipient) pairs it held"""
+        with self.lock:
+            self._exited.add(shard.index)
+            rows = [(index, recipient) for index, (owner, recipient) in self._rows.items()
+                    if owner == shard.index]
+            for index, _ in rows:
+                del self._rows[index]
+        return rows
+
+
+class ShardedSender:
+    """Send a batch across several accounts/relays, one worker process per account.
+
+    Recipients are spread over the accounts by smooth weighted round-robin, each
+    account stops receiving rows once its `daily_limit` for the day is used up, and
+    the workers' outcomes are merged into one (successful, total, failed_emails)
+    report. The parent owns the job, the ledger and the daily usage counts; quota is
+    reserved in the ledger as each chunk is dispatched, so concurrent runs share it.
+    Rows no account can take, and rows held by a worker that exits early, are
+    deferred and the run is left open for a later resume.
+    """
+
+    def __init__(self, accounts):
+        if not accounts:
+            raise ValueError("Sharded sending needs at least one sender account")
+        self.accounts = accounts
+
+    def plan_shards(self, ledger=None):
+        shards = []
+        for index, account in enumerate(self.accounts):
+            remaining = None
+            if account.get('daily_limit'):
+                used = ledger.account_usage(account['email_address']) if ledger is not None else 0
+                remaining = max(0, int(account['daily_limit']) - used)
+            shards.append(Shard(index, account, remaining))
+        return shards
+
+    def partition(self, df, shards):
+        """Split a chunk's rows across shards with quota left, returning ({shard: rows}, leftover rows)"""
+        positions = {shard.index: [] for shard in shards}
+        leftover = []
+        for position in range(len(df)):
+            candidates = [shard for shard in shards if shard.available]
+            if not candidates:
+                leftover.append(position)
+                continue
+            # Smooth weighted round-robin keeps the interleaving even for any weights
+            for shard in candidates:
+                shard.current += shard.weight
+            chosen = max(candidates, key=lambda shard: shard.current)
+            chosen.current -= sum(shard.weight for shard in candidates)
+            if chosen.remaining is not None:
+                chosen.remaining -= 1
+            positions[chosen.index].append(position)
+        parts = {shard.index: df.iloc[rows] for shard in shards if (rows := positions[shard.index])}
+        return parts, df.iloc[leftover]
+
+    def reserve(self, shard, df, ledger):
+        """Reserve daily quota for a shard's part of a chunk, returning (rows to
+        dispatch, rows over the limit)"""
+        limit = shard.account.get('daily_limit')
+        if ledger is None or not limit:
+            return df, df.iloc[:0]
+        granted = ledger.reserve_account_usage(shard.name, len(df), int(limit))
+        if granted < len(df):
+            # Another run has used the quota since this one planned its shards
+            shard.remaining = 0
+        return df.iloc[:granted], df.iloc[granted:]
+
+    def release(self, shard, ledger, count):
+        """Give back quota reserved for rows a shard did not send"""
+        if count and ledger is not None and shard.account.get('daily_limit'):
+            ledger.add_account_usage(shard.name, -count)
+
+    def defer(self, rows, reason, report, inflight, job, ledger, run_id):
+        """Report (row index, recipient) pairs as not sent and leave them to a resume"""
+        for index, email in rows:
+            with inflight.lock:
+                report['deferred'] += 1
+                report['failed_emails'].append(email)
+            if job is not None:
+                job.record(email, False)
+            if ledger is not None:
+                ledger.record(run_id, index, email, 'deferred', reason)
+
+    def dispatch(self, shard, df):
+        """Hand a DataFrame to a worker, returning False if the worker has died"""
+        if not shard.process.is_alive():
+            return False
+        while True:
+            try:
+                shard.tasks.put(df, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                if not shard.process.is_alive():
+                    return False
+
+    def pace_batches(self, df, job, shards):
+        """Split a chunk for pacing. A job spread over a window gets batches of about
+        one row per sending thread across the shards, so the window is filled evenly
+        instead of in bursts of a whole chunk."""
+        gate = getattr(job, 'gate', None)
+        if gate is None or not gate.window_seconds:
+            return [df]
+        size = len(shards) * max(1, int(os.getenv('SEND_WORKERS', os.getenv('SMTP_POOL_SIZE', '4'))))
+        return [df.iloc[start:start + size] for start in range(0, len(df), size)]
+
+    def distribute(self, df, email_column, shards, report, inflight, job, ledger, run_id):
+        """Dispatch a DataFrame's rows across the shards, deferring what none can take"""
+        parts, leftover = self.partition(df, shards)
+        orphaned = []
+        for index, part in parts.items():
+            shard = shards[index]
+            part, over_limit = self.reserve(shard, part, ledger)
+            leftover = pd.concat([leftover, over_limit])
+            if part.empty:
+                continue
+            rows = list(zip(part.index, part[email_column]))
+            if not (inflight.add(shard, rows) and self.dispatch(shard, part)):
+                logging.error(f"Send shard {index} exited early")
+                shard.remaining = 0
+                rows = inflight.discard(rows)
+                self.release(shard, ledger, len(rows))
+                orphaned.extend(rows)
+
+        # Rows no account can take stay in the ledger for a later resume
+        self.defer(zip(leftover.index, leftover[email_column]), 'Daily sending limit reached',
+                   report, inflight, job, ledger, run_id)
+        self.defer(orphaned, 'Send shard exited', report, inflight, job, ledger, run_id)
+
+    @timed('send_batch_sharded')
+    def send_batch_chunks(self, chunks, template, subject, placeholder_settings=None, edited_templates=None,
+                          font_family="Calibri", font_size="11", job=None, ledger=None, run_id=None,
+                          attachments=None):
+        """Send emails from an iterable of DataFrame chunks across all configured accounts.
+
+        Takes the same arguments and returns the same report as
+        EmailSender.send_batch_chunks, so callers can use either.
+        """
+        options = {
+            'template': template,
+            'subject': subject,
+            'placeholder_settings': placeholder_settings or {},
+            'edited_templates': edited_templates or {},
+            'font_family': font_family,
+            'font_size': font_size,
+            'attachments': tuple(attachments or ()),
+        }
+        shards = self.plan_shards(ledger)
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        log_records = context.Queue()
+        log_forwarder = forward_logs(log_records)
+        resume = context.Event()
+        resume.set()
+        cancel = context.Event()
+        for shard in shards:
+            shard.tasks = context.Queue(maxsize=TASK_QUEUE_DEPTH)
+            shard.process = context.Process(
+                target=shard_worker,
+                args=(shard.index, shard.account, options, run_id if ledger is not None else None,
+                      LOGGING_CONFIG, log_records, shard.tasks, results, resume, cancel),
+                name=f"send-shard-{shard.index}",
+                daemon=True
+            )
+            shard.process.start()
+        logging.info(f"Started {len(shards)} send shards")
+
+        report = {'successful': 0, 'failed_emails': [], 'deferred': 0}
+        inflight = InFlightRows()
+        collector = threading.Thread(
+            target=self.collect, args=(shards, results, resume, cancel, report, inflight, job, ledger, run_id),
+            name='send-shard-collector', daemon=True
+        )
+        collector.start()
+
+        total_emails = 0
+        sent_rows = ledger.sent_rows(run_id) if ledger is not None else set()
+        try:
+            for df in chunks:
+                if job is not None and job.cancelled:
+                    break
+                total_emails += len(df)
+                if job is not None and job.total < total_emails:
+                    job.total = total_emails
+
+                email_column = find_email_column(df.columns)
+                if not email_column:
+                    logging.error("No email column found in DataFrame")
+                    continue
+
+                if ledger is not None:
+                    done = df.index.isin(list(sent_rows))
+                    previously_sent = int(done.sum())
+                    df = df[~done]
+                    with inflight.lock:
+                        report['successful'] += previously_sent
+                    if previously_sent and job is not None:
+                        job.record_previously_sent(previously_sent)
+                    ledger.queue(run_id, zip(df.index, df[email_column]))
+
+                # Scheduled sends are paced a batch at a time across the shards
+                for batch in self.pace_batches(df, job, shards):
+                    if job is not None:
+                        job.pace(len(batch))
+                        if job.cancelled:
+                            break
+                    self.distribute(batch, email_column, shards, report, inflight, job, ledger, run_id)
+        finally:
+            for shard in shards:
+                self.dispatch(shard, None)
+            collector.join()
+            for shard in shards:
+                shard.process.join()
+            log_forwarder.stop()
+
+        if report['deferred']:
+            logging.warning(f"{report['deferred']} emails were deferred to a later resume: "
+                            f"daily limits were reached or a send shard exited")
+        for shard in shards:
+            logging.info(f"Account {shard.name} sent {shard.sent} emails")
+
+        if job is not None and not job.cancelled:
+            job.total = total_emails
+        if ledger is not None:
+            if report['deferred'] or (job is not None and job.cancelled):
+                ledger.flush()
+            else:
+                ledger.finish_run(run_id)
+
+        return report['successful'], total_emails, report['failed_emails']
+
+    def collect(self, shards, results, resume, cancel, report, inflight, job, ledger, run_id):
+        """Merge worker events into the report, job and ledger, and relay pause/cancel to workers"""
+        pending = {shard.index for shard in shards}
+        while pending:
+            if job is not None:
+                if job.cancelled:
+                    cancel.set()
+                    resume.set()
+                elif job.status == 'paused':
+                    resume.clear()
+                else:
+                    resume.set()
+            try:
+                event = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                # A worker that died without saying goodbye will never send 'exit'
+                for shard in shards:
+                    if shard.index in pending and not shard.process.is_alive() and results.empty():
+                        pending.discard(shard.index)
+                        self.shard_exited(shard, report, inflight, job, ledger, run_id, unexpected=True)
+                continue
+            if event[0] == 'exit':
+                pending.discard(event[1])
+                self.shard_exited(shards[event[1]], report, inflight, job, ledger, run_id)
+                continue
+            self.handle_event(event, shards, report, inflight, job, ledger, run_id)
+        if ledger is not None:
+            ledger.flush()
+
+    def shard_exited(self, shard, report, inflight, job, ledger, run_id, unexpected=False):
+        """Defer the rows a finished or dead worker still held and give back their quota"""
+        rows = inflight.abandon(shard)
+        if unexpected:
+            logging.error(f"Send shard {shard.index} exited unexpectedly holding {len(rows)} emails")
+        self.release(shard, ledger, shard.unsent + len(rows))
+        shard.unsent = 0
+        # Rows skipped because the job was cancelled stay queued for the next send
+        if rows and (unexpected or job is None or not job.cancelled):
+            self.defer(rows, 'Send shard exited before sending', report, inflight, job, ledger, run_id)
+
+    def handle_event(self, event, shards, report, inflight, job, ledger, run_id):
+        kind = event[0]
+        if kind == 'record':
+            _, recipient, sent = event
+            MESSAGES_TOTAL.inc(status='sent' if sent else 'failed')
+            if job is not None:
+                job.record(recipient, sent)
+        elif kind == 'ledger':
+            # Final outcomes are counted per row, so a worker that dies mid-chunk
+            # still reports what it sent
+            _, row_index, recipient, state, error = event
+            if state in ('sent', 'failed'):
+                owner = inflight.settle(row_index)
+                if owner is not None:
+                    shard = shards[owner]
+                    with inflight.lock:
+                        if state == 'sent':
+                            shard.sent += 1
+                            report['successful'] += 1
+                        else:
+                            shard.unsent += 1
+                            report['failed_emails'].append(recipient)
+            if ledger is not None:
+                ledger.record(run_id, row_index, recipient, state, error)
+        elif kind == 'chunk':
+            _, index, successful, failed_emails = event
+            shard = shards[index]
+            if ledger is not None and not shard.account.get('daily_limit'):
+                ledger.add_account_usage(shard.name, successful)
+            self.release(shard, ledger, shard.unsent)
+            shard.unsent = 0
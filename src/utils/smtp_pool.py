@@ -0,0 +1,251 @@
+import re
+import smtplib
+import threading
+import time
+import logging
+from src.utils.metrics import smtp_phase
+from src.utils.message_builder import message_bytes
+
+# Connections idle for longer than this are checked with NOOP before reuse
+NOOP_CHECK_INTERVAL = 30
+
+# SMTP reply codes that mean the server is closing the session, which is then discarded
+RECONNECT_CODES = (421,)
+
+LEADING_DOT = re.compile(rb'(?m)^\.')
+CRLF = b'\r\n'
+
+
+def data_chunks(message):
+    """The DATA payload for a message, dot-stuffed and ending with the final '.' line.
+
+    A PreparedMessage is returned in pieces so shared attachment parts are written
+    as they are rather than copied into one buffer.
+    """
+    if isinstance(message, bytes):
+        data = LEADING_DOT.sub(b'..', message)
+        if not data.endswith(CRLF):
+            data += CRLF
+        return [data + b'.' + CRLF]
+    return [LEADING_DOT.sub(b'..', message.text), *message.parts, b'.' + CRLF]
+
+
+def pipelined_sendmail(smtp, from_addr, to_addrs, msg_bytes):
+    """Like SMTP.sendmail, but send MAIL, every RCPT and DATA in one write (RFC 2920).
+
+    A transaction costs two round trips however many recipients it has. Returns the
+    refused recipients as {recipient: (code, message)} and raises the same exceptions
+    as sendmail.
+    """
+    options = f" SIZE={len(msg_bytes)}" if smtp.has_extn('size') else ''
+    commands = [f"MAIL FROM:{smtplib.quoteaddr(from_addr)}{options}"]
+    commands.extend(f"RCPT TO:{smtplib.quoteaddr(recipient)}" for recipient in to_addrs)
+    commands.append("DATA")
+    smtp.send(''.join(command + '\r\n' for command in commands))
+
+    mail_reply = smtp.getreply()
+    rcpt_replies = [smtp.getreply() for _ in to_addrs]
+    data_code, data_message = smtp.getreply()
+
+    refused = {recipient: reply for recipient, reply in zip(to_addrs, rcpt_replies)
+               if reply[0] not in (250, 251)}
+    error = None
+    if mail_reply[0] != 250:
+        error = smtplib.SMTPSenderRefused(mail_reply[0], mail_reply[1], from_addr)
+    elif len(refused) == len(to_addrs):
+        error = smtplib.SMTPRecipientsRefused(refused)
+    elif data_code != 354:
+        error = smtplib.SMTPDataError(data_code, data_message)
+    if error is not None:
+        if data_code == 354:
+            # The server is waiting for a body we no longer want to send
+            smtp.send(b'.' + CRLF)
+            smtp.getreply()
+        if mail_reply[0] != 421:
+            smtp.rset()
+        raise error
+
+    for chunk in data_chunks(msg_bytes):
+        smtp.send(chunk)
+    code, message = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, message)
+    return refused
+
+
+class PooledConnection:
+    """An authenticated SMTP session plus its usage bookkeeping"""
+    __slots__ = ('smtp', 'messages_sent', 'last_used')
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPConnectionPool:
+    """Keep authenticated SMTP connections alive and reuse them across sends"""
+
+    def __init__(self, host, port, username, password, size=4,
+                 max_messages_per_connection=100, timeout=30, use_starttls=True):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = max(1, int(size))
+        self.max_messages_per_connection = max(1, int(max_messages_per_connection))
+        self.timeout = timeout
+        self.use_starttls = use_starttls
+
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._closed = False
+
+    def _connect(self):
+        """Open a new connection and run STARTTLS and AUTH"""
+        with smtp_phase('connect'):
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if self.use_starttls:
+                with smtp_phase('starttls'):
+                    smtp.starttls()
+            with smtp_phase('auth'):
+                smtp.login(self.username, self.password)
+        except Exception:
+            self._quit(smtp)
+            raise
+        logging.info(f"Opened SMTP connection to {self.host}:{self.port}")
+        return PooledConnection(smtp)
+
+    @staticmethod
+    def _quit(smtp):
+        """Close a connection, ignoring errors from an already dead socket"""
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+    def _is_alive(self, conn):
+        """Health-check a connection that has been idle for a while"""
+        if time.monotonic() - conn.last_used < NOOP_CHECK_INTERVAL:
+            return True
+        try:
+            return conn.smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Take a healthy connection from the pool, opening one if needed"""
+        self._slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect()
+                if self._is_alive(conn):
+                    return conn
+                self._quit(conn.smtp)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, recycling it if worn out or broken"""
+        try:
+            conn.last_used = time.monotonic()
+            if (discard or self._closed
+                    or conn.messages_sent >= self.max_messages_per_connection):
+                self._quit(conn.smtp)
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+        finally:
+            self._slots.release()
+
+    def sendmail(self, from_addr, to_addrs, msg_bytes):
+        """Send an already-serialised message (CRLF line endings) over a pooled connection.
+
+        Returns the refused recipients like SMTP.sendmail, pipelining the envelope
+        when the server advertises PIPELINING.
+        """
+        def transaction(smtp):
+            with smtp_phase('transaction'):
+                smtp.ehlo_or_helo_if_needed()
+                if smtp.has_extn('pipelining'):
+                    return pipelined_sendmail(smtp, from_addr, to_addrs, msg_bytes)
+                return smtp.sendmail(from_addr, to_addrs, message_bytes(msg_bytes))
+        return self._run(transaction)
+
+    def _run(self, operation):
+        """Run `operation(smtp)` on a pooled connection.
+
+        A dropped or closing session is discarded and the error raised as it is; the
+        sender's retry policy decides whether and when to try again, so a failure is
+        never retried by two layers.
+        """
+        conn = self.acquire()
+        try:
+            result = operation(conn.smtp)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.release(conn, discard=True)
+            raise
+        except smtplib.SMTPResponseException as e:
+            self.release(conn, discard=e.smtp_code in RECONNECT_CODES)
+            raise
+        except smtplib.SMTPRecipientsRefused:
+            # The server reset the transaction; the session is still usable
+            self.release(conn)
+            raise
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        conn.messages_sent += 1
+        self.release(conn)
+        return result
+
+    def close(self):
+        """Close all idle connections; in-use connections close when released"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._quit(conn.smtp)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(host, port, username, password, size=4, max_messages_per_connection=100,
+             use_starttls=True):
+    """Return the shared pool for an SMTP account, creating it on first use"""
+    key = (host, port, username)
+    size = max(1, int(size))
+    max_messages_per_connection = max(1, int(max_messages_per_connection))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if (pool is None or pool._closed or pool.password != password
+                or pool.size != size or pool.use_starttls != use_starttls
+                or pool.max_messages_per_connection != max_messages_per_connection):
+            if pool is not None:
+                pool.close()
+            pool = SMTPConnectionPool(host, port, username, password, size=size,
+                                      max_messages_per_connection=max_messages_per_connection,
+                                      use_starttls=use_starttls)
+            _pools[key] = pool
+        return pool
+
+
+def close_all_pools():
+    """Close every shared pool, sending QUIT on idle sessions; gunicorn's worker_exit
+    hook calls this when a worker shuts down"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -0,0 +1,195 @@
+import itertools
+import logging
+import os
+import smtplib
+import socket
+import subprocess
+import threading
+import time
+from src.utils.message_builder import message_bytes
+
+CRLF = b'\r\n'
+
+# sysexits.h: the MTA could not queue the message right now
+EX_TEMPFAIL = 75
+
+
+class SpoolFlushError(OSError):
+    """A batch of spooled messages could not be made durable and was discarded"""
+
+
+def envelope_headers(from_addr, to_addrs):
+    """Pickup-directory envelope lines (X-Sender / X-Receiver), as read by IIS/Exchange
+    style pickup services and easy to map for other MTAs"""
+    lines = [f"X-Sender: {from_addr}".encode('utf-8')]
+    lines.extend(f"X-Receiver: {recipient}".encode('utf-8') for recipient in to_addrs)
+    return CRLF.join(lines) + CRLF
+
+
+class SpoolTransport:
+    """Hand rendered messages to a local MTA through a Maildir-style spool.
+
+    Messages are written under `<directory>/<shard>/tmp` and renamed into
+    `<directory>/<shard>/new` once durable, so the MTA only ever sees complete
+    files. Files are fsynced in batches: once `flush_due`, the caller flushes the
+    `fsync_batch` messages written since the last flush (0 disables fsync), and
+    `shards` subdirectories keep any one directory from growing huge. With
+    `envelope`, each file starts with X-Sender/X-Receiver lines; a message for
+    several recipients is then spooled once per recipient, so no file lists the
+    other (undisclosed) recipients.
+    """
+    is_local = True
+    # A file write is cheaper than a thread handoff, so batches spool on one thread
+    single_threaded = True
+
+    def __init__(self, directory, shards=16, fsync_batch=100, envelope=False):
+        self.directory = directory
+        self.shards = max(1, int(shards))
+        self.fsync_batch = max(0, int(fsync_batch))
+        self.envelope = envelope
+        self._counter = itertools.count()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._hostname = socket.gethostname().replace('/', '_').replace(':', '_')
+        for shard in range(self.shards):
+            for name in ('tmp', 'new', 'cur'):
+                os.makedirs(os.path.join(self.shard_path(shard), name), exist_ok=True)
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, f"{shard:02x}")
+
+    def unique_name(self, sequence):
+        """Maildir unique name: time, pid and sequence, host"""
+        return f"{time.time():.6f}.P{os.getpid()}Q{sequence}.{self._hostname}"
+
+    @property
+    def buffered(self):
+        """True when sendmail() returns before the message is durable; see flush()"""
+        return self.fsync_batch > 0
+
+    @property
+    def flush_due(self):
+        """True once a full batch of messages is waiting for flush()"""
+        with self._lock:
+            return len(self._pending) >= self.fsync_batch
+
+    def sendmail(self, from_addr, to_addrs, msg_bytes):
+        """Spool one message for `to_addrs`, returning no refused recipients like SMTP.sendmail"""
+        if self.envelope and len(to_addrs) > 1:
+            for recipient in to_addrs:
+                self.sendmail(from_addr, [recipient], msg_bytes)
+            return {}
+        sequence = next(self._counter)
+        shard = self.shard_path(sequence % self.shards)
+        name = self.unique_name(sequence)
+        tmp_path = os.path.join(shard, 'tmp', name)
+        # Messages with attachments are written piece by piece from the shared parts
+        pieces = [msg_bytes] if isinstance(msg_bytes, bytes) else [msg_bytes.text, *msg_bytes.parts]
+        if self.envelope:
+            pieces.insert(0, envelope_headers(from_addr, to_addrs))
+
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o640)
+        try:
+            for piece in pieces:
+                view = memoryview(piece)
+                while view:
+                    view = view[os.write(fd, view):]
+        except Exception:
+            os.close(fd)
+            os.unlink(tmp_path)
+            raise
+
+        if not self.fsync_batch:
+            os.close(fd)
+            os.rename(tmp_path, os.path.join(shard, 'new', name))
+            return {}
+
+        with self._lock:
+            self._pending.append((fd, tmp_path, os.path.join(shard, 'new', name)))
+        return {}
+
+    def flush(self):
+        """Make every written message durable and visible to the MTA.
+
+        If any file cannot be synced the whole batch is deleted and SpoolFlushError raised.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        errors = []
+        for fd, _, _ in pending:
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                errors.append(e)
+            finally:
+                os.close(fd)
+        if errors:
+            # The batch is reported as not sent, so none of it may reach the MTA later
+            for _, tmp_path, _ in pending:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+            raise SpoolFlushError(f"Could not sync {len(errors)} of {len(pending)} spooled messages: {errors[0]}") from errors[0]
+        directories = set()
+        for _, tmp_path, new_path in pending:
+            os.rename(tmp_path, new_path)
+            directories.add(os.path.dirname(new_path))
+        # Persist the renames themselves
+        for directory in directories:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        logging.info(f"Spooled {len(pending)} messages to {self.directory}")
+
+    def close(self):
+        self.flush()
+
+
+class SendmailTransport:
+    """Pipe each rendered message to a sendmail-compatible binary"""
+    is_local = True
+
+    def __init__(self, path='/usr/sbin/sendmail', timeout=60):
+        self.path = path
+        self.timeout = timeout
+
+    def sendmail(self, from_addr, to_addrs, msg_bytes):
+        """Queue one message with `sendmail -i -f FROM -- RCPT...`, returning no refused recipients"""
+        command = [self.path, '-i', '-f', from_addr, '--', *to_addrs]
+        try:
+            process = subprocess.run(command, input=message_bytes(msg_bytes).replace(CRLF, b'\n'), capture_output=True,
+                                     timeout=self.timeout)
+        except subprocess.TimeoutExpired as e:
+            raise TimeoutError(f"{self.path} did not finish within {self.timeout}s") from e
+        if process.returncode != 0:
+            detail = process.stderr.decode('utf-8', 'replace').strip() or f"exit status {process.returncode}"
+            # Map the exit status onto SMTP codes so retry classification applies
+            code = 451 if process.returncode == EX_TEMPFAIL else 554
+            raise smtplib.SMTPResponseException(code, detail)
+        return {}
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+_spools = {}
+_spools_lock = threading.Lock()
+
+
+def get_spool(directory, shards=16, fsync_batch=100, envelope=False):
+    """Return the shared spool for a directory, creating it on first use"""
+    with _spools_lock:
+        spool = _spools.get(directory)
+        if spool is None or (spool.shards, spool.fsync_batch, spool.envelope) != (shards, fsync_batch, envelope):
+            if spool is not None:
+                spool.close()
+            spool = _spools[directory] = SpoolTransport(directory, shards, fsync_batch, envelope)
+        return spool
@@ -0,0 +1,307 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from src.config.settings import SUPPRESSION_DB_PATH, SUPPRESSION_FALSE_POSITIVE_RATE
+from src.utils.lazy_import import lazy_module
+from src.utils.recipient_store import find_email_column
+
+np = lazy_module('numpy')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS suppressions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    address TEXT NOT NULL UNIQUE,
+    reason TEXT NOT NULL,
+    added_at REAL NOT NULL
+);
+"""
+
+# Addresses per exact-match query; SQLite limits bound parameters
+LOOKUP_BATCH = 500
+
+# Saved Bloom filter: magic, capacity, size, hashes, count, last suppression id
+BLOOM_HEADER = struct.Struct('<4sQQQQQ')
+BLOOM_MAGIC = b'BLM1'
+
+# Rows added since the saved filter before it is saved again
+BLOOM_SAVE_EVERY = 10000
+
+MASK64 = (1 << 64) - 1
+
+# Recipient refusals that can mean the mailbox does not exist or will never accept mail
+HARD_BOUNCE_CODES = frozenset((550, 551, 553))
+
+# Enhanced status (RFC 3463) leading a reply text, e.g. "5.1.1 User unknown"
+ENHANCED_STATUS = re.compile(r'^\s*5\.1\.(\d{1,3})\b')
+
+# 5.1.x details about the sender rather than the recipient's mailbox
+SENDER_STATUS_DETAILS = frozenset((7, 8))
+
+
+def is_hard_bounce(code, message):
+    """True when a recipient refusal says the mailbox is gone: a 550/551/553 reply
+    with a 5.1.x (addressing) enhanced status. Bare codes are also used for policy
+    and spam rejections, so they are not enough on their own."""
+    if code not in HARD_BOUNCE_CODES:
+        return False
+    if isinstance(message, bytes):
+        message = message.decode('utf-8', 'replace')
+    match = ENHANCED_STATUS.match(str(message or ''))
+    return match is not None and int(match.group(1)) not in SENDER_STATUS_DETAILS
+
+
+def normalize_address(address):
+    return str(address).strip().lower()
+
+
+def address_digest(address):
+    """128-bit digest of a normalized address"""
+    return hashlib.blake2b(address.encode('utf-8'), digest_size=16).digest()
+
+
+class BloomFilter:
+    """Bit array answering "definitely not present" or "maybe present" for digests"""
+
+    def __init__(self, capacity, error_rate=SUPPRESSION_FALSE_POSITIVE_RATE):
+        self.capacity = max(1, int(capacity))
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, digest):
+        # Double hashing: k positions from two 64-bit halves of one digest, with
+        # 64-bit wraparound so add_many's vectorised arithmetic agrees
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [((first + i * second) & MASK64) % self.size for i in range(self.hashes)]
+
+    def add(self, digest):
+        for position in self.positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def add_many(self, digests):
+        """Add many digests at once with numpy; used to build the filter from the database"""
+        if not digests:
+            return
+        halves = np.frombuffer(b''.join(digests), dtype='<u8').reshape(-1, 2)
+        first, second = halves[:, 0], halves[:, 1] | np.uint64(1)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        size = np.uint64(self.size)
+        with np.errstate(over='ignore'):
+            for i in range(self.hashes):
+                positions = (first + np.uint64(i) * second) % size
+                masks = np.left_shift(1, (positions & np.uint64(7)).astype(np.uint8)).astype(np.uint8)
+                np.bitwise_or.at(bits, (positions >> np.uint64(3)).astype(np.intp), masks)
+        self.count += len(digests)
+
+    def __contains__(self, digest):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.positions(digest))
+
+
+class SuppressionList:
+    """Addresses that must not be mailed again (hard bounces, unsubscribes).
+
+    SQLite holds the exact list; an in-memory Bloom filter in front of it answers
+    most lookups without touching the database, so screening a large upload costs
+    one exact query per LOOKUP_BATCH possible matches. The filter is saved next to
+    the database so a new process does not rebuild it, and catches up with rows
+    added by other processes before every check.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._last_id = 0
+        self._saved_id = 0
+
+    def _refresh(self):
+        """Load rows added since the last check into the Bloom filter (lock held)"""
+        started = time.perf_counter()
+        building = self._bloom is None
+        if building and not self._load_bloom():
+            total = self._conn.execute("SELECT COUNT(*) FROM suppressions").fetchone()[0]
+            # Room to grow before the false positive rate degrades
+            self._bloom = BloomFilter(max(100000, total * 2))
+            self._last_id = self._saved_id = 0
+        rows = self._conn.execute(
+            "SELECT id, address FROM suppressions WHERE id > ? ORDER BY id", (self._last_id,)
+        ).fetchall()
+        if self._bloom.count + len(rows) > self._bloom.capacity:
+            # Rebuild larger from scratch rather than overfilling
+            self._bloom = None
+            self._drop_saved_bloom()
+            return self._refresh()
+        self._bloom.add_many([address_digest(address) for _, address in rows])
+        if rows:
+            self._last_id = rows[-1][0]
+        if self._last_id - self._saved_id >= BLOOM_SAVE_EVERY:
+            self._save_bloom()
+        if building:
+            logging.info(f"Loaded {self._bloom.count} suppressed addresses in {time.perf_counter() - started:.2f}s")
+
+    @property
+    def bloom_path(self):
+        return self.path + '.bloom'
+
+    def _load_bloom(self):
+        """Reuse the filter saved next to the database, if it still matches it"""
+        try:
+            with open(self.bloom_path, 'rb') as f:
+                magic, capacity, size, hashes, count, last_id = BLOOM_HEADER.unpack(f.read(BLOOM_HEADER.size))
+                bits = bytearray(f.read())
+        except (OSError, struct.error):
+            return False
+        max_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM suppressions").fetchone()[0]
+        if magic != BLOOM_MAGIC or len(bits) != (size + 7) // 8 or last_id > max_id:
+            return False
+        bloom = BloomFilter(capacity)
+        if (bloom.size, bloom.hashes) != (size, hashes):
+            # Saved with another false positive rate
+            return False
+        bloom.bits, bloom.count = bits, count
+        self._bloom, self._last_id, self._saved_id = bloom, last_id, last_id
+        return True
+
+    def _save_bloom(self):
+        bloom = self._bloom
+        temporary = f"{self.bloom_path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, bloom.capacity, bloom.size, bloom.hashes,
+                                      bloom.count, self._last_id))
+            f.write(bloom.bits)
+        os.replace(temporary, self.bloom_path)
+        self._saved_id = self._last_id
+
+    def _drop_saved_bloom(self):
+        try:
+            os.remove(self.bloom_path)
+        except FileNotFoundError:
+            pass
+
+    def add_many(self, addresses, reason):
+        """Suppress addresses, keeping the original reason for ones already listed"""
+        now = time.time()
+        rows = [(normalize_address(address), reason, now) for address in addresses]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO suppressions (address, reason, added_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (address) DO NOTHING",
+                rows
+            )
+        logging.info(f"Suppressed {len(rows)} addresses ({reason})")
+
+    def remove(self, address):
+        """Allow mailing an address again"""
+        with self._lock:
+            self._conn.execute("DELETE FROM suppressions WHERE address = ?", (normalize_address(address),))
+
+    def suppressed(self, addresses):
+        """Return the subset of `addresses` (normalized) that is suppressed"""
+        normalized = {normalize_address(address) for address in addresses}
+        with self._lock:
+            self._refresh()
+            bloom = self._bloom
+            candidates = [address for address in normalized if address_digest(address) in bloom]
+            found = set()
+            for start in range(0, len(candidates), LOOKUP_BATCH):
+                batch = candidates[start:start + LOOKUP_BATCH]
+                placeholders = ','.join('?' * len(batch))
+                found.update(row[0] for row in self._conn.execute(
+                    f"SELECT address FROM suppressions WHERE address IN ({placeholders})", batch
+                ))
+        return found
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM suppressions").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class DedupeIndex:
+    """Addresses already taken in one send, kept as 64-bit digests across chunks"""
+
+    def __init__(self):
+        self._seen = set()
+
+    def first_seen(self, addresses):
+        """Flag each address True the first time it appears, False for repeats"""
+        seen = self._seen
+        flags = []
+        for address in addresses:
+            key = address_digest(normalize_address(address))[:8]
+            if key in seen:
+                flags.append(False)
+            else:
+                seen.add(key)
+                flags.append(True)
+        return flags
+
+
+def screen_recipients(df, suppression=None, dedupe=None):
+    """Drop rows whose address is suppressed or was already seen, keeping the row index.
+
+    Returns (df, suppressed count, duplicate count).
+    """
+    email_column = find_email_column(df.columns)
+    if email_column is None or df.empty:
+        return df, 0, 0
+    addresses = [normalize_address(address) for address in df[email_column].tolist()]
+
+    keep = [True] * len(addresses)
+    suppressed_count = 0
+    if suppression is not None:
+        suppressed = suppression.suppressed(addresses)
+        if suppressed:
+            for position, address in enumerate(addresses):
+                if address in suppressed:
+                    keep[position] = False
+                    suppressed_count += 1
+
+    duplicate_count = 0
+    if dedupe is not None:
+        # Suppressed rows are dropped already and do not claim the address
+        flags = dedupe.first_seen(address for address, kept in zip(addresses, keep) if kept)
+        kept_positions = [position for position, kept in enumerate(keep) if kept]
+        for position, first in zip(kept_positions, flags):
+            if not first:
+                keep[position] = False
+                duplicate_count += 1
+
+    if suppressed_count or duplicate_count:
+        df = df[keep]
+    return df, suppressed_count, duplicate_count
+
+
+_suppression_list = None
+_suppression_lock = threading.Lock()
+
+
+def get_suppression_list():
+    """Return the process-wide suppression list, opening it on first use"""
+    global _suppression_list
+    with _suppression_lock:
+        if _suppression_list is None:
+            _suppression_list = SuppressionList(SUPPRESSION_DB_PATH)
+        return _suppression_list
@@ -1,7 +1,13 @@
 import base64
 import logging
-from src.config.settings import REQUIRED_PLACEHOLDERS
+import re
+from functools import lru_cache
+from src.config.settings import REQUIRED_PLACEHOLDERS, DEFAULT_PLACEHOLDER_MAPPING
+from src.utils.upload_cache import upload_cache
+from src.utils.upload_store import resolve_upload
+from src.utils.metrics import timed
 
+@timed('parse_template')
 def parse_template(contents):
     """Parse uploaded template file"""
     # Check if contents are provided
@@ -10,26 +16,30 @@ def parse_template(contents):
         return None
         
     try:
-        # Decode the template file content
-        content_type, content_string = contents.split(',')
-        decoded = base64.b64decode(content_string)
-        template = decoded.decode('utf-8')
-        
-        # Check if template is empty
-        if not template.strip():
-            logging.error("Template file is empty")
-            return None
-            
-        # Validate the template's placeholders
-        if not validate_template(template):
-            return None
-            
-        return template
+        return upload_cache.get_or_load('template', contents, decode_template)
         
     except Exception as e:
         logging.error(f"Error parsing template file: {str(e)}")
         return None
 
+def decode_template(contents):
+    """Decode and validate an uploaded template"""
+    # Decode the template file content
+    content_type, content_string = resolve_upload(contents).split(',')
+    decoded = base64.b64decode(content_string)
+    template = decoded.decode('utf-8')
+    
+    # Check if template is empty
+    if not template.strip():
+        logging.error("Template file is empty")
+        return None
+        
+    # Validate the template's placeholders
+    if not validate_template(template):
+        return None
+        
+    return template
+
 def validate_template(template):
     """Validate template contents"""
     # Ensure all required placeholders are present
@@ -37,3 +47,102 @@ def validate_template(template):
         logging.error("Template missing required placeholders")
         return False
     return True
+
+# Explicit placeholder syntax: {{X}} or {{Column Name}}
+PLACEHOLDER_PATTERN = re.compile(r'\{\{\s*([^{}]+?)\s*\}\}')
+
+# Header the preview pane puts above each message
+PREVIEW_HEADER_PATTERN = re.compile(r'^Preview \d+ of \d+\n\n')
+
+def strip_preview_header(text):
+    """Remove the "Preview i of n" header added by the preview pane"""
+    return PREVIEW_HEADER_PATTERN.sub('', text, count=1)
+
+class CompiledTemplate:
+    """A template parsed once into literal and slot segments.
+
+    Literals are stored as a str.format string with positional fields, so rendering
+    a row is a single pass in C and substituted values are never re-scanned.
+    """
+    __slots__ = ('source', 'columns', 'format_string')
+
+    def __init__(self, source, columns, format_string):
+        self.source = source
+        self.columns = columns
+        self.format_string = format_string
+
+    def render(self, values):
+        """Render one recipient from a mapping (dict, Series) of column values"""
+        return self.format_string.format(*[str(values[col]) for col in self.columns])
+
+    def render_frame(self, df):
+        """Render every row of a DataFrame, stringifying each slot column once"""
+        if not self.columns:
+            return [self.format_string.format()] * len(df)
+        column_values = [df[col].astype(str).tolist() for col in self.columns]
+        format_string = self.format_string
+        return [format_string.format(*values) for values in zip(*column_values)]
+
+    def render_store(self, store):
+        """Render every recipient of a RecipientStore from its pre-stringified columns"""
+        if not self.columns:
+            return [self.format_string.format()] * len(store)
+        format_string = self.format_string
+        return [format_string.format(*values) for values in zip(*(store.column(col) for col in self.columns))]
+
+def placeholder_mapping(saved=None):
+    """The column -> placeholder mapping to render with: the mapping saved in the
+    column mapping section over DEFAULT_PLACEHOLDER_MAPPING. A placeholder the user
+    assigned to a column is no longer filled from its default column."""
+    saved = {col: placeholder for col, placeholder in (saved or {}).items() if placeholder}
+    taken = set(saved.values())
+    defaults = {col: placeholder for col, placeholder in DEFAULT_PLACEHOLDER_MAPPING.items()
+                if placeholder not in taken}
+    return {**defaults, **saved}
+
+def compile_template(template, placeholder_settings=None, columns=None):
+    """Compile a template against a column -> placeholder mapping.
+
+    Placeholders are written as {{X}} where X is a mapped placeholder or a column name.
+    Templates without any {{...}} fall back to matching the mapped placeholders as
+    whole words, so legacy single-letter placeholders keep working without touching
+    ordinary words that merely contain the letter.
+    """
+    mapping = tuple(sorted((str(col), str(placeholder))
+                           for col, placeholder in (placeholder_settings or {}).items()
+                           if placeholder))
+    return _compile_template(template, mapping, tuple(columns) if columns is not None else None)
+
+@lru_cache(maxsize=256)
+def _compile_template(template, mapping, columns):
+    lookup = {placeholder: col for col, placeholder in mapping}
+    if columns is not None:
+        available = {str(col): col for col in columns}
+        lookup = {placeholder: available[col] for placeholder, col in lookup.items() if col in available}
+    
+    if PLACEHOLDER_PATTERN.search(template):
+        pattern = PLACEHOLDER_PATTERN
+        # Delimited placeholders may also name a column directly
+        if columns is not None:
+            lookup = {**available, **lookup}
+    elif lookup:
+        alternatives = '|'.join(re.escape(p) for p in sorted(lookup, key=len, reverse=True))
+        pattern = re.compile(rf'(?<!\w)({alternatives})(?!\w)')
+    else:
+        return CompiledTemplate(template, (), template.replace('{', '{{').replace('}', '}}'))
+    
+    slot_columns = []
+    parts = []
+    position = 0
+    for match in pattern.finditer(template):
+        column = lookup.get(match.group(1))
+        if column is None:
+            # Unknown placeholders are left in the text as written
+            continue
+        parts.append(template[position:match.start()].replace('{', '{{').replace('}', '}}'))
+        parts.append('{}')
+        slot_columns.append(column)
+        position = match.end()
+    parts.append(template[position:].replace('{', '{{').replace('}', '}}'))
+    
+    return CompiledTemplate(template, tuple(slot_columns), ''.join(parts))
@@ -0,0 +1,78 @@
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from src.config.settings import UPLOAD_CACHE_MAX_BYTES
+from src.utils.upload_store import is_upload_id, upload_id_for
+
+
+def content_key(kind, contents):
+    """Key an upload (data URL or stored upload id) by its kind and content hash"""
+    upload_id = contents if is_upload_id(contents) else upload_id_for(contents)
+    return f"{kind}:{upload_id}"
+
+
+def estimate_size(value):
+    """Approximate the memory held by a cached value in bytes"""
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(deep=True).sum())
+    return sys.getsizeof(value)
+
+
+class UploadCache:
+    """Size-bounded LRU cache of parsed uploads keyed by content hash"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            logging.info(f"Upload too large to cache ({size} bytes)")
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            # Evict least recently used entries until we fit the budget
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def get_or_load(self, kind, contents, loader):
+        """Return the cached parse of `contents`, calling `loader(contents)` on a miss.
+
+        `contents` may be a data URL or a stored upload id; ids are only read from
+        disk when the cache misses.
+        """
+        key = content_key(kind, contents)
+        value = self.get(key)
+        if value is None:
+            value = loader(contents)
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+upload_cache = UploadCache(UPLOAD_CACHE_MAX_BYTES)
@@ -0,0 +1,179 @@
+import base64
+import csv
+import io
+import logging
+import time
+from contextlib import ExitStack
+from src.utils.excel_parser import UploadSheets
+from src.utils.recipient_store import find_email_column
+
+
+def normalize_column(name):
+    return '' if name is None else str(name).strip().lower()
+
+
+def join_value(value):
+    """Normalize a key cell so that 12, 12.0, '12 ' and 'ACME'/'acme' match"""
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip().lower() or None
+
+
+class HashIndex:
+    """One lookup sheet keyed by its join column, built in a single pass.
+
+    Each key maps to the values of the sheet's other columns; when a key repeats,
+    the first row wins, so a join never multiplies recipients.
+    """
+
+    def __init__(self, label, header, key):
+        self.label = label
+        self.key = key
+        self.key_position = [normalize_column(col) for col in header].index(normalize_column(key))
+        self.value_positions = [position for position, col in enumerate(header)
+                                if col is not None and position != self.key_position]
+        self.columns = [header[position] for position in self.value_positions]
+        self.rows = {}
+        self.duplicates = 0
+        self.matched = 0
+        self.unmatched = 0
+
+    def build(self, rows):
+        key_position = self.key_position
+        value_positions = self.value_positions
+        width = max(value_positions, default=key_position) + 1
+        entries = self.rows
+        for row in rows:
+            if len(row) < width:
+                row = tuple(row) + (None,) * (width - len(row))
+            key = join_value(row[key_position])
+            if key is None:
+                continue
+            if key in entries:
+                self.duplicates += 1
+                continue
+            entries[key] = tuple(row[position] for position in value_positions)
+        return self
+
+    def lookup(self, value):
+        """Values for a key cell, or a row of blanks when nothing matches"""
+        values = self.rows.get(join_value(value))
+        if values is None:
+            self.unmatched += 1
+            return (None,) * len(self.columns)
+        self.matched += 1
+        return values
+
+
+def choose_key(header, columns, join_key=None):
+    """The column a lookup sheet joins on: `join_key`, else the one column its header
+    shares with the columns joined so far; None if there is none. Raises ValueError
+    when it shares several and no `join_key` says which."""
+    available = {normalize_column(col) for col in columns if col is not None}
+    names = [col for col in header if col is not None]
+    if join_key:
+        wanted = normalize_column(join_key)
+        return next((col for col in names if normalize_column(col) == wanted and wanted in available), None)
+    shared = [col for col in names if normalize_column(col) in available]
+    if len(shared) > 1:
+        raise ValueError(f"shares the columns {', '.join(repr(col) for col in shared)}; "
+                         f"enter a join key to choose one")
+    return shared[0] if shared else None
+
+
+def sheet_label(filename, title):
+    return filename if title == filename else f"'{title}' in {filename}"
+
+
+def merge_uploads(uploads, join_key=None):
+    """Join the sheets of one or more uploads into a single recipient table.
+
+    `uploads` are (filename, contents) pairs. The active sheet of the first upload
+    lists the recipients; every other non-empty sheet is indexed on its join column
+    (`join_key`, or the one column it shares with the columns joined so far) and
+    its remaining columns are added to each recipient row. A sheet may join on a
+    column another sheet added; sheets without a join column (notes, a readme) are
+    skipped and listed in the report. Lookup sheets are read once into a HashIndex
+    and the recipient sheet is streamed once, so the join costs one pass per side.
+
+    Returns (CSV data URL, report); raises ValueError when the recipient sheet has
+    no email column or a sheet shares several columns and no `join_key` is given.
+    """
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        tables = []
+        primary = None
+        for filename, contents in uploads:
+            workbook = stack.enter_context(UploadSheets(contents, filename))
+            for title, rows in workbook.sheets:
+                header = next(rows, None)
+                table = (sheet_label(filename, title), list(header or ()), rows)
+                if primary is None and title == workbook.active:
+                    primary = table
+                elif header is not None:
+                    tables.append(table)
+
+        label, columns, recipient_rows = primary
+        if find_email_column(columns) is None:
+            raise ValueError(f"The recipient sheet {label} (the active sheet of the first upload) "
+                             f"has no email column")
+        width = len(columns)
+        columns = list(columns)
+
+        # Index every lookup sheet whose join column is available, until none is left
+        lookups = tables
+        joins = []
+        while lookups:
+            for table in lookups:
+                try:
+                    key = choose_key(table[1], columns, join_key)
+                except ValueError as e:
+                    raise ValueError(f"Cannot join {table[0]}: it {e}") from None
+                if key is not None:
+                    break
+            else:
+                break
+            lookups.remove(table)
+            lookup_label, header, rows = table
+            index = HashIndex(lookup_label, header, key).build(rows)
+            source = [normalize_column(col) for col in columns].index(normalize_column(key))
+            # Columns already present keep their name; the joined copy is labelled
+            existing = {normalize_column(col) for col in columns if col is not None}
+            columns.extend(col if normalize_column(col) not in existing else f"{col} ({lookup_label})"
+                           for col in index.columns)
+            joins.append((source, index))
+
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['' if col is None else col for col in columns])
+        count = 0
+        for row in recipient_rows:
+            values = list(row[:width])
+            if len(values) < width:
+                values.extend([None] * (width - len(values)))
+            for source, index in joins:
+                values.extend(index.lookup(values[source]))
+            writer.writerow(['' if value is None else value for value in values])
+            count += 1
+
+    reason = f"has no '{join_key}' column to join on" if join_key else "shares no column with the recipients"
+    skipped = [f"{table[0]} {reason}" for table in lookups]
+    for reason in skipped:
+        logging.warning(f"Skipped {reason}")
+    report = {
+        'rows': count,
+        'recipients': label,
+        'skipped': skipped,
+        'joins': [{'sheet': index.label, 'key': index.key, 'matched': index.matched,
+                   'unmatched': index.unmatched, 'duplicate_keys': index.duplicates}
+                  for _, index in joins],
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+    for join in report['joins']:
+        logging.info(f"Joined {join['sheet']} on '{join['key']}': {join['matched']} matched, "
+                     f"{join['unmatched']} unmatched, {join['duplicate_keys']} duplicate keys ignored")
+    logging.info(f"Merged {len(joins) + 1} sheets into {count} recipients in {report['seconds']}s")
+    data = base64.b64encode(output.getvalue().encode('utf-8')).decode('ascii')
+    return f"data:text/csv;base64,{data}", report
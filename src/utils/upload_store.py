@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from src.config.settings import UPLOAD_STORE_DIR, UPLOAD_TTL_SECONDS
+
+UPLOAD_ID_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+
+
+def upload_id_for(contents):
+    """Short content-addressed id for an upload data URL"""
+    return hashlib.sha256(contents.encode('utf-8')).hexdigest()[:16]
+
+
+def is_upload_id(ref):
+    return isinstance(ref, str) and bool(UPLOAD_ID_PATTERN.match(ref))
+
+
+class UploadStore:
+    """Spool uploads to disk once and hand out short ids, evicting them after a TTL"""
+
+    def __init__(self, directory, ttl=UPLOAD_TTL_SECONDS):
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _path(self, upload_id):
+        return os.path.join(self.directory, f"{upload_id}.upload")
+
+    def save(self, contents):
+        """Persist a dcc.Upload data URL and return its id"""
+        os.makedirs(self.directory, exist_ok=True)
+        upload_id = upload_id_for(contents)
+        path = self._path(upload_id)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            # Write to a temporary name first so readers never see a partial file
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(contents)
+            os.replace(temp_path, path)
+        self.prune()
+        return upload_id
+
+    def load(self, upload_id):
+        """Return the stored data URL, or None if it is unknown or expired"""
+        path = self._path(upload_id)
+        try:
+            with open(path, encoding='utf-8') as f:
+                contents = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return contents
+
+    def touch(self, upload_id):
+        """Mark an upload as used so it outlives the TTL, returning False if it is gone"""
+        try:
+            os.utime(self._path(upload_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def prune(self):
+        """Delete uploads not used within the TTL"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            try:
+                names = os.listdir(self.directory)
+            except FileNotFoundError:
+                return
+            for name in names:
+                if not name.endswith('.upload'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+class EditStore:
+    """Per-session edited previews, kept in SQLite next to the uploads.
+
+    Edits are keyed by the upload they were made against (`upload_key`) as well as
+    the row index, so a new file in the same session never picks up another file's
+    rendered text for the same row.
+    """
+
+    def __init__(self, path, ttl=UPLOAD_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS edits (session_id TEXT NOT NULL, upload_key TEXT NOT NULL, "
+                "row_index INTEGER NOT NULL, content TEXT NOT NULL, updated_at REAL NOT NULL, "
+                "PRIMARY KEY (session_id, upload_key, row_index))"
+            )
+        return self._conn
+
+    def set_many(self, session_id, upload_key, edits):
+        """Save several {row_index: content} edits to one upload in one transaction"""
+        if not edits:
+            return
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute('BEGIN')
+                conn.executemany(
+                    "INSERT OR REPLACE INTO edits (session_id, upload_key, row_index, content, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(session_id, upload_key, int(index), content, now) for index, content in edits.items()]
+                )
+                conn.execute("DELETE FROM edits WHERE updated_at < ?", (now - self.ttl,))
+
+    def all(self, session_id, upload_key):
+        """Return a session's edits to one upload as {str(row_index): content}, the
+        shape the sender expects"""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT row_index, content FROM edits WHERE session_id = ? AND upload_key = ?",
+                (session_id, upload_key)
+            ).fetchall()
+        return {str(index): content for index, content in rows}
+
+
+upload_store = UploadStore(UPLOAD_STORE_DIR)
+edit_store = EditStore(os.path.join(UPLOAD_STORE_DIR, 'edits.db'))
+
+
+def resolve_upload(ref):
+    """Return the data URL for an upload reference (a data URL or a stored upload id)"""
+    if not is_upload_id(ref):
+        return ref
+    contents = upload_store.load(ref)
+    if contents is None:
+        logging.error(f"Upload {ref} is unknown or has expired")
+        raise KeyError(f"Upload {ref} has expired, please upload the file again")
+    return contents